@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -25,6 +26,8 @@ SECRET_KEY = 'a-u2$pbn$&q!o=2l(r-5%a_$=+29n@r+rex42n7*aod9afib$m'
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+TESTING = sys.argv[1:2] == ['test']
+
 ALLOWED_HOSTS = []
 
 
@@ -45,6 +48,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.QueryInspectorMiddleware',
+    'core.middleware.ProfilingMiddleware',
+    'core.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -97,6 +104,86 @@ DATABASES = {
 }
 
 
+# Cache holding the per-user recipe indexes and the throttling token buckets, swap for a shared backend
+# (memcached, redis) with multiple workers, throttling warns (core.W001) while it runs on a process local one
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+# Per endpoint latency, query and response size metrics, exposed in prometheus format at /metrics/
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED') == '1'
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')  # scrapers allowed to read /metrics/
+METRICS_NAMESPACES = ('recipe', 'user')  # url namespaces of the instrumented API routes
+
+
+# API calls multiplexed through /api/batch/. Batches of reads run on up to MAX_WORKERS threads, each opening its own
+# database connection, so raise it only where connections are cheap (e.g. behind pgbouncer)
+BATCH_REQUESTS = {
+    'MAX_REQUESTS': 20,
+    'MAX_WORKERS': int(os.environ.get('BATCH_MAX_WORKERS', 1)),
+    'NAMESPACES': ('recipe', 'user'),  # url namespaces batched calls may reach
+}
+
+
+REST_FRAMEWORK = {
+    'DEFAULT_THROTTLE_CLASSES': ('core.throttling.TokenBucketThrottle',),
+}
+
+# Token buckets of the API per user, or per address for anonymous clients, kept in the default cache which has
+# to be shared between the workers
+THROTTLING = {
+    'ENABLED': os.environ.get('THROTTLING_ENABLED', '0' if DEBUG else '1') == '1',
+    'BUCKETS': {  # scope -> (capacity, tokens refilled per second)
+        'read': (120, 10),
+        'write': (30, 1),
+        'upload': (20, 0.2),  # image uploads, chunked ones are charged once when started
+        'token': (5, 5 / 60),  # token issuance and sign up, per address
+    },
+}
+
+
+# Server-sent change events at /api/recipe/events/. Every open stream holds a worker thread, so run the app with
+# threaded workers (e.g. gunicorn --threads) and keep streams short, clients reconnect with Last-Event-ID
+EVENTS = {
+    'BACKEND': 'core.pubsub.LocalBroker',  # in-process only, plug in a broker backed by a shared server
+    'QUEUE_SIZE': 100,  # events buffered per stream before its client is told to resync
+    'KEEPALIVE': 15,  # seconds between comments keeping idle connections open
+    'MAX_STREAM_SECONDS': 300,
+    'RETRY_MS': 3000,  # reconnection delay suggested to clients
+    'REPLAY_LIMIT': 100,  # missed changes replayed on reconnect, more ask the client to use delta sync
+}
+
+
+# N+1 and slow query detection for development and staging, never enable in production
+QUERY_INSPECTOR = {
+    'ENABLED': os.environ.get('QUERY_INSPECTOR_ENABLED', '1' if DEBUG and not TESTING else '0') == '1',
+    'SAMPLE_RATE': float(os.environ.get('QUERY_INSPECTOR_SAMPLE_RATE', 1.0)),  # fraction of inspected requests
+    'SLOW_QUERY_MS': 100,
+    'REPEAT_THRESHOLD': 3,  # executions of the same query shape within a request flagged as N+1
+    'REPORT_DIR': os.environ.get('QUERY_INSPECTOR_REPORT_DIR'),  # JSON report per flagged request if set
+    'VIEWS': ('recipe.views.RecipeViewSet', 'recipe.views.BaseRecipeAttrViewSet'),
+}
+
+
+# Sampling profiler for the recipe and user views, writes collapsed stacks (flamegraph.pl, speedscope) to OUTPUT_DIR.
+# Requests carrying a header signed by `manage.py profile_token` are always profiled.
+PROFILING = {
+    'ENABLED': os.environ.get('PROFILING_ENABLED') == '1',
+    'SAMPLE_RATE': float(os.environ.get('PROFILING_SAMPLE_RATE', 0.01)),
+    'ENDPOINTS': {},  # url name -> sample rate overriding SAMPLE_RATE, e.g. {'recipe:recipe-list': 0.1}
+    'INTERVAL': 0.005,  # seconds between stack samples
+    'OUTPUT_DIR': os.environ.get('PROFILING_OUTPUT_DIR', '/vol/web/profiles'),
+    'HEADER': 'X-Profile',
+    'HEADER_MAX_AGE': 300,  # seconds a signed profiling header stays valid
+    'VIEW_MODULES': ('recipe.views', 'user.views'),
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -143,5 +230,33 @@ MEDIA_URL = '/media/'  # user uploaded files
 MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
+# Recipe images are served by core.views.media after checking access. Set BACKEND to hand the transfer off to the
+# web server: 'x-sendfile' (apache mod_xsendfile, lighttpd) or 'x-accel-redirect' (nginx internal location)
+MEDIA_SERVING = {
+    'BACKEND': os.environ.get('MEDIA_SERVING_BACKEND') or None,
+    'ACCEL_REDIRECT_PREFIX': '/protected-media/',  # internal nginx location aliasing MEDIA_ROOT
+    'IMMUTABLE_MAX_AGE': 365 * 24 * 60 * 60,  # seconds public content addressed images are cached
+}
+
+# Response compression by core.middleware.CompressionMiddleware, brotli is used when the package is installed.
+# LEVELS maps encodings to (max body size in bytes, level) pairs, streaming responses get the last level
+COMPRESSION = {
+    'ENABLED': os.environ.get('COMPRESSION_ENABLED', '1') == '1',
+    'MIN_SIZE': 1024,  # bytes, smaller bodies barely shrink
+    'LEVELS': {
+        'gzip': ((64 * 1024, 6), (1024 * 1024, 4), (None, 1)),
+        'br': ((64 * 1024, 5), (1024 * 1024, 4), (None, 1)),
+    },
+    'SKIP_CONTENT_TYPES': ('image/', 'video/', 'audio/', 'application/zip', 'application/gzip', 'text/event-stream'),
+    'SKIP_PATH_PREFIXES': (MEDIA_URL,),  # recipe images are compressed already
+}
+
+# Resumable chunked recipe image uploads, see RecipeViewSet.start_upload
+IMAGE_UPLOADS = {
+    'MAX_SIZE': 20 * 1024 * 1024,  # bytes
+    'MAX_CHUNK_SIZE': 5 * 1024 * 1024,
+    'EXPIRE_HOURS': 24,  # unfinished uploads are removed by gc_images after this
+}
+
 # set the custom user model
 AUTH_USER_MODEL = 'core.User'
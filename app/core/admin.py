@@ -1,10 +1,71 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import IGNORED_PARAMS, PAGE_VAR
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.contrib.auth.forms import AdminPasswordChangeForm as BaseAdminPasswordChangeForm
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from django.utils.translation import gettext as _
 from core import models
 
 
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator taking the row count of a whole table from the PostgreSQL planner statistics instead of a COUNT(*)
+    scanning it, once the table is past estimate_threshold rows. Counts are exact on other databases and when
+    estimate is not set, which the admin does for searched and filtered changelists.
+    """
+    estimate_threshold = 10000
+
+    def __init__(self, *args, estimate=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.estimate = estimate
+
+    def _estimated_count(self):
+        connection = connections[self.object_list.db]
+        if connection.vendor != 'postgresql':
+            return None
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                           [self.object_list.model._meta.db_table])
+            row = cursor.fetchone()
+        # reltuples is 0 or -1 for tables never analyzed
+        return int(row[0]) if row and row[0] >= self.estimate_threshold else None
+
+    @cached_property
+    def count(self):
+        estimated = self._estimated_count() if self.estimate else None
+        return estimated if estimated is not None else super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist of a big table, paginated without counting its rows, search fields should be indexed"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # would count the whole table on every searched or filtered page
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    ordering = ('-id',)
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        filtered = any(value for param, value in request.GET.items() if param not in IGNORED_PARAMS + (PAGE_VAR,))
+        searched = bool(request.GET.get('q'))
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page,
+                              estimate=not (filtered or searched))
+
+
+class AdminPasswordChangeForm(BaseAdminPasswordChangeForm):
+
+    def save(self, commit=True):
+        """Save the new password only, see User.change_seq"""
+        self.user.set_password(self.cleaned_data['password1'])
+        if commit:
+            self.user.save(update_fields=['password'])
+        return self.user
+
+
 class UserAdmin(BaseUserAdmin):
+    change_password_form = AdminPasswordChangeForm
     ordering = ['id']
     list_display = ['email', 'name']
     fieldsets = (
@@ -20,8 +81,36 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
 
+    def save_model(self, request, obj, form, change):
+        """Save the edited fields of an existing user only, see User.change_seq"""
+        if change:
+            concrete = {field.name for field in obj._meta.concrete_fields}
+            obj.save(update_fields=[name for name in form.changed_data if name in concrete])
+        else:
+            super().save_model(request, obj, form, change)
+
 
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Tag)  # no need to specify admin second param, it falls back to default one
-admin.site.register(models.Ingredient)
-admin.site.register(models.Recipe)
+
+
+class TagAdmin(LargeTableAdmin):
+    list_display = ['name', 'user']
+    search_fields = ['^name']  # prefix search, backed by the upper(name) index on PostgreSQL
+
+
+class IngredientAdmin(LargeTableAdmin):
+    list_display = ['name', 'user']
+    search_fields = ['^name']
+
+
+class RecipeAdmin(LargeTableAdmin):
+    list_display = ['title', 'user', 'visibility', 'updated_at']
+    search_fields = ['^title']
+    # the default widgets would render the tags and ingredients of every user
+    autocomplete_fields = ['tags', 'ingredients']
+    readonly_fields = ['version', 'updated_at']
+
+
+admin.site.register(models.Tag, TagAdmin)
+admin.site.register(models.Ingredient, IngredientAdmin)
+admin.site.register(models.Recipe, RecipeAdmin)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        """Register the system checks of the deployment settings"""
+        from core import checks  # noqa: F401
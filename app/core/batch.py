@@ -0,0 +1,110 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.urls import Resolver404, resolve
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+logger = logging.getLogger('core.batch')
+
+FORWARDED_HEADERS = ('ETag', 'Location', 'Cache-Control', 'Retry-After')
+
+
+class SubRequestSerializer(serializers.Serializer):
+    """Serializer for one API call of a batch"""
+    method = serializers.ChoiceField(choices=('GET', 'HEAD', 'OPTIONS', 'POST', 'PUT', 'PATCH', 'DELETE'))
+    path = serializers.CharField()
+    headers = serializers.DictField(child=serializers.CharField(), required=False)
+    body = serializers.JSONField(required=False)
+
+
+class BatchSerializer(serializers.Serializer):
+    """Serializer for the API calls multiplexed into one batch request"""
+    requests = serializers.ListField(child=SubRequestSerializer(), min_length=1)
+
+    def validate_requests(self, value):
+        if len(value) > settings.BATCH_REQUESTS['MAX_REQUESTS']:
+            raise serializers.ValidationError(
+                f'A batch is limited to {settings.BATCH_REQUESTS["MAX_REQUESTS"]} requests')
+
+        return value
+
+
+def _sub_request(request, call, path, query):
+    """Build the request of one call from the batch request, authenticated as the batch request already is"""
+    content = json.dumps(call['body']).encode() if 'body' in call else b''
+    environ = dict(request.META)
+    environ.update({
+        'REQUEST_METHOD': call['method'],
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(content)),
+        'wsgi.input': BytesIO(content),
+    })
+    for header, value in call.get('headers', {}).items():
+        if header.lower() != 'authorization':
+            environ['HTTP_' + header.upper().replace('-', '_')] = value
+
+    sub_request = WSGIRequest(environ)
+    # read by rest_framework.request.Request, the views skip their authentication classes for forced users
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    return sub_request
+
+
+def dispatch(request, call):
+    """Run one call of a batch through its API view, returning its status, headers and body"""
+    url = urlsplit(call['path'])
+    try:
+        match = resolve(url.path)
+    except Resolver404:
+        match = None
+    if match is None or match.namespace not in settings.BATCH_REQUESTS['NAMESPACES']:
+        return {'status': 404, 'headers': {}, 'body': {'detail': 'Not found.'}}
+
+    try:
+        response = match.func(_sub_request(request, call, url.path, url.query), *match.args, **match.kwargs)
+        # event streams never end and nothing streamed fits into a batch response. The stream is dropped unread,
+        # response.close() would send request_finished and close the database connection of the batch
+        if response.streaming:
+            return {'status': 400, 'headers': {}, 'body': {'detail': 'Streaming responses can not be batched.'}}
+        if hasattr(response, 'render'):
+            response.render()
+        return {
+            'status': response.status_code,
+            'headers': {header: response[header] for header in FORWARDED_HEADERS if response.has_header(header)},
+            'body': response.data if hasattr(response, 'data') else response.content.decode() or None,
+        }
+    except Exception:  # one failing call must not fail the calls batched with it
+        logger.exception('Batched %s %s failed', call['method'], call['path'])
+        return {'status': 500, 'headers': {}, 'body': {'detail': 'Internal server error.'}}
+
+
+def _dispatch_in_thread(request, call):
+    """Dispatch a call on a pool thread, closing the database connection the thread opened"""
+    try:
+        return dispatch(request, call)
+    finally:
+        connections.close_all()
+
+
+def dispatch_all(request, calls):
+    """
+    Dispatch the calls of a batch in order. Batches of reads only run concurrently on up to
+    BATCH_REQUESTS['MAX_WORKERS'] threads, each with its own database connection.
+    """
+    workers = min(settings.BATCH_REQUESTS['MAX_WORKERS'], len(calls))
+    if workers > 1 and all(call['method'] in SAFE_METHODS for call in calls):
+        with ThreadPoolExecutor(workers, thread_name_prefix='batch') as pool:
+            return list(pool.map(partial(_dispatch_in_thread, request), calls))
+
+    return [dispatch(request, call) for call in calls]
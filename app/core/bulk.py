@@ -0,0 +1,16 @@
+from django.db.models import Case, Value, When
+
+
+def update_values(queryset, key, field, values, batch_size=500, **fields):
+    """
+    Set field to a different value per row in one UPDATE per batch_size rows, values maps key values to new ones.
+    Further fields passed as keyword arguments are set to the same value on every updated row.
+    Stands in for QuerySet.bulk_update, which Django only ships from 2.2 on.
+    """
+    output_field = queryset.model._meta.get_field(field)
+    items = list(values.items())
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        queryset.filter(**{f'{key}__in': [pk for pk, _ in batch]}).update(**fields, **{
+            field: Case(*[When(**{key: pk}, then=Value(value)) for pk, value in batch], output_field=output_field)
+        })
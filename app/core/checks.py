@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# cache backends keeping their values in the process, every worker would throttle with buckets of its own
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_throttling_cache(app_configs, **kwargs):
+    """Warn when the token buckets of core.throttling live in a cache the workers do not share"""
+    if not settings.THROTTLING['ENABLED'] or settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES:
+        return []
+
+    return [Warning(
+        'Throttling keeps its token buckets in a process local cache, each worker allows the full rate.',
+        hint='Point CACHES["default"] at a shared backend like memcached or redis, or disable THROTTLING.',
+        id='core.W001',
+    )]
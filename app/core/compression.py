@@ -0,0 +1,74 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional, responses are gzipped only without it
+    brotli = None
+
+
+class GzipEncoder:
+    name = 'gzip'
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """Return the pending output so the client can decode everything compressed so far"""
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    name = 'br'
+
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        """Return the pending output so the client can decode everything compressed so far"""
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+# in order of preference when a client accepts several equally
+ENCODERS = {'br': BrotliEncoder, 'gzip': GzipEncoder} if brotli is not None else {'gzip': GzipEncoder}
+
+
+def negotiate(accept_encoding):
+    """Return the name of the preferred encoding an Accept-Encoding header allows, None to send the response as is"""
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    wildcard = qualities.get('*', 0.0)
+    quality, name = max(((qualities.get(name, wildcard), name) for name in ENCODERS), key=lambda choice: choice[0])
+    return name if quality > 0 else None
+
+
+def compression_level(levels, size):
+    """
+    Return the level for a response of size bytes from (max size, level) pairs ordered by size, the last pair
+    having a max size of None. Streaming responses of unknown size get the last, cheapest level.
+    """
+    for max_size, level in levels:
+        if max_size is None or (size is not None and size <= max_size):
+            return level
@@ -0,0 +1,9 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class PreconditionFailed(APIException):
+    """The resource changed since the version the client sent in If-Match"""
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'The resource was modified, fetch the current version and retry.'
+    default_code = 'precondition_failed'
@@ -0,0 +1,174 @@
+import io
+import json
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.urls import reverse
+from PIL import Image
+from rest_framework.test import APIClient
+
+from core.management.commands.seed_benchmark_data import EMAIL_TEMPLATE
+from core.metrics import RequestMetrics
+from core.models import Recipe
+
+
+class _Rollback(Exception):
+    """Raised to roll back the writes of a benchmark scenario"""
+
+
+def _percentile(values, percent):
+    """Return the nearest-rank percentile of a list of values"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+def _jpeg():
+    """Return a small in-memory jpeg upload"""
+    image = io.BytesIO()
+    Image.new('RGB', (64, 64)).save(image, format='JPEG')
+    image.name = 'benchmark.jpg'
+    image.seek(0)
+    return image
+
+
+class Command(BaseCommand):
+    """django command to benchmark every API endpoint against the seeded benchmark data"""
+    help = 'Benchmark the API through the test client and compare against a stored baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--password', default='benchmark123')
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmark_baseline.json'))
+        parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='allowed relative p95 latency increase over the baseline')
+
+    def scenarios(self, user, password):
+        """Return (name, method, url, data factory, format, cleanup) of every benchmarked endpoint call"""
+        recipe = Recipe.objects.filter(user=user).order_by('id').first()
+        if recipe is None:
+            raise CommandError(f'{user.email} has no recipes, run seed_benchmark_data first')
+
+        tag_ids = list(recipe.tags.values_list('id', flat=True))
+        ingredient_ids = list(recipe.ingredients.values_list('id', flat=True))
+        filters = {
+            'tags': ','.join(map(str, tag_ids[:2])),
+            'ingredients': ','.join(map(str, ingredient_ids[:2])),
+            'max_price': 50,
+        }
+        new_recipe = {'title': 'benchmark', 'time_minutes': 10, 'price': 5, 'tags': tag_ids,
+                      'ingredients': ingredient_ids}
+
+        def delete_uploaded_image():
+            # the database write is rolled back but the file would stay on disk
+            Recipe.objects.get(id=recipe.id).image.delete(save=False)
+
+        list_url = reverse('recipe:recipe-list')
+        return (
+            ('recipe list', 'get', list_url, lambda: None, None, None),
+            ('recipe list filtered', 'get', list_url, lambda: filters, None, None),
+            ('recipe list page', 'get', list_url, lambda: {'page_size': 50}, None, None),
+            ('recipe feed', 'get', reverse('recipe:recipe-feed'), lambda: None, None, None),
+            ('recipe retrieve', 'get', reverse('recipe:recipe-detail', args=[recipe.id]), lambda: None, None, None),
+            ('recipe create', 'post', list_url, lambda: new_recipe, 'json', None),
+            ('recipe clone', 'post', reverse('recipe:recipe-clone', args=[recipe.id]), lambda: None, None, None),
+            ('recipe upload image', 'post', reverse('recipe:recipe-upload-image', args=[recipe.id]),
+             lambda: {'image': _jpeg()}, 'multipart', delete_uploaded_image),
+            ('tag list', 'get', reverse('recipe:tag-list'), lambda: None, None, None),
+            ('ingredient list', 'get', reverse('recipe:ingredient-list'), lambda: None, None, None),
+            ('user token', 'post', reverse('user:token'),
+             lambda: {'email': user.email, 'password': password}, None, None),
+        )
+
+    def run_scenario(self, client, method, url, data, format, cleanup, iterations):
+        """Call an endpoint repeatedly, returning the latencies and the highest query count"""
+        latencies, queries = [], 0
+        try:
+            # writes are rolled back so repeated runs see the same dataset
+            with transaction.atomic():
+                for _ in range(iterations):
+                    payload = data()
+                    request_metrics = RequestMetrics()
+                    with connection.execute_wrapper(request_metrics.execute_wrapper):
+                        start = time.perf_counter()
+                        res = getattr(client, method)(url, payload, format=format)
+                        latencies.append(time.perf_counter() - start)
+
+                    if res.status_code >= 400:
+                        raise CommandError(f'{method.upper()} {url} failed with {res.status_code}: {res.data}')
+                    queries = max(queries, request_metrics.queries)
+                    if cleanup is not None:
+                        cleanup()
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        return latencies, queries
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.filter(email=EMAIL_TEMPLATE.format(0)).first()
+        if user is None:
+            raise CommandError('No benchmark data found, run seed_benchmark_data first')
+
+        client = APIClient()
+        client.force_authenticate(user)
+
+        results = {}
+        for name, method, url, data, format, cleanup in self.scenarios(user, options['password']):
+            # token issuance is dominated by password hashing, a few samples are enough
+            iterations = options['iterations'] if name != 'user token' else max(1, options['iterations'] // 10)
+            with override_settings(ALLOWED_HOSTS=['testserver']):  # the host name used by the test client
+                latencies, queries = self.run_scenario(client, method, url, data, format, cleanup, iterations)
+            results[name] = {
+                'requests_per_second': round(len(latencies) / sum(latencies), 1),
+                'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+                'p95_ms': round(_percentile(latencies, 95) * 1000, 2),
+                'p99_ms': round(_percentile(latencies, 99) * 1000, 2),
+                'queries': queries,
+            }
+
+        self.report(results)
+        self.compare(results, options)
+
+    def report(self, results):
+        self.stdout.write(f'{"endpoint":<24}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"queries":>9}')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<24}{result["requests_per_second"]:>10}{result["p50_ms"]:>10}'
+                f'{result["p95_ms"]:>10}{result["p99_ms"]:>10}{result["queries"]:>9}'
+            )
+
+    def compare(self, results, options):
+        """Store the results as baseline or fail on regressions against the stored one"""
+        if options['save_baseline']:
+            with open(options['baseline'], 'w') as baseline_file:
+                json.dump(results, baseline_file, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f'Baseline saved to {options["baseline"]}'))
+            return
+
+        if not os.path.exists(options['baseline']):
+            self.stdout.write(self.style.WARNING('No baseline found, run with --save-baseline to create one'))
+            return
+
+        with open(options['baseline']) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = []
+        for name, result in results.items():
+            expected = baseline.get(name)
+            if expected is None:
+                continue
+            if result['queries'] > expected['queries']:
+                regressions.append(f'{name}: {result["queries"]} queries, baseline {expected["queries"]}')
+            if result['p95_ms'] > expected['p95_ms'] * (1 + options['tolerance']):
+                regressions.append(f'{name}: p95 {result["p95_ms"]}ms, baseline {expected["p95_ms"]}ms')
+
+        if regressions:
+            raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
@@ -0,0 +1,91 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import PARTIAL_UPLOAD_DIR, RECIPE_IMAGE_DIR, ImageUpload, Recipe, recipe_image_storage
+
+
+class Command(BaseCommand):
+    """django command to delete recipe image files no recipe refers to"""
+    help = 'Delete unreferenced recipe images, walking the upload directory and checking references in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--min-age-minutes', type=float, default=60,
+                            help='keep files younger than this, their recipe may not be committed yet')
+        parser.add_argument('--dry-run', action='store_true', help='only report the files that would be deleted')
+
+    def walk(self, directory):
+        """Yield the names of all files below directory, one directory listing at a time"""
+        directories, files = recipe_image_storage.listdir(directory)
+        for filename in files:
+            yield os.path.join(directory, filename)
+        for subdirectory in directories:
+            yield from self.walk(os.path.join(directory, subdirectory))
+
+    def collect(self, names, modified_before, dry_run):
+        """Delete the files among names that are old enough and not referenced, returning how many"""
+        unreferenced = set(names) - set(Recipe.all_objects.filter(image__in=names).values_list('image', flat=True))
+        return self.delete_old(unreferenced, modified_before, dry_run,
+                               unused=lambda name: not Recipe.all_objects.filter(image=name).exists())
+
+    def expire_uploads(self, modified_before, dry_run):
+        """
+        Delete chunked uploads abandoned for longer than IMAGE_UPLOADS["EXPIRE_HOURS"], and partial files
+        left behind by uploads deleted with their recipe. Returns how many partial files were deleted.
+        """
+        expired = ImageUpload.objects.filter(
+            created_at__lt=timezone.now() - timedelta(hours=settings.IMAGE_UPLOADS['EXPIRE_HOURS'])
+        )
+        if not dry_run:
+            expired.delete()
+
+        directory = PARTIAL_UPLOAD_DIR.rstrip('/')
+        if not recipe_image_storage.exists(directory):
+            return 0
+
+        live = {str(upload_id) for upload_id in ImageUpload.objects.values_list('id', flat=True)}
+        return self.delete_old([name for name in self.walk(directory) if os.path.basename(name) not in live],
+                               modified_before, dry_run)
+
+    def delete_old(self, names, modified_before, dry_run, unused=lambda name: True):
+        """
+        Delete the files among names last modified before modified_before, returning how many. Right before a
+        file is deleted unused(name) is checked again and its mtime is checked again by the storage, a recipe
+        saved with the same content since the batch was checked either refers to it or has touched it.
+        """
+        deleted = 0
+        for name in sorted(names):
+            if recipe_image_storage.get_modified_time(name) >= modified_before:
+                continue
+            if dry_run:
+                self.stdout.write(name)
+                deleted += 1
+            elif unused(name) and recipe_image_storage.delete_unmodified(name, modified_before):
+                deleted += 1
+
+        return deleted
+
+    def handle(self, *args, **options):
+        modified_before = timezone.now() - timedelta(minutes=options['min_age_minutes'])
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+
+        scanned = deleted = 0
+        directory = RECIPE_IMAGE_DIR.rstrip('/')
+        batch = []
+        for name in self.walk(directory) if recipe_image_storage.exists(directory) else ():
+            batch.append(name)
+            if len(batch) >= options['batch_size']:
+                deleted += self.collect(batch, modified_before, options['dry_run'])
+                scanned += len(batch)
+                batch = []
+        if batch:
+            deleted += self.collect(batch, modified_before, options['dry_run'])
+            scanned += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'{verb} {deleted} of {scanned} image files'))
+
+        partial = self.expire_uploads(modified_before, options['dry_run'])
+        self.stdout.write(self.style.SUCCESS(f'{verb} {partial} abandoned partial uploads'))
@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.profiling import sign_profile_request
+
+
+class Command(BaseCommand):
+    """django command to print a signed header value forcing a request to be profiled"""
+    help = 'Print a signed profiling header value, valid for PROFILING["HEADER_MAX_AGE"] seconds'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{settings.PROFILING["HEADER"]}: {sign_profile_request()}')
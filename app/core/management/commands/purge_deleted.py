@@ -0,0 +1,79 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import FeedEntry, ImageUpload, Ingredient, Recipe, Tag
+
+
+def raw_delete(queryset):
+    """
+    Delete rows with a single statement, skipping the collector that loads them and sends pre_ and post_delete.
+    The receivers have nothing left to do for purged rows: soft deletion already took recipes off the indexes, the feed
+    and delta sync, and a purged account takes its change log along. Dependent rows have to be deleted first.
+    """
+    queryset._raw_delete(queryset.db)
+
+
+class Command(BaseCommand):
+    """django command to hard delete soft deleted recipes and accounts in small batches"""
+    help = 'Delete soft deleted recipes and user accounts with their links and images, one short transaction per batch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--min-age-hours', type=float, default=0,
+                            help='only purge rows soft deleted at least this long ago')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='seconds to sleep between batches, leaves room for other transactions')
+
+    def batches(self, queryset, batch_size):
+        """Yield the ids of queryset batch by batch, each batch is expected to be deleted before the next"""
+        while True:
+            ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return
+            yield ids
+            time.sleep(self.pause)
+
+    def purge_recipes(self, queryset, batch_size):
+        """Delete recipes with their links, and their images once no other recipe refers to them"""
+        purged = 0
+        for ids in self.batches(queryset, batch_size):
+            with transaction.atomic():
+                images = list(Recipe.all_objects.filter(id__in=ids).values_list('image', flat=True))
+                for relation in ('tags', 'ingredients'):
+                    raw_delete(getattr(Recipe, relation).through.objects.filter(recipe_id__in=ids))
+                # partial files of the uploads are left to gc_images
+                for model in (FeedEntry, ImageUpload):
+                    raw_delete(model.objects.filter(recipe_id__in=ids))
+                raw_delete(Recipe.all_objects.filter(id__in=ids))
+
+            Recipe.release_images(images)  # only once the rows referring to them are gone for good
+            purged += len(ids)
+
+        return purged
+
+    def handle(self, *args, **options):
+        self.pause = options['pause']
+        batch_size = options['batch_size']
+        deleted_before = timezone.now() - timedelta(hours=options['min_age_hours'])
+
+        recipes = self.purge_recipes(Recipe.all_objects.filter(deleted_at__lte=deleted_before), batch_size)
+
+        users = get_user_model().all_objects.filter(deleted_at__lte=deleted_before)
+        user_ids = list(users.values_list('id', flat=True))
+        for user_id in user_ids:
+            recipes += self.purge_recipes(Recipe.all_objects.filter(user_id=user_id), batch_size)
+            for model, relation in ((Tag, 'tags'), (Ingredient, 'ingredients')):
+                through = getattr(Recipe, relation).through
+                for ids in self.batches(model.objects.filter(user_id=user_id), batch_size):
+                    with transaction.atomic():
+                        raw_delete(through.objects.filter(**{f'{model._meta.model_name}_id__in': ids}))
+                        raw_delete(model.objects.filter(id__in=ids))
+            # the change log cascades with a single delete, it has no receivers
+            get_user_model().all_objects.filter(id=user_id).delete()
+
+        self.stdout.write(self.style.SUCCESS(f'Purged {recipes} recipes and {len(user_ids)} users'))
@@ -0,0 +1,84 @@
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.models import Ingredient, Recipe, Tag
+
+EMAIL_TEMPLATE = 'benchmark-{}@example.com'
+
+
+def bulk_create(model, objs, batch_size):
+    """Insert objects in batches no larger than the database backend allows"""
+    batch_size = min(batch_size, connection.ops.bulk_batch_size(model._meta.concrete_fields, objs) or batch_size)
+    return model.objects.bulk_create(objs, batch_size=max(batch_size, 1))
+
+
+class Command(BaseCommand):
+    """django command to bulk generate a reproducible dataset for benchmarks"""
+    help = 'Generate benchmark users with recipes, tags and ingredients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5)
+        parser.add_argument('--recipes-per-user', type=int, default=1000)
+        parser.add_argument('--tags-per-user', type=int, default=20)
+        parser.add_argument('--ingredients-per-user', type=int, default=200)
+        parser.add_argument('--tags-per-recipe', type=int, default=3)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--password', default='benchmark123')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+
+        with transaction.atomic():
+            # start from a clean slate so the same seed always produces the same dataset
+            get_user_model().objects.filter(email__startswith='benchmark-', email__endswith='@example.com').delete()
+
+            password = make_password(options['password'])  # hashing once instead of per user saves minutes
+            users = bulk_create(get_user_model(), [
+                get_user_model()(email=EMAIL_TEMPLATE.format(i), name=f'Benchmark User {i}', password=password)
+                for i in range(options['users'])
+            ], batch_size)
+            users = list(get_user_model().objects.filter(email__in=[user.email for user in users]).order_by('id'))
+
+            bulk_create(Tag, [
+                Tag(user=user, name=f'tag {i}') for user in users for i in range(options['tags_per_user'])
+            ], batch_size)
+            bulk_create(Ingredient, [
+                Ingredient(user=user, name=f'ingredient {i}')
+                for user in users for i in range(options['ingredients_per_user'])
+            ], batch_size)
+            bulk_create(Recipe, [
+                Recipe(
+                    user=user,
+                    title=f'recipe {i}',
+                    time_minutes=rng.randint(5, 180),
+                    price=rng.randint(100, 9999) / 100,
+                )
+                for user in users for i in range(options['recipes_per_user'])
+            ], batch_size)
+
+            # ids are read back because not every backend returns them from bulk inserts
+            for relation, model, per_recipe in (('tags', Tag, 'tags_per_recipe'),
+                                                ('ingredients', Ingredient, 'ingredients_per_recipe')):
+                through = getattr(Recipe, relation).through
+                column = f'{model._meta.model_name}_id'
+                links = []
+                for user in users:
+                    ids = list(model.objects.filter(user=user).order_by('id').values_list('id', flat=True))
+                    recipe_ids = Recipe.objects.filter(user=user).order_by('id').values_list('id', flat=True)
+                    for recipe_id in recipe_ids:
+                        for pk in rng.sample(ids, min(options[per_recipe], len(ids))):
+                            links.append(through(recipe_id=recipe_id, **{column: pk}))
+
+                bulk_create(through, links, batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(users)} users with {options["recipes_per_user"]} recipes each '
+            f'(login {EMAIL_TEMPLATE.format(0)} / {options["password"]})'
+        ))
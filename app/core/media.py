@@ -0,0 +1,143 @@
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from core.models import RECIPE_IMAGE_DIR, recipe_image_storage
+
+CONTENT_ADDRESSED = re.compile(r'^[0-9a-f]{2}/([0-9a-f]{64})\.\w+$')
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class UnsatisfiableRange(Exception):
+    """The requested range starts past the end of the file"""
+
+
+def image_name(path):
+    """Return the storage name of a recipe image requested as path, None for anything outside the image directory"""
+    name = posixpath.normpath(path)
+    if name != path or not name.startswith(RECIPE_IMAGE_DIR):
+        return None  # rejects ../ traversal and partial uploads alike
+
+    return name
+
+
+def parse_range(header, size):
+    """
+    Return the first and last byte of a single byte range header, None to serve the whole file.
+    Multiple ranges are valid but rare for images, the whole file is served for them as allowed by RFC 7233.
+    """
+    match = BYTE_RANGE.match(header or '')
+    if not match or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+    if not first:  # suffix range, the last n bytes
+        if not int(last) or not size:
+            raise UnsatisfiableRange
+        return max(size - int(last), 0), size - 1
+
+    first, last = int(first), int(last) if last else size - 1
+    if first >= size:
+        raise UnsatisfiableRange
+    if last < first:
+        return None
+
+    return first, min(last, size - 1)
+
+
+class _FileRange:
+    """File-like view of a byte range of a file, read by FileResponse in blocks"""
+
+    def __init__(self, file, first, length):
+        self.file = file
+        self.file.seek(first)
+        self.remaining = length
+
+    def read(self, size):
+        data = self.file.read(min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _handoff(name, path, content_type):
+    """Return a response letting the web server send the file, None if Django has to send it"""
+    backend = settings.MEDIA_SERVING['BACKEND']
+    if backend is None:
+        return None
+
+    response = HttpResponse(content_type=content_type)
+    if backend == 'x-sendfile':
+        response['X-Sendfile'] = path
+    elif backend == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = settings.MEDIA_SERVING['ACCEL_REDIRECT_PREFIX'] + name
+    else:
+        raise ValueError(f'Unknown MEDIA_SERVING backend {backend!r}')
+
+    return response
+
+
+def _file_response(request, path, size, content_type, etag, last_modified):
+    """Stream the file or the byte range requested, ranges are ignored when If-Range no longer matches"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    byte_range = None
+    if if_range is None or if_range in (etag, http_date(last_modified)):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except UnsatisfiableRange:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        first, last = byte_range
+        response = FileResponse(_FileRange(open(path, 'rb'), first, last - first + 1), status=206,
+                                content_type=content_type)
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+        response['Content-Length'] = last - first + 1
+    response['Accept-Ranges'] = 'bytes'
+
+    return response
+
+
+def serve_image(request, name, public):
+    """
+    Respond with a recipe image the request was authorized to read, answering conditional requests with 304.
+    Content addressed names never change their content, public ones are cached for a year without revalidation.
+    """
+    path = recipe_image_storage.path(name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    relative = name[len(RECIPE_IMAGE_DIR):]
+    match = CONTENT_ADDRESSED.match(relative)
+    etag = quote_etag(match.group(1) if match else f'{int(stat.st_mtime)}-{stat.st_size}')
+    last_modified = int(stat.st_mtime)
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _handoff(name, path, content_type) or _file_response(
+            request, path, stat.st_size, content_type, etag, last_modified)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if public and match:
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_SERVING['IMMUTABLE_MAX_AGE'],
+                            immutable=True)
+    else:
+        patch_cache_control(response, no_cache=True, **{'public' if public else 'private': True})
+
+    return response
@@ -0,0 +1,139 @@
+import threading
+import time
+from bisect import bisect_left
+
+from rest_framework.serializers import BaseSerializer
+
+# upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_local = threading.local()
+
+
+class RequestMetrics:
+    """Measurements collected while a single request is handled"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """Database execute wrapper counting queries and the time spent in them"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+    def __enter__(self):
+        _local.metrics = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.metrics = None
+
+
+class _EndpointMetrics:
+    """Accumulated metrics of one endpoint"""
+
+    def __init__(self):
+        self.count = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # the last bucket is +Inf
+        self.latency = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.response_bytes = 0
+
+
+class MetricsRegistry:
+    """In-process registry of per endpoint metrics, every worker process exposes its own"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def observe(self, labels, duration, request_metrics, response_bytes):
+        """Record a handled request for the endpoint identified by labels (a tuple of label pairs)"""
+        with self._lock:
+            endpoint = self._endpoints.get(labels)
+            if endpoint is None:
+                endpoint = self._endpoints[labels] = _EndpointMetrics()
+
+            endpoint.count += 1
+            endpoint.buckets[bisect_left(LATENCY_BUCKETS, duration)] += 1
+            endpoint.latency += duration
+            endpoint.queries += request_metrics.queries
+            endpoint.db_time += request_metrics.db_time
+            endpoint.serializer_time += request_metrics.serializer_time
+            endpoint.response_bytes += response_bytes
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+    def render(self):
+        """Return all metrics in the prometheus text exposition format"""
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            counters = (
+                ('api_db_queries_total', 'counter', 'Database queries executed', 'queries'),
+                ('api_db_seconds_total', 'counter', 'Time spent in database queries', 'db_time'),
+                ('api_serializer_seconds_total', 'counter', 'Time spent serializing data', 'serializer_time'),
+                ('api_response_bytes_total', 'counter', 'Size of the response bodies', 'response_bytes'),
+            )
+
+            lines = [
+                '# HELP api_request_duration_seconds Request latency',
+                '# TYPE api_request_duration_seconds histogram',
+            ]
+            for labels, endpoint in endpoints:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), endpoint.buckets):
+                    cumulative += count
+                    lines.append(f'api_request_duration_seconds_bucket{_labels(labels, le=bound)} {cumulative}')
+                lines.append(f'api_request_duration_seconds_sum{_labels(labels)} {endpoint.latency}')
+                lines.append(f'api_request_duration_seconds_count{_labels(labels)} {endpoint.count}')
+
+            for name, kind, description, attribute in counters:
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, endpoint in endpoints:
+                    lines.append(f'{name}{_labels(labels)} {getattr(endpoint, attribute)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels, **extra):
+    """Format label pairs as a prometheus label set"""
+    pairs = list(labels) + list(extra.items())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+
+registry = MetricsRegistry()
+
+
+def instrument_serializers():
+    """
+    Time BaseSerializer.data, the point where DRF turns instances into primitives, for the current request.
+    Only called when metrics are enabled so the default code path is left untouched.
+    """
+    original = BaseSerializer.data.fget
+    if getattr(original, 'instrumented', False):
+        return
+
+    def data(self):
+        metrics = getattr(_local, 'metrics', None)
+        if metrics is None:
+            return original(self)
+
+        start = time.perf_counter()
+        try:
+            return original(self)
+        finally:
+            metrics.serializer_time += time.perf_counter() - start
+
+    data.instrumented = True
+    BaseSerializer.data = property(data)
@@ -0,0 +1,215 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_vary_headers
+from django.utils.module_loading import import_string
+
+from core.compression import ENCODERS, compression_level, negotiate
+from core.metrics import RequestMetrics, instrument_serializers, registry
+from core.profiling import StackSampler, valid_profile_header
+from core.queryinspector import QueryInspector
+
+logger = logging.getLogger('core.queryinspector')
+
+
+class MetricsMiddleware:
+    """
+    Record latency, database queries and time, serializer time and response size per API endpoint.
+    Removed from the middleware chain entirely unless settings.METRICS_ENABLED is set.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+        self.namespaces = set(settings.METRICS_NAMESPACES)
+        instrument_serializers()
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with RequestMetrics() as request_metrics, connection.execute_wrapper(request_metrics.execute_wrapper):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        if match is not None and match.namespace in self.namespaces:
+            # viewsets route several actions through one url name, e.g. recipe-list serves list and create
+            actions = getattr(match.func, 'actions', None) or {}
+            labels = (
+                ('view', match.view_name),
+                ('action', actions.get(request.method.lower(), request.method.lower())),
+                ('status', f'{response.status_code // 100}xx'),
+            )
+            size = len(response.content) if not response.streaming else 0
+            registry.observe(labels, duration, request_metrics, size)
+
+        return response
+
+
+class QueryInspectorMiddleware:
+    """
+    Development helper reporting N+1 query patterns and slow queries of the configured views.
+    A sampled request records every query with the serializer field that triggered it, flagged requests are
+    logged as JSON and optionally written to QUERY_INSPECTOR['REPORT_DIR'].
+    """
+
+    def __init__(self, get_response):
+        config = settings.QUERY_INSPECTOR
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+        self.config = config
+        self.view_classes = tuple(import_string(path) for path in config['VIEWS'])
+
+    def _inspected(self, request):
+        """Return whether the request is routed to one of the inspected views"""
+        try:
+            view_class = getattr(resolve(request.path_info).func, 'cls', None)
+        except Resolver404:
+            return False
+
+        return view_class is not None and issubclass(view_class, self.view_classes)
+
+    def __call__(self, request):
+        if random.random() >= self.config['SAMPLE_RATE'] or not self._inspected(request):
+            return self.get_response(request)
+
+        inspector = QueryInspector(self.config['SLOW_QUERY_MS'], self.config['REPEAT_THRESHOLD'])
+        with connection.execute_wrapper(inspector):
+            response = self.get_response(request)
+
+        report = inspector.report(request, request.resolver_match.view_name)
+        if report['n_plus_one'] or report['slow']:
+            logger.warning('query inspector %s', json.dumps(report))
+            if self.config['REPORT_DIR']:
+                name = f'{time.time():.6f}-{request.method}-{report["view"].replace(":", "-")}.json'
+                with open(os.path.join(self.config['REPORT_DIR'], name), 'w') as report_file:
+                    json.dump(report, report_file, indent=2)
+
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in statistical profiling of the views in settings.PROFILING['VIEW_MODULES'].
+    A request is profiled when it is sampled (SAMPLE_RATE, overridable per url name in ENDPOINTS) or carries a
+    valid signed profiling header, its stack samples are written in collapsed stack format to OUTPUT_DIR.
+    """
+
+    def __init__(self, get_response):
+        config = settings.PROFILING
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+        self.config = config
+        self.header = 'HTTP_' + config['HEADER'].upper().replace('-', '_')
+        os.makedirs(config['OUTPUT_DIR'], exist_ok=True)
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler = getattr(request, '_stack_sampler', None)
+            if sampler is not None:
+                sampler.stop()
+
+        if sampler is not None:
+            name = f'{request.resolver_match.view_name.replace(":", "-")}-{time.time():.6f}-{os.getpid()}.folded'
+            with open(os.path.join(self.config['OUTPUT_DIR'], name), 'w') as profile_file:
+                profile_file.write(sampler.collapsed())
+            if request._profile_requested:
+                response['X-Profile-Output'] = name
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Start sampling right before a view of the profiled modules runs"""
+        module = getattr(view_func, 'cls', view_func).__module__
+        if module not in self.config['VIEW_MODULES']:
+            return None
+
+        value = request.META.get(self.header)
+        request._profile_requested = value is not None and valid_profile_header(value, self.config['HEADER_MAX_AGE'])
+        rate = self.config['ENDPOINTS'].get(request.resolver_match.view_name, self.config['SAMPLE_RATE'])
+        if request._profile_requested or random.random() < rate:
+            request._stack_sampler = StackSampler(threading.get_ident(), self.config['INTERVAL']).start()
+
+        return None
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with the encoding the client prefers among brotli, when installed, and gzip.
+    Bodies under COMPRESSION['MIN_SIZE'] and content types or paths in the skip lists are sent as they are, larger
+    bodies get cheaper levels to bound the CPU spent per response. Streaming responses are compressed chunk by chunk
+    and flushed, so every chunk reaches the client as soon as the view produces it.
+    """
+
+    def __init__(self, get_response):
+        config = settings.COMPRESSION
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+        self.config = config
+
+    def _compressible(self, request, response):
+        """Return whether the response may be sent compressed, whatever the client accepts"""
+        if response.status_code in (204, 206, 304) or response.has_header('Content-Encoding'):
+            return False
+        if not response.streaming and len(response.content) < self.config['MIN_SIZE']:
+            return False
+        if 'no-transform' in response.get('Cache-Control', ''):
+            return False
+
+        content_type = response.get('Content-Type', '').lower()
+        return not (content_type.startswith(self.config['SKIP_CONTENT_TYPES'])
+                    or request.path_info.startswith(self.config['SKIP_PATH_PREFIXES']))
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self._compressible(request, response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        levels = self.config['LEVELS'][encoding]
+        if response.streaming:
+            encoder = ENCODERS[encoding](compression_level(levels, None))
+            response.streaming_content = self._compress_stream(encoder, response.streaming_content)
+            del response['Content-Length']
+        else:
+            encoder = ENCODERS[encoding](compression_level(levels, len(response.content)))
+            compressed = encoder.compress(response.content) + encoder.finish()
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # the compressed bytes differ from those the strong etag was given to, like GZipMiddleware weaken it
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = f'W/{etag}'
+        response['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def _compress_stream(encoder, content):
+        for chunk in content:
+            if chunk:
+                yield encoder.compress(chunk) + encoder.flush()
+        yield encoder.finish()
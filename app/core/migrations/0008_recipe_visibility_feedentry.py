@@ -0,0 +1,28 @@
+# Generated by Django 2.1.15 on 2026-10-19 07:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_recipe_user_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='feed_entry', serialize=False, to='core.Recipe')),
+                ('published_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('payload', models.TextField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='visibility',
+            field=models.CharField(choices=[('private', 'Private'), ('public', 'Public')], default='private', max_length=10),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def backfill_changelog(apps, schema_editor):
+    """Put the existing recipes, tags and ingredients of every user into their change sequence"""
+    User = apps.get_model('core', 'User')
+    ChangeLogEntry = apps.get_model('core', 'ChangeLogEntry')
+    models = [
+        ('tag', apps.get_model('core', 'Tag').objects.all()),
+        ('ingredient', apps.get_model('core', 'Ingredient').objects.all()),
+        ('recipe', apps.get_model('core', 'Recipe').objects.filter(deleted_at__isnull=True)),
+    ]
+
+    for user_id in User.objects.filter(deleted_at__isnull=True).values_list('id', flat=True).iterator():
+        entries = []
+        for model_name, queryset in models:
+            for object_id in queryset.filter(user_id=user_id).order_by('id').values_list('id', flat=True):
+                entries.append(ChangeLogEntry(user_id=user_id, model=model_name, object_id=object_id,
+                                              seq=len(entries) + 1))
+        ChangeLogEntry.objects.bulk_create(entries, batch_size=1000)
+        User.objects.filter(id=user_id).update(change_seq=len(entries))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_changelog'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_changelog, migrations.RunPython.noop),
+    ]
@@ -1,19 +1,38 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.conf import settings
-import uuid
+from django.utils import timezone
+from datetime import timedelta
 import os
+import uuid
+
+from core.storage import ContentAddressedStorage
+
+
+RECIPE_IMAGE_DIR = 'uploads/recipe/'
+PARTIAL_UPLOAD_DIR = 'uploads/partial/'
+IMAGE_RELEASE_GRACE = timedelta(minutes=10)  # see Recipe.release_images
 
 
 def recipe_image_file_path(instance, original_filename):
-    """Generate file path for new recipe image"""
+    """Generate file path for new recipe image, the storage replaces the file name with the content hash"""
     extension = original_filename.split('.')[-1]  # returns file extension .jpg etc
-    filename = f'{uuid.uuid4()}.{extension}'
+    filename = f'image.{extension}'
+
+    return os.path.join(RECIPE_IMAGE_DIR, filename)
+
 
-    return os.path.join('uploads/recipe/', filename)
+recipe_image_storage = ContentAddressedStorage()
 
 
-class UserManager(BaseUserManager):
+class NotDeletedManager(models.Manager):
+    """Manager hiding soft deleted rows, all_objects managers still see them"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class UserManager(NotDeletedManager, BaseUserManager):
 
     def create_user(self, email, password=None, **extra_fields):
         """creates and saves new user"""
@@ -31,7 +50,7 @@ class UserManager(BaseUserManager):
         user = self.create_user(email, password)
         user.is_staff = True
         user.is_superuser = True
-        user.save(using=self._db)
+        user.save(using=self._db, update_fields=['is_staff', 'is_superuser'])
 
         return user
 
@@ -42,16 +61,29 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)  # set on soft delete, see purge_deleted
+    # last sequence number handed to a ChangeLogEntry of the user, only ever advanced by recipe.changelog with an
+    # F() update, saves of a user loaded earlier must leave it out (update_fields) or they would move it back
+    change_seq = models.BigIntegerField(default=0)
 
     objects = UserManager()
+    all_objects = models.Manager()
 
     USERNAME_FIELD = 'email'
 
+    def soft_delete(self):
+        """Deactivate the account right away and leave its data to purge_deleted, which deletes it in batches"""
+        self.deleted_at = timezone.now()
+        self.is_active = False
+        self.email = f'deleted-{self.pk}@deleted.invalid'  # frees the address for a new account
+        self.save(update_fields=['deleted_at', 'is_active', 'email'])
+
 
 class Tag(models.Model):
     """Tag to be used for a recipe"""
     name = models.CharField(max_length=255)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -61,6 +93,7 @@ class Ingredient(models.Model):
     """Ingredient to be used in a recipe"""
     name = models.CharField(max_length=255)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -68,6 +101,10 @@ class Ingredient(models.Model):
 
 class Recipe(models.Model):
     """Recipe object"""
+    PRIVATE = 'private'
+    PUBLIC = 'public'
+    VISIBILITY_CHOICES = ((PRIVATE, 'Private'), (PUBLIC, 'Public'))
+
     title = models.CharField(max_length=255)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,)
     time_minutes = models.IntegerField()
@@ -75,7 +112,115 @@ class Recipe(models.Model):
     link = models.CharField(max_length=255, blank=True)
     ingredients = models.ManyToManyField('Ingredient')  # dependency order doesn't matter if wrapped as a string
     tags = models.ManyToManyField('Tag')
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # content addressed, recipes with the same image share its file, see release_images and gc_images
+    image = models.ImageField(null=True, upload_to=recipe_image_file_path, storage=recipe_image_storage, db_index=True)
+    visibility = models.CharField(max_length=10, choices=VISIBILITY_CHOICES, default=PRIVATE)
+    version = models.PositiveIntegerField(default=1)  # incremented on every update, exposed as ETag
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)  # set on soft delete, see purge_deleted
+    updated_at = models.DateTimeField(auto_now=True)  # also touched by link changes, see recipe.sync
+
+    objects = NotDeletedManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        # back the range filters and orderings of the recipe list, which is always scoped to a user
+        indexes = [
+            models.Index(fields=['user', 'time_minutes']),
+            models.Index(fields=['user', 'price']),
+        ]
 
     def __str__(self):
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the visibility as loaded, so saving a recipe that was never public leaves the feed alone"""
+        recipe = super().from_db(db, field_names, values)
+        if 'visibility' in field_names:
+            recipe._saved_visibility = values[field_names.index('visibility')]
+
+        return recipe
+
+    @classmethod
+    def release_images(cls, names):
+        """
+        Delete the image files no recipe refers to anymore, call once the rows that used them are gone.
+        Files saved again within IMAGE_RELEASE_GRACE may belong to a row not committed yet, gc_images collects them.
+        """
+        names = set(filter(None, names))
+        if names:
+            names -= set(cls.all_objects.filter(image__in=names).values_list('image', flat=True))
+        modified_before = timezone.now() - IMAGE_RELEASE_GRACE
+        for name in names:
+            recipe_image_storage.delete_unmodified(name, modified_before)
+
+    def soft_delete(self):
+        """Hide the recipe right away and leave deleting its row, links and image to purge_deleted"""
+        self.deleted_at = timezone.now()
+        self.save(update_fields=['deleted_at'])
+
+    def bump_version(self, expected=None, refresh=True):
+        """
+        Atomically increment the version, if given only while it still equals expected.
+        Returns False if another update got there first, the row stays locked until the transaction ends.
+        Without expected the new version is read back unless refresh is False.
+        """
+        rows = Recipe.objects.filter(pk=self.pk)
+        if expected is not None:
+            rows = rows.filter(version=expected)
+        if not rows.update(version=models.F('version') + 1, updated_at=timezone.now()):
+            return False
+
+        if expected is not None:
+            self.version = expected + 1
+        elif refresh:
+            self.refresh_from_db(fields=['version'])
+
+        return True
+
+
+class FeedEntry(models.Model):
+    """Precomputed public feed listing of a published recipe, served without joins"""
+    recipe = models.OneToOneField('Recipe', on_delete=models.CASCADE, primary_key=True, related_name='feed_entry')
+    published_at = models.DateTimeField(default=timezone.now, db_index=True)
+    payload = models.TextField()  # the recipe rendered as JSON, refreshed whenever it changes
+
+    def __str__(self):
+        return f'{self.recipe_id} published at {self.published_at}'
+
+
+class ChangeLogEntry(models.Model):
+    """
+    Latest change of a recipe, tag or ingredient in the change sequence of its user, read by delta sync.
+    There is one entry per object, moved to the end of the sequence on every change and kept as tombstone on deletion.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    model = models.CharField(max_length=20)  # model_name of the changed object
+    object_id = models.PositiveIntegerField()
+    seq = models.BigIntegerField()  # taken from user.change_seq, increasing in commit order per user
+    deleted = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = (('user', 'model', 'object_id'), ('user', 'seq'))
+
+    def __str__(self):
+        return f'{self.model} {self.object_id} at {self.seq}'
+
+
+class ImageUpload(models.Model):
+    """Resumable chunked upload of a recipe image, the received bytes are appended to a partial file"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE)
+    size = models.PositiveIntegerField()  # total bytes announced by the client
+    offset = models.PositiveIntegerField(default=0)  # bytes received so far
+    extension = models.CharField(max_length=10, blank=True)  # detected from the first bytes
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    @property
+    def file_name(self):
+        """Name of the partial file in the recipe image storage"""
+        return os.path.join(PARTIAL_UPLOAD_DIR, str(self.id))
+
+    def __str__(self):
+        return f'{self.id} {self.offset}/{self.size}'
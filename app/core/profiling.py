@@ -0,0 +1,76 @@
+import os
+import sys
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+
+SIGNING_SALT = 'core.profiling'
+
+
+def sign_profile_request():
+    """Return a signed value for the profiling header forcing a request to be profiled"""
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign('profile')
+
+
+def valid_profile_header(value, max_age):
+    """Return whether value is a profiling header signed with SECRET_KEY no longer than max_age seconds ago"""
+    try:
+        return signing.TimestampSigner(salt=SIGNING_SALT).unsign(value, max_age=max_age) == 'profile'
+    except signing.BadSignature:
+        return False
+
+
+def _frame_name(code):
+    """Name a frame module:function, paths relative to the project or the installed package"""
+    filename = code.co_filename
+    if filename.startswith(settings.BASE_DIR):
+        filename = os.path.relpath(filename, settings.BASE_DIR)
+    else:
+        filename = os.path.join(*filename.split(os.sep)[-2:])
+
+    return f'{filename}:{code.co_name}'.replace(';', ':')  # semicolons separate frames in collapsed stacks
+
+
+class StackSampler:
+    """
+    Statistical profiler sampling the stack of one thread from a background thread.
+    The profiled thread is never interrupted, its cost is the sampling thread taking the GIL once per interval.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def collapsed(self):
+        """Return the samples in the collapsed stack format read by flamegraph.pl and speedscope"""
+        names = {}
+        lines = []
+        for stack, count in self.samples.most_common():
+            frames = ';'.join(names.get(code) or names.setdefault(code, _frame_name(code)) for code in stack)
+            lines.append(f'{frames} {count}')
+
+        return '\n'.join(lines) + '\n' if lines else ''
@@ -0,0 +1,72 @@
+import queue
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    """Bounded queue of the messages published to a channel since subscribing"""
+
+    def __init__(self, broker, channel, size):
+        self.broker = broker
+        self.channel = channel
+        self.overflowed = False  # set once a message was dropped, the subscriber has to resync
+        self._queue = queue.Queue(size)
+
+    def put(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Return the next message, None if none arrived within timeout seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """
+    In-process pub/sub fanning messages out to the subscriptions of a channel.
+    Subscribers only see messages published by the same process, deployments running several processes plug in
+    a broker with the same publish, subscribe and unsubscribe methods backed by a shared server via EVENTS['BACKEND'].
+    """
+
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.queue_size)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.channel, None)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(message)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    """Return the broker configured by EVENTS['BACKEND'], one per process"""
+    return import_string(settings.EVENTS['BACKEND'])(queue_size=settings.EVENTS['QUEUE_SIZE'])
@@ -0,0 +1,118 @@
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.fields import Field
+from rest_framework.serializers import Serializer
+
+IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+WHITESPACE = re.compile(r'\s+')
+# issued by atomic blocks rather than the code under inspection, repeating them is not an N+1 pattern
+TRANSACTION_CONTROL = re.compile(r'\s*(?:BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE)\b', re.IGNORECASE)
+
+_this_file = os.path.abspath(__file__)
+ORM_PATH = os.path.join('django', 'db', '')
+
+
+def sql_shape(sql):
+    """Normalize a query so executions differing only in parameters share the same shape"""
+    return WHITESPACE.sub(' ', LITERALS.sub('?', IN_LIST.sub('(...)', sql))).strip()
+
+
+def _describe_field(field):
+    """Return Serializer.field for a serializer field, following nested fields up to their serializer"""
+    if field.parent is None:  # the top level serializer itself, e.g. while evaluating the queryset of a list
+        return type(getattr(field, 'child', field)).__name__
+
+    names, node = [], field
+    while node.parent is not None and (node is field or not isinstance(node, Serializer)):
+        if node.field_name:
+            names.append(node.field_name)
+        node = node.parent
+
+    return '.'.join([type(node).__name__] + names[::-1])
+
+
+def _format_frame(frame):
+    """Format a frame as path:line in function, paths relative to the project or the installed package"""
+    filename = frame.f_code.co_filename
+    if filename.startswith(settings.BASE_DIR):
+        filename = os.path.relpath(filename, settings.BASE_DIR)
+    else:
+        filename = os.path.join(*filename.split(os.sep)[-2:])
+
+    return f'{filename}:{frame.f_lineno} in {frame.f_code.co_name}'
+
+
+def _origin(frame, stack_depth):
+    """Return the serializer field that led to a query and the innermost frames above the ORM"""
+    field, stack = None, []
+    while frame is not None and (field is None or len(stack) < stack_depth):
+        candidate = frame.f_locals.get('self')
+        if field is None and isinstance(candidate, Field) and frame.f_code.co_name in (
+                'to_representation', 'get_attribute'):
+            field = _describe_field(candidate)
+
+        filename = frame.f_code.co_filename
+        if len(stack) < stack_depth and filename != _this_file and ORM_PATH not in filename:
+            stack.append(_format_frame(frame))
+        frame = frame.f_back
+
+    return field, stack
+
+
+class QueryInspector:
+    """Database execute wrapper collecting every query of a request with its timing and origin"""
+
+    def __init__(self, slow_query_ms, repeat_threshold, stack_depth=8):
+        self.slow_query_ms = slow_query_ms
+        self.repeat_threshold = repeat_threshold
+        self.stack_depth = stack_depth
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if TRANSACTION_CONTROL.match(sql):
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            field, stack = _origin(sys._getframe(1), self.stack_depth)
+            self.queries.append({'sql': sql, 'ms': duration_ms, 'field': field, 'stack': stack})
+
+    def report(self, request, view_name):
+        """Return the JSON report of a request, flagging repeated query shapes and slow queries"""
+        shapes = OrderedDict()
+        for query in self.queries:
+            shapes.setdefault(sql_shape(query['sql']), []).append(query)
+
+        repeated = [
+            {
+                'shape': shape,
+                'count': len(queries),
+                'total_ms': round(sum(query['ms'] for query in queries), 3),
+                'fields': sorted({query['field'] for query in queries if query['field']}),
+                'stack': queries[0]['stack'],
+            }
+            for shape, queries in shapes.items() if len(queries) >= self.repeat_threshold
+        ]
+        slow = [
+            {'sql': query['sql'], 'ms': round(query['ms'], 3), 'field': query['field'], 'stack': query['stack']}
+            for query in self.queries if query['ms'] >= self.slow_query_ms
+        ]
+
+        return {
+            'method': request.method,
+            'path': request.path,
+            'view': view_name,
+            'queries': len(self.queries),
+            'total_ms': round(sum(query['ms'] for query in self.queries), 3),
+            'n_plus_one': repeated,
+            'slow': slow,
+        }
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import uuid
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+def content_digest(content):
+    """Return the sha256 hex digest of a file, read in chunks and rewound afterwards"""
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage naming files by the sha256 of their content, so identical uploads share one file.
+    Only the directory and extension of the requested name are kept, e.g. uploads/recipe/ab/ab12...ef.jpg
+    """
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        if self.exists(name):
+            # already stored by an earlier upload of the same content. A fresh mtime keeps release_images and
+            # gc_images off the file until the row referring to it commits, see delete_unmodified
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                pass  # deleted in the meantime, store it again
+
+        return super().save(name, content, max_length)
+
+    def content_name(self, name, content):
+        """Return the name content requested as name is stored under"""
+        directory, filename = os.path.split(name)
+        digest = content_digest(content)
+        return os.path.join(directory, digest[:2], digest + os.path.splitext(filename)[1].lower())
+
+    def link_as(self, name, path):
+        """
+        Store the file at path under the name content_name returned for it, keeping the file at path in place.
+        The stored file is a hard link with a fresh mtime, so gc_images leaves it alone until a row refers to it.
+        """
+        if self.exists(name):
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                pass  # deleted in the meantime, store it again
+
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        try:
+            os.link(path, full_path)
+        except FileExistsError:
+            pass  # stored by a concurrent upload of the same content
+        except OSError:  # no hard links on this file system
+            with open(path, 'rb') as content:
+                return super().save(name, File(content), None)
+        os.utime(full_path)
+
+        return name
+
+    def delete_unmodified(self, name, modified_before):
+        """
+        Delete a file unless it was modified at or after modified_before, returning whether it was deleted.
+        The file is moved aside before its mtime is checked, so a concurrent save of the same content either shows
+        in the mtime, which puts the file back, or no longer finds the file and stores it again.
+        """
+        path = self.path(name)
+        aside = f'{path}.{uuid.uuid4().hex}.deleting'
+        try:
+            os.rename(path, aside)
+        except FileNotFoundError:
+            return False
+
+        if os.stat(aside).st_mtime >= modified_before.timestamp():
+            os.replace(aside, path)
+            return False
+
+        os.remove(aside)
+        return True
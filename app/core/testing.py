@@ -0,0 +1,119 @@
+import atexit
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.db import connection
+from django.test import override_settings
+from django.urls import Resolver404, resolve
+from rest_framework.test import APIClient
+
+from core.metrics import RequestMetrics
+
+BUDGET_FILE = os.path.join(settings.BASE_DIR, 'query_budgets.json')
+UPDATE_ENV = 'UPDATE_QUERY_BUDGETS'  # set to 1 to rewrite the budgets with the counts observed by the run
+
+
+class QueryBudgets:
+    """
+    Committed per endpoint query budgets and the highest counts observed during the test run.
+    Budgets are kept per database vendor, backends differ in e.g. whether bulk inserts return ids.
+    """
+
+    def __init__(self, path, vendor):
+        self.path = path
+        self.vendor = vendor
+        self.observed = {}
+        self.update = os.environ.get(UPDATE_ENV) == '1'
+        self.recorded = {}
+        if os.path.exists(path):
+            with open(path) as budget_file:
+                self.recorded = json.load(budget_file)
+        self.budgets = self.recorded.get(vendor, {})
+
+        if self.update:
+            atexit.register(self.save)
+
+    def check(self, endpoint, queries):
+        """Record the queries of an endpoint call and fail if they exceed its budget"""
+        self.observed[endpoint] = max(queries, self.observed.get(endpoint, 0))
+        if self.update:
+            return
+
+        budget = self.budgets.get(endpoint)
+        if budget is None:
+            raise AssertionError(
+                f'{endpoint} has no {self.vendor} query budget, run the tests with {UPDATE_ENV}=1 and commit '
+                f'{self.path}'
+            )
+        if queries > budget:
+            raise AssertionError(
+                f'{endpoint} executed {queries} queries, its budget is {budget}. Avoid the extra queries or '
+                f'raise the budget by running the tests with {UPDATE_ENV}=1 and commit {self.path}'
+            )
+
+    def save(self):
+        """Write the observed counts, keeping the budgets of endpoints this run did not call and of other vendors"""
+        recorded = dict(self.recorded, **{self.vendor: dict(self.budgets, **self.observed)})
+        with open(self.path, 'w') as budget_file:
+            json.dump(recorded, budget_file, indent=2, sort_keys=True)
+            budget_file.write('\n')
+
+
+budgets = QueryBudgets(BUDGET_FILE, connection.vendor)
+
+
+class QueryCountingAPIClient(APIClient):
+    """API client counting the queries of every request and checking them against the endpoint budget"""
+
+    def request(self, **kwargs):
+        request_metrics = RequestMetrics()
+        with connection.execute_wrapper(request_metrics.execute_wrapper):
+            response = super().request(**kwargs)
+
+        response.query_count = request_metrics.queries
+        try:
+            match = resolve(kwargs['PATH_INFO'])
+        except Resolver404:  # nothing to budget for urls no view serves
+            return response
+        budgets.check(f'{kwargs["REQUEST_METHOD"]} {match.view_name}', request_metrics.queries)
+
+        return response
+
+
+class QueryCountAssertionsMixin:
+    """TestCase mixin for asserting that endpoints do not issue a query per result"""
+
+    def assertConstantQueries(self, client, url, add_result, sizes=(1, 5), params=None):
+        """Call url after growing the result set to each size and assert the query count never changes"""
+        counts = {}
+        results = 0
+        for size in sizes:
+            while results < size:
+                add_result(results)
+                results += 1
+
+            res = client.get(url, params)
+            self.assertEqual(res.status_code, 200)
+            counts[size] = res.query_count
+
+        self.assertEqual(len(set(counts.values())), 1, f'queries of {url} grow with the result size: {counts}')
+
+
+class TemporaryMediaRootMixin:
+    """TestCase mixin storing the files the tests write in a MEDIA_ROOT of their own, removed after the class"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls._media_root_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls._media_root_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._media_root_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
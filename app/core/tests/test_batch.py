@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag
+
+BATCH_URL = reverse('batch')
+BATCH_SETTINGS = {'MAX_REQUESTS': 3, 'MAX_WORKERS': 1, 'NAMESPACES': ('recipe', 'user')}
+
+
+@override_settings(BATCH_REQUESTS=BATCH_SETTINGS)
+class BatchTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123', name='name')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_batch_requires_authentication(self):
+        """Test that the batch endpoint authenticates like the API views"""
+        res = APIClient().post(BATCH_URL, {'requests': [{'method': 'GET', 'path': '/api/user/me/'}]}, format='json')
+
+        self.assertEqual(res.status_code, 401)
+
+    def test_batch_dispatches_in_order(self):
+        """Test that reads and writes are dispatched to the API views with their responses returned in order"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        calls = [
+            {'method': 'GET', 'path': '/api/user/me/'},
+            {'method': 'POST', 'path': '/api/recipe/tags/', 'body': {'name': 'Dessert'}},
+            {'method': 'GET', 'path': '/api/recipe/tags/?assigned_only=0'},
+        ]
+
+        res = self.client.post(BATCH_URL, {'requests': calls}, format='json')
+
+        self.assertEqual(res.status_code, 200)
+        me, created, tags = res.data['responses']
+        self.assertEqual(me['status'], 200)
+        self.assertEqual(me['body']['email'], 'test@test.com')
+        self.assertEqual(created['status'], 201)
+        self.assertEqual([tag['name'] for tag in tags['body']], ['Vegan', 'Dessert'])
+
+    def test_batch_forwards_headers_and_errors(self):
+        """Test that sub-request headers reach the views and failures stay confined to their call"""
+        recipe = Recipe.objects.create(user=self.user, title='recipe', time_minutes=10, price=5)
+        calls = [
+            {'method': 'GET', 'path': f'/api/recipe/recipes/{recipe.id}/'},
+            {'method': 'PATCH', 'path': f'/api/recipe/recipes/{recipe.id}/', 'body': {'title': 'new'},
+             'headers': {'If-Match': '"5"'}},
+            {'method': 'GET', 'path': '/admin/'},
+        ]
+
+        res = self.client.post(BATCH_URL, {'requests': calls}, format='json')
+
+        detail, stale, outside = res.data['responses']
+        self.assertEqual(detail['headers']['ETag'], '"1"')
+        self.assertEqual(stale['status'], 412)
+        self.assertEqual(outside['status'], 404)
+
+    def test_batch_limits(self):
+        """Test that empty and oversized batches are rejected"""
+        too_many = [{'method': 'GET', 'path': '/api/user/me/'}] * 4
+
+        self.assertEqual(self.client.post(BATCH_URL, {'requests': []}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(BATCH_URL, {'requests': too_many}, format='json').status_code, 400)
+
+    def test_batch_unhandled_error(self):
+        """Test that an exception in one view is reported as a 500 of that call only"""
+        calls = [{'method': 'GET', 'path': '/api/recipe/recipes/'}, {'method': 'GET', 'path': '/api/user/me/'}]
+        with patch('recipe.views.RecipeViewSet.list', side_effect=RuntimeError), self.assertLogs('core.batch'):
+            res = self.client.post(BATCH_URL, {'requests': calls}, format='json')
+
+        self.assertEqual([call['status'] for call in res.data['responses']], [500, 200])
+
+    def test_batch_streaming_response(self):
+        """Test that calls answered with a streaming response are rejected without failing the batch"""
+        calls = [{'method': 'GET', 'path': '/api/recipe/events/'}, {'method': 'GET', 'path': '/api/user/me/'}]
+
+        res = self.client.post(BATCH_URL, {'requests': calls}, format='json')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([call['status'] for call in res.data['responses']], [400, 200])
+
+
+@override_settings(BATCH_REQUESTS=dict(BATCH_SETTINGS, MAX_WORKERS=3))
+class ConcurrentBatchTests(TransactionTestCase):
+
+    def test_reads_dispatched_concurrently(self):
+        """Test that batches of reads run on the thread pool and still return responses in order"""
+        user = get_user_model().objects.create_user(email='test@test.com', password='password123', name='name')
+        Tag.objects.create(user=user, name='Vegan')
+        client = APIClient()
+        client.force_authenticate(user)
+        calls = [{'method': 'GET', 'path': '/api/user/me/'}, {'method': 'GET', 'path': '/api/recipe/tags/'}]
+
+        with patch('core.batch.ThreadPoolExecutor', wraps=ThreadPoolExecutor) as executor:
+            res = client.post(BATCH_URL, {'requests': calls}, format='json')
+
+        executor.assert_called_once()
+        me, tags = res.data['responses']
+        self.assertEqual(me['body']['email'], 'test@test.com')
+        self.assertEqual(tags['body'][0]['name'], 'Vegan')
@@ -1,7 +1,23 @@
+import json
+from datetime import timedelta
+from io import StringIO
+import os
+import tempfile
 from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.db.utils import OperationalError
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.models import ImageUpload, Ingredient, Recipe, Tag
+from core.testing import TemporaryMediaRootMixin
+from recipe.uploads import create_partial_file
 
 
 class CommandTests(TestCase):
@@ -23,3 +39,165 @@ class CommandTests(TestCase):
             gi.side_effect = [OperationalError] * 5 + [True]
             call_command('wait_for_db')
             self.assertEqual(gi.call_count, 6)
+
+
+class BenchmarkCommandTests(TestCase):
+
+    def setUp(self):
+        call_command('seed_benchmark_data', users=2, recipes_per_user=5, tags_per_user=3, ingredients_per_user=4,
+                     tags_per_recipe=2, ingredients_per_recipe=3, stdout=StringIO())
+
+    def test_seed_benchmark_data(self):
+        """Test that the configured amount of data is generated"""
+        self.assertEqual(Recipe.objects.count(), 10)
+        self.assertEqual(Tag.objects.count(), 6)
+        self.assertEqual(Recipe.ingredients.through.objects.count(), 30)
+
+        # seeding again replaces the previous dataset
+        call_command('seed_benchmark_data', users=1, recipes_per_user=1, stdout=StringIO())
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_benchmark_against_baseline(self):
+        """Test that the benchmark stores a baseline and fails on query regressions"""
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = os.path.join(directory, 'baseline.json')
+            call_command('benchmark_api', iterations=1, baseline=baseline, save_baseline=True,
+                         stdout=StringIO())
+            with open(baseline) as baseline_file:
+                results = json.load(baseline_file)
+            self.assertIn('recipe upload image', results)
+            self.assertIn('p95_ms', results['recipe list'])
+
+            results['recipe retrieve']['queries'] = 0
+            results = {name: dict(result, p95_ms=10 ** 6) for name, result in results.items()}
+            with open(baseline, 'w') as baseline_file:
+                json.dump(results, baseline_file)
+
+            with self.assertRaisesMessage(CommandError, 'recipe retrieve'):
+                call_command('benchmark_api', iterations=1, baseline=baseline, stdout=StringIO())
+
+
+class PurgeDeletedCommandTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+
+    def sample_recipe(self, user, **params):
+        recipe = Recipe.objects.create(user=user, title='recipe', time_minutes=10, price=5, **params)
+        recipe.tags.add(Tag.objects.create(user=user, name='tag'))
+        recipe.ingredients.add(Ingredient.objects.create(user=user, name='ingredient'))
+        return recipe
+
+    def test_purge_deleted_recipes(self):
+        """Test that soft deleted recipes are purged with their links and images no other recipe uses"""
+        image = default_storage.save('uploads/recipe/purge.jpg', ContentFile(b'image'))
+        self.addCleanup(default_storage.delete, image)
+        recipe = self.sample_recipe(self.user, image=image)
+        clone = self.sample_recipe(self.user, image=image)
+        kept = self.sample_recipe(self.user)
+        recipe.soft_delete()
+
+        call_command('purge_deleted', stdout=StringIO())
+
+        self.assertEqual(list(Recipe.all_objects.all()), [clone, kept])
+        self.assertFalse(Recipe.tags.through.objects.filter(recipe_id=recipe.id).exists())
+        self.assertTrue(default_storage.exists(image))
+
+        clone.soft_delete()
+        call_command('purge_deleted', stdout=StringIO())
+        self.assertTrue(default_storage.exists(image))  # saved too recently, its recipe may not be committed yet
+
+        an_hour_ago = (timezone.now() - timedelta(hours=1)).timestamp()
+        os.utime(default_storage.path(image), (an_hour_ago, an_hour_ago))
+        Recipe.release_images([image])
+        self.assertFalse(default_storage.exists(image))
+
+    def test_purge_deleted_users(self):
+        """Test that soft deleted accounts are purged in batches, leaving other accounts alone"""
+        other = get_user_model().objects.create_user(email='other@test.com', password='password123')
+        for user in (self.user, other):
+            for _ in range(3):
+                self.sample_recipe(user)
+        self.user.soft_delete()
+
+        out = StringIO()
+        call_command('purge_deleted', batch_size=2, stdout=out)
+
+        self.assertIn('Purged 3 recipes and 1 users', out.getvalue())
+        self.assertFalse(get_user_model().all_objects.filter(id=self.user.id).exists())
+        for model in (Recipe, Tag, Ingredient):
+            self.assertEqual(set(model.objects.values_list('user_id', flat=True)), {other.id})
+
+    def test_purge_queries_bounded(self):
+        """Test that a batch costs the same number of queries however many rows it purges"""
+        def purge_queries(email, recipes):
+            user = get_user_model().objects.create_user(email=email, password='password123')
+            for _ in range(recipes):
+                self.sample_recipe(user)
+            user.soft_delete()
+            with CaptureQueriesContext(connection) as queries:
+                call_command('purge_deleted', stdout=StringIO())
+            return len(queries)
+
+        self.assertEqual(purge_queries('few@test.com', 1), purge_queries('many@test.com', 5))
+
+    def test_purge_respects_min_age(self):
+        """Test that recently soft deleted recipes are kept until they are old enough"""
+        recipe = self.sample_recipe(self.user)
+        recipe.soft_delete()
+
+        call_command('purge_deleted', min_age_hours=1, stdout=StringIO())
+
+        self.assertTrue(Recipe.all_objects.filter(id=recipe.id).exists())
+
+
+class GcImagesCommandTests(TemporaryMediaRootMixin, TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.storage = Recipe._meta.get_field('image').storage
+        self.used = self.storage.save('uploads/recipe/image.jpg', ContentFile(b'used'))
+        self.unused = self.storage.save('uploads/recipe/image.jpg', ContentFile(b'unused'))
+        self.recipe = Recipe.objects.create(user=user, title='recipe', time_minutes=10, price=5, image=self.used)
+
+    def test_gc_images(self):
+        """Test that only unreferenced images are deleted"""
+        out = StringIO()
+        call_command('gc_images', min_age_minutes=0, batch_size=1, stdout=out)
+
+        self.assertTrue(self.storage.exists(self.used))
+        self.assertFalse(self.storage.exists(self.unused))
+        self.assertIn('Deleted 1 of', out.getvalue())
+
+    def test_gc_images_dry_run_and_min_age(self):
+        """Test that dry runs and recent files leave the images alone"""
+        out = StringIO()
+        call_command('gc_images', min_age_minutes=0, dry_run=True, stdout=out)
+        self.assertIn(self.unused, out.getvalue())
+
+        call_command('gc_images', stdout=StringIO())
+        self.assertTrue(self.storage.exists(self.unused))
+
+    def test_gc_expired_uploads(self):
+        """Test that abandoned chunked uploads are removed with their partial files"""
+        upload = ImageUpload.objects.create(user=self.recipe.user, recipe=self.recipe, size=100)
+        create_partial_file(upload)
+        ImageUpload.objects.filter(id=upload.id).update(created_at=timezone.now() - timedelta(days=2))
+
+        call_command('gc_images', min_age_minutes=0, stdout=StringIO())
+
+        self.assertFalse(ImageUpload.objects.exists())
+        self.assertFalse(self.storage.exists(upload.file_name))
+
+    def test_gc_images_keeps_saved_again(self):
+        """Test that an old unreferenced image saved again by a new upload is kept"""
+        path = self.storage.path(self.unused)
+        an_hour_ago = (timezone.now() - timedelta(hours=1)).timestamp()
+        os.utime(path, (an_hour_ago, an_hour_ago))
+
+        self.assertEqual(self.storage.save('uploads/recipe/image.jpg', ContentFile(b'unused')), self.unused)
+        call_command('gc_images', min_age_minutes=30, stdout=StringIO())
+        Recipe.release_images([self.unused])
+
+        self.assertTrue(self.storage.exists(self.unused))
+        self.assertFalse([name for name in os.listdir(os.path.dirname(path)) if name.endswith('.deleting')])
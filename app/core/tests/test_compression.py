@@ -0,0 +1,138 @@
+import gzip
+import zlib
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import compression
+from core.middleware import CompressionMiddleware
+from core.models import Tag
+
+TAGS_URL = reverse('recipe:tag-list')
+
+
+class NegotiationTests(TestCase):
+
+    def test_negotiate(self):
+        """Test that the accepted encoding with the highest quality is chosen"""
+        self.assertEqual(compression.negotiate('gzip, deflate'), 'gzip')
+        self.assertEqual(compression.negotiate('deflate;q=1, gzip;q=0.5'), 'gzip')
+        self.assertEqual(compression.negotiate('*'), next(iter(compression.ENCODERS)))
+        self.assertIsNone(compression.negotiate('gzip;q=0'))
+        self.assertIsNone(compression.negotiate('identity, deflate'))
+        self.assertIsNone(compression.negotiate(''))
+
+    @skipUnless(compression.brotli, 'brotli is not installed')
+    def test_negotiate_prefers_brotli(self):
+        """Test that brotli is preferred when accepted as much as gzip"""
+        self.assertEqual(compression.negotiate('gzip, br'), 'br')
+        self.assertEqual(compression.negotiate('gzip, br;q=0.8'), 'gzip')
+
+    def test_compression_level(self):
+        """Test that larger responses get cheaper levels and streams the cheapest"""
+        levels = ((100, 6), (1000, 4), (None, 1))
+
+        self.assertEqual([compression.compression_level(levels, size) for size in (10, 100, 500, 5000, None)],
+                         [6, 6, 4, 1, 1])
+
+
+class CompressionMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Tag.objects.bulk_create(Tag(user=self.user, name=f'tag {i}') for i in range(50))
+
+    def test_gzip(self):
+        """Test that a large JSON response is gzipped for clients accepting gzip"""
+        plain = self.client.get(TAGS_URL)
+        res = self.client.get(TAGS_URL, HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res['Vary'])
+        self.assertEqual(res['Content-Length'], str(len(res.content)))
+        self.assertEqual(gzip.decompress(res.content), plain.content)
+        self.assertLess(len(res.content), len(plain.content) / 3)
+
+    def test_etag_weakened(self):
+        """Test that compressed responses carry their etag as a weak one and uncompressed ones keep it strong"""
+        def get_response(request):
+            response = HttpResponse(b'x' * 4096, content_type='application/json')
+            response['ETag'] = '"1"'
+            return response
+
+        factory = RequestFactory()
+        compressed = CompressionMiddleware(get_response)(factory.get('/', HTTP_ACCEPT_ENCODING='gzip'))
+        plain = CompressionMiddleware(get_response)(factory.get('/'))
+
+        self.assertEqual(compressed['ETag'], 'W/"1"')
+        self.assertEqual(plain['ETag'], '"1"')
+
+    def test_not_accepted(self):
+        """Test that responses stay uncompressed without an accepted encoding but still vary on it"""
+        res = self.client.get(TAGS_URL, HTTP_ACCEPT_ENCODING='gzip;q=0')
+
+        self.assertFalse(res.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', res['Vary'])
+
+    def test_small_response(self):
+        """Test that responses under the size threshold are sent as they are"""
+        Tag.objects.all().delete()
+        res = self.client.get(TAGS_URL, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertFalse(res.has_header('Content-Encoding'))
+
+    @override_settings(COMPRESSION={'ENABLED': False})
+    def test_disabled(self):
+        """Test that nothing is compressed while compression is disabled"""
+        res = self.client.get(TAGS_URL, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertFalse(res.has_header('Content-Encoding'))
+
+
+class CompressionStreamingTests(TestCase):
+
+    def setUp(self):
+        self.request = RequestFactory().get('/api/recipe/export/', HTTP_ACCEPT_ENCODING='gzip')
+
+    def test_streaming(self):
+        """Test that streaming responses are compressed chunk by chunk, each chunk decodable as it arrives"""
+        chunks = [f'{{"chunk": {i}}}\n'.encode() * 10 for i in range(3)]
+        response = CompressionMiddleware(lambda request: StreamingHttpResponse(
+            iter(chunks), content_type='application/json'))(self.request)
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        for chunk, compressed in zip(chunks, response.streaming_content):
+            self.assertEqual(decoder.decompress(compressed), chunk)
+
+    def test_skipped_content(self):
+        """Test that images, event streams and media paths are never compressed"""
+        body = b'x' * 4096
+        responses = (
+            HttpResponse(body, content_type='image/jpeg'),
+            StreamingHttpResponse(iter([body]), content_type='text/event-stream'),
+        )
+        for response in responses:
+            self.assertFalse(CompressionMiddleware(lambda request: response)(self.request).has_header(
+                'Content-Encoding'))
+
+        request = RequestFactory().get('/media/uploads/recipe/file', HTTP_ACCEPT_ENCODING='gzip')
+        response = CompressionMiddleware(lambda request: HttpResponse(body, content_type='text/plain'))(request)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_already_encoded(self):
+        """Test that responses with a content encoding or partial content are left alone"""
+        encoded = HttpResponse(b'x' * 4096)
+        encoded['Content-Encoding'] = 'br'
+        partial = HttpResponse(b'x' * 4096, status=206)
+
+        for response in (encoded, partial):
+            res = CompressionMiddleware(lambda request: response)(self.request)
+            self.assertEqual(res.content, b'x' * 4096)
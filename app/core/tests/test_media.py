@@ -0,0 +1,121 @@
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.media import parse_range, UnsatisfiableRange
+from core.models import Recipe
+
+CONTENT = b'0123456789' * 10
+
+
+def media_url(name):
+    """Return the url serving a stored image"""
+    return f'/media/{name}'
+
+
+class MediaTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.storage = Recipe._meta.get_field('image').storage
+        self.name = self.storage.save('uploads/recipe/image.jpg', ContentFile(CONTENT))
+        self.addCleanup(self.storage.delete, self.name)
+        self.recipe = Recipe.objects.create(user=self.user, title='recipe', time_minutes=10, price=5, image=self.name,
+                                            visibility=Recipe.PUBLIC)
+        self.client = APIClient()
+
+    def test_public_image_cached_immutable(self):
+        """Test that public content addressed images are served with long lived cache headers"""
+        res = self.client.get(media_url(self.name))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b''.join(res.streaming_content), CONTENT)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res['Accept-Ranges'], 'bytes')
+        self.assertEqual(res['ETag'], f'"{self.name.rsplit("/", 1)[1][:-4]}"')
+        self.assertIn('immutable', res['Cache-Control'])
+        self.assertIn('max-age=31536000', res['Cache-Control'])
+
+    def test_conditional_get(self):
+        """Test that a matching If-None-Match or If-Modified-Since is answered without the file"""
+        res = self.client.get(media_url(self.name))
+
+        etag = self.client.get(media_url(self.name), HTTP_IF_NONE_MATCH=res['ETag'])
+        modified = self.client.get(media_url(self.name), HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+
+        self.assertEqual(etag.status_code, 304)
+        self.assertEqual(modified.status_code, 304)
+        self.assertEqual(etag['ETag'], res['ETag'])
+
+    def test_range_requests(self):
+        """Test that byte ranges are served partially and unsatisfiable ones rejected"""
+        res = self.client.get(media_url(self.name), HTTP_RANGE='bytes=10-19')
+        suffix = self.client.get(media_url(self.name), HTTP_RANGE='bytes=-5')
+        stale = self.client.get(media_url(self.name), HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"other"')
+        unsatisfiable = self.client.get(media_url(self.name), HTTP_RANGE='bytes=500-')
+
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(b''.join(res.streaming_content), CONTENT[10:20])
+        self.assertEqual(res['Content-Range'], f'bytes 10-19/{len(CONTENT)}')
+        self.assertEqual(res['Content-Length'], '10')
+        self.assertEqual(b''.join(suffix.streaming_content), CONTENT[-5:])
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(unsatisfiable.status_code, 416)
+        self.assertEqual(unsatisfiable['Content-Range'], f'bytes */{len(CONTENT)}')
+
+    def test_parse_range(self):
+        """Test that ranges are clamped to the file and malformed headers ignored"""
+        self.assertEqual(parse_range('bytes=90-200', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-200', 100), (0, 99))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+        self.assertIsNone(parse_range('bytes=9-1', 100))
+        self.assertIsNone(parse_range(None, 100))
+        with self.assertRaises(UnsatisfiableRange):
+            parse_range('bytes=-0', 100)
+
+    def test_private_image_owner_only(self):
+        """Test that private images are only served to their owner and never cached by shared caches"""
+        self.recipe.visibility = Recipe.PRIVATE
+        self.recipe.save()
+        token = Token.objects.create(user=self.user)
+
+        anonymous = self.client.get(media_url(self.name))
+        bad_token = self.client.get(media_url(self.name), HTTP_AUTHORIZATION='Token invalid')
+        owner = self.client.get(media_url(self.name), HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        self.assertEqual(anonymous.status_code, 404)
+        self.assertEqual(bad_token.status_code, 404)
+        self.assertEqual(owner.status_code, 200)
+        self.assertIn('private', owner['Cache-Control'])
+        self.assertNotIn('immutable', owner['Cache-Control'])
+
+    def test_unreferenced_and_outside_paths_not_found(self):
+        """Test that unreferenced files, deleted recipes, partial uploads and traversal are not served"""
+        unreferenced = self.storage.save('uploads/recipe/image.jpg', ContentFile(b'unreferenced'))
+        self.addCleanup(self.storage.delete, unreferenced)
+
+        self.assertEqual(self.client.get(media_url(unreferenced)).status_code, 404)
+        self.assertEqual(self.client.get(media_url('uploads/partial/abc')).status_code, 404)
+        self.assertEqual(self.client.get(media_url(f'uploads/recipe/../recipe/{self.name[15:]}')).status_code, 404)
+        self.recipe.soft_delete()
+        self.assertEqual(self.client.get(media_url(self.name)).status_code, 404)
+
+    @override_settings(MEDIA_SERVING={'BACKEND': 'x-accel-redirect', 'ACCEL_REDIRECT_PREFIX': '/protected-media/',
+                                      'IMMUTABLE_MAX_AGE': 60})
+    def test_accel_redirect_handoff(self):
+        """Test that the transfer is handed off to the web server with an empty body"""
+        res = self.client.get(media_url(self.name))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(res.content, b'')
+        self.assertIn('max-age=60', res['Cache-Control'])
+
+    @override_settings(MEDIA_SERVING={'BACKEND': 'x-sendfile', 'IMMUTABLE_MAX_AGE': 60})
+    def test_sendfile_handoff(self):
+        """Test that x-sendfile receives the absolute file path"""
+        res = self.client.get(media_url(self.name))
+
+        self.assertEqual(res['X-Sendfile'], self.storage.path(self.name))
@@ -0,0 +1,48 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.metrics import registry
+
+METRICS_URL = reverse('metrics')
+
+
+@override_settings(METRICS_ENABLED=True)
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        registry.reset()
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_endpoint_metrics_recorded(self):
+        """Test that latency, queries and response size are recorded per view action"""
+        self.client.get(reverse('recipe:recipe-list'))
+        self.client.get(reverse('recipe:recipe-list'))
+
+        res = self.client.get(METRICS_URL)
+
+        self.assertEqual(res.status_code, 200)
+        content = res.content.decode()
+        labels = '{view="recipe:recipe-list",action="list",status="2xx"}'
+        self.assertIn(f'api_request_duration_seconds_count{labels} 2', content)
+        self.assertIn(f'api_db_queries_total{labels} 2', content)
+        self.assertIn(f'api_response_bytes_total{labels} 4', content)
+        self.assertIn(f'api_serializer_seconds_total{labels}', content)
+        self.assertNotIn('view="metrics"', content)
+
+    def test_metrics_restricted_to_local_addresses(self):
+        """Test that remote clients cannot read the metrics"""
+        res = self.client.get(METRICS_URL, REMOTE_ADDR='10.0.0.1')
+
+        self.assertEqual(res.status_code, 404)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_metrics_disabled(self):
+        """Test that nothing is recorded or exposed while metrics are disabled"""
+        self.client.get(reverse('recipe:recipe-list'))
+
+        self.assertEqual(self.client.get(METRICS_URL).status_code, 404)
+        self.assertEqual(registry.render().count('recipe-list'), 0)
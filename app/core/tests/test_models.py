@@ -1,7 +1,10 @@
+from django.core.files.base import ContentFile
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from core import models
-from unittest.mock import patch
+from core.storage import ContentAddressedStorage
+import hashlib
+import tempfile
 
 
 def sample_user(email='test@test.com', password='password123'):
@@ -70,12 +73,20 @@ class ModelTests(TestCase):
 
         self.assertEqual(str(recipe), recipe.title)
 
-    @patch('uuid.uuid4')
-    def test_recipe_file_name_uuid(self, mock_uuid):
+    def test_recipe_file_name(self):
         """Test that image is saved in the correct location"""
-        uuid = 'test-uuid'
-        mock_uuid.return_value = uuid
         file_path = models.recipe_image_file_path(None, 'myimage.jpg')
 
-        expected_path = f'uploads/recipe/{uuid}.jpg'
-        self.assertEqual(file_path, expected_path)
+        self.assertEqual(file_path, 'uploads/recipe/image.jpg')
+
+    def test_content_addressed_storage(self):
+        """Test that files are named by their content hash and identical content is stored once"""
+        with tempfile.TemporaryDirectory() as location:
+            storage = ContentAddressedStorage(location=location)
+            digest = hashlib.sha256(b'image').hexdigest()
+
+            name = storage.save('uploads/recipe/image.JPG', ContentFile(b'image'))
+            self.assertEqual(name, f'uploads/recipe/{digest[:2]}/{digest}.jpg')
+            self.assertEqual(storage.save('uploads/recipe/other.jpg', ContentFile(b'image')), name)
+            self.assertEqual(storage.listdir(f'uploads/recipe/{digest[:2]}'), ([], [f'{digest}.jpg']))
+            self.assertNotEqual(storage.save('uploads/recipe/image.jpg', ContentFile(b'other')), name)
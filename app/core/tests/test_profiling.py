@@ -0,0 +1,96 @@
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.profiling import StackSampler, sign_profile_request
+from recipe.views import RecipeViewSet
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+def busy_wait(seconds):
+    """Keep the thread running python code for a while"""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def slow_list(self, request, *args, **kwargs):
+    """Recipe list taking long enough to be sampled"""
+    busy_wait(0.05)
+    return original_list(self, request, *args, **kwargs)
+
+
+original_list = RecipeViewSet.list
+
+
+class StackSamplerTests(TestCase):
+
+    def test_collapsed_stacks(self):
+        """Test that samples are collapsed into semicolon separated stacks with counts"""
+        sampler = StackSampler(threading.get_ident(), 0.001).start()
+        busy_wait(0.05)
+        sampler.stop()
+
+        lines = sampler.collapsed().splitlines()
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertIn('core/tests/test_profiling.py:busy_wait', stack.split(';'))
+        self.assertGreater(int(count), 0)
+
+
+@patch.object(RecipeViewSet, 'list', slow_list)
+class ProfilingMiddlewareTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output_dir = directory.name
+        user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def profiling(self, **overrides):
+        """Return settings enabling the profiler, writing into the temporary output directory"""
+        config = dict(settings.PROFILING, ENABLED=True, INTERVAL=0.001, OUTPUT_DIR=self.output_dir)
+        config.update(overrides)
+        return override_settings(PROFILING=config)
+
+    def test_sampled_request_profiled(self):
+        """Test that sampled requests write a collapsed stack file"""
+        with self.profiling(SAMPLE_RATE=1):
+            self.client.get(RECIPES_URL)
+
+        files = os.listdir(self.output_dir)
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith('recipe-recipe-list-'))
+        with open(os.path.join(self.output_dir, files[0])) as profile_file:
+            self.assertIn('test_profiling.py:slow_list', profile_file.read())
+
+    def test_endpoint_sample_rate(self):
+        """Test that per endpoint rates override the default sample rate"""
+        with self.profiling(SAMPLE_RATE=0, ENDPOINTS={'recipe:tag-list': 1}):
+            self.client.get(RECIPES_URL)
+            self.client.get(TAGS_URL)
+
+        files = os.listdir(self.output_dir)
+        self.assertEqual([name.startswith('recipe-tag-list-') for name in files], [True])
+
+    def test_signed_header_forces_profiling(self):
+        """Test that a valid signed header profiles the request and a forged one does not"""
+        with self.profiling(SAMPLE_RATE=0):
+            res = self.client.get(RECIPES_URL, HTTP_X_PROFILE='profile:forged:signature')
+            self.assertNotIn('X-Profile-Output', res)
+
+            res = self.client.get(RECIPES_URL, HTTP_X_PROFILE=sign_profile_request())
+
+        self.assertEqual(os.listdir(self.output_dir), [res['X-Profile-Output']])
@@ -0,0 +1,40 @@
+from django.test import SimpleTestCase
+
+from core.pubsub import LocalBroker
+
+
+class LocalBrokerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.broker = LocalBroker(queue_size=2)
+
+    def test_publish_fans_out_to_channel(self):
+        """Test that every subscription of a channel receives its messages and only those"""
+        first = self.broker.subscribe('a')
+        second = self.broker.subscribe('a')
+        other = self.broker.subscribe('b')
+
+        self.broker.publish('a', 'message')
+
+        self.assertEqual(first.get(timeout=0), 'message')
+        self.assertEqual(second.get(timeout=0), 'message')
+        self.assertIsNone(other.get(timeout=0))
+
+    def test_unsubscribe(self):
+        """Test that closed subscriptions no longer receive messages"""
+        subscription = self.broker.subscribe('a')
+        subscription.close()
+
+        self.broker.publish('a', 'message')
+
+        self.assertIsNone(subscription.get(timeout=0))
+        self.assertEqual(self.broker._subscriptions, {})
+
+    def test_overflow(self):
+        """Test that a subscriber falling behind is flagged instead of blocking the publisher"""
+        subscription = self.broker.subscribe('a')
+        for i in range(3):
+            self.broker.publish('a', i)
+
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual([subscription.get(timeout=0), subscription.get(timeout=0)], [0, 1])
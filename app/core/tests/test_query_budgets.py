@@ -0,0 +1,47 @@
+import json
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from core.testing import QueryBudgets, QueryCountingAPIClient
+
+
+class QueryBudgetTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'budgets.json')
+        with open(self.path, 'w') as budget_file:
+            json.dump({'sqlite': {'GET recipe:recipe-list': 3}, 'postgresql': {'GET recipe:tag-list': 2}}, budget_file)
+
+    def test_within_budget(self):
+        """Test that calls within their budget pass"""
+        QueryBudgets(self.path, 'sqlite').check('GET recipe:recipe-list', 3)
+
+    def test_over_budget(self):
+        """Test that calls exceeding their budget or without budget fail"""
+        budgets = QueryBudgets(self.path, 'sqlite')
+
+        with self.assertRaisesMessage(AssertionError, 'executed 4 queries, its budget is 3'):
+            budgets.check('GET recipe:recipe-list', 4)
+        with self.assertRaisesMessage(AssertionError, 'has no sqlite query budget'):
+            budgets.check('GET recipe:tag-list', 1)
+
+    def test_save_observed(self):
+        """Test that saving keeps budgets of endpoints that were not called"""
+        budgets = QueryBudgets(self.path, 'sqlite')
+        budgets.update = True
+        budgets.check('GET recipe:tag-list', 1)
+        budgets.save()
+
+        with open(self.path) as budget_file:
+            self.assertEqual(json.load(budget_file), {'sqlite': {'GET recipe:recipe-list': 3, 'GET recipe:tag-list': 1},
+                                                      'postgresql': {'GET recipe:tag-list': 2}})
+
+    def test_unresolved_path(self):
+        """Test that requests to urls no view serves are not budgeted"""
+        res = QueryCountingAPIClient().get('/api/recipe/no-such-path/')
+
+        self.assertEqual(res.status_code, 404)
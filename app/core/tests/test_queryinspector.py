@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag
+from core.queryinspector import QueryInspector, sql_shape
+from recipe.views import RecipeViewSet
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def inspector_settings(**overrides):
+    """Return query inspector settings enabled for every request"""
+    return dict(settings.QUERY_INSPECTOR, **dict({'ENABLED': True, 'SAMPLE_RATE': 1.0}, **overrides))
+
+
+def unprefetched_queryset(self):
+    """Recipe queryset without prefetching, reintroducing the N+1 queries of the recipe list"""
+    return Recipe.objects.filter(user=self.request.user)
+
+
+class QueryInspectorTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for i in range(3):
+            recipe = Recipe.objects.create(user=self.user, title=f'recipe {i}', time_minutes=5, price=5)
+            recipe.tags.add(Tag.objects.create(user=self.user, name=f'tag {i}'))
+
+    def test_sql_shape(self):
+        """Test that queries differing only in parameters share a shape"""
+        self.assertEqual(
+            sql_shape('SELECT * FROM t WHERE id IN (%s, %s)  AND x = 5'),
+            sql_shape('SELECT * FROM t WHERE id IN (%s) AND x = 7'),
+        )
+
+    @patch.object(RecipeViewSet, 'get_queryset', unprefetched_queryset)
+    def test_n_plus_one_reported(self):
+        """Test that repeated queries are reported with the serializer field triggering them"""
+        with tempfile.TemporaryDirectory() as report_dir:
+            with override_settings(QUERY_INSPECTOR=inspector_settings(REPORT_DIR=report_dir)), \
+                    self.assertLogs('core.queryinspector', level='WARNING') as logs:
+                self.client.get(RECIPES_URL)
+
+            report = json.loads(logs.output[0].split('query inspector ', 1)[1])
+            fields = {field for pattern in report['n_plus_one'] for field in pattern['fields']}
+            self.assertEqual(fields, {'RecipeSerializer.tags', 'RecipeSerializer.ingredients'})
+            self.assertEqual(report['n_plus_one'][0]['count'], 3)
+            self.assertIn('in to_representation', report['n_plus_one'][0]['stack'][0])
+            self.assertEqual(len(os.listdir(report_dir)), 1)
+
+    def test_slow_queries_reported(self):
+        """Test that queries over the time threshold are reported"""
+        with override_settings(QUERY_INSPECTOR=inspector_settings(SLOW_QUERY_MS=0)), \
+                self.assertLogs('core.queryinspector', level='WARNING') as logs:
+            self.client.get(RECIPES_URL)
+
+        report = json.loads(logs.output[0].split('query inspector ', 1)[1])
+        self.assertEqual(report['n_plus_one'], [])
+        self.assertEqual(len(report['slow']), report['queries'])
+
+    def test_transaction_control_ignored(self):
+        """Test that the savepoints of atomic blocks are not reported as repeated queries"""
+        inspector = QueryInspector(slow_query_ms=1000, repeat_threshold=2)
+        with connection.execute_wrapper(inspector):
+            for _ in range(3):
+                with transaction.atomic():
+                    Tag.objects.create(user=self.user, name='tag')
+
+        report = inspector.report(RequestFactory().post(RECIPES_URL), 'recipe:tag-list')
+        statements = {pattern['shape'].split()[0] for pattern in report['n_plus_one']}
+        self.assertIn('INSERT', statements)
+        self.assertFalse(statements & {'SAVEPOINT', 'RELEASE'})
+
+    @patch.object(RecipeViewSet, 'get_queryset', unprefetched_queryset)
+    def test_unsampled_requests_ignored(self):
+        """Test that requests outside the sample are not inspected"""
+        with override_settings(QUERY_INSPECTOR=inspector_settings(SAMPLE_RATE=0)), \
+                patch('core.middleware.QueryInspector') as inspector:
+            self.client.get(RECIPES_URL)
+
+        inspector.assert_not_called()
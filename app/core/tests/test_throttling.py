@@ -0,0 +1,120 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.checks import check_throttling_cache
+from core.models import Recipe
+from core.testing import TemporaryMediaRootMixin
+
+THROTTLING = {
+    'ENABLED': True,
+    'BUCKETS': {'read': (3, 1), 'write': (1, 1), 'upload': (1, 0.1), 'token': (2, 0.5)},
+}
+TAGS_URL = reverse('recipe:tag-list')
+
+
+@override_settings(THROTTLING=THROTTLING)
+class TokenBucketThrottleTests(TemporaryMediaRootMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.now = 1000.0
+        clock = patch('core.throttling.time.time', lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def test_burst_then_retry_after(self):
+        """Test that a bucket allows its capacity at once and then tells clients when to retry"""
+        statuses = [self.client.get(TAGS_URL).status_code for _ in range(4)]
+
+        self.assertEqual(statuses, [200, 200, 200, 429])
+        self.assertEqual(self.client.get(TAGS_URL)['Retry-After'], '1')
+
+    def test_bucket_refills(self):
+        """Test that tokens are refilled at the configured rate"""
+        for _ in range(3):
+            self.client.get(TAGS_URL)
+
+        self.now += 1
+        self.assertEqual(self.client.get(TAGS_URL).status_code, 200)
+        self.assertEqual(self.client.get(TAGS_URL).status_code, 429)
+
+    def test_scopes_are_separate(self):
+        """Test that reads, writes and uploads spend from separate buckets"""
+        recipe = Recipe.objects.create(user=self.user, title='recipe', time_minutes=10, price=5)
+        upload_url = reverse('recipe:recipe-upload-image', args=[recipe.id])
+
+        self.assertEqual(self.client.post(TAGS_URL, {'name': 'Vegan'}).status_code, 201)
+        self.assertEqual(self.client.post(TAGS_URL, {'name': 'Dessert'}).status_code, 429)
+        self.assertEqual(self.client.get(TAGS_URL).status_code, 200)
+        self.assertEqual(self.client.post(upload_url, {}).status_code, 200)
+        res = self.client.post(upload_url, {})
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(res['Retry-After'], '10')
+
+    def test_chunked_upload_charged_once(self):
+        """Test that a chunked upload spends one upload token, its chunks and offset reads spend from the others"""
+        recipe = Recipe.objects.create(user=self.user, title='recipe', time_minutes=10, price=5)
+        res = self.client.post(reverse('recipe:recipe-start-upload', args=[recipe.id]), {'size': 20})
+        self.assertEqual(res.status_code, 201)
+        upload_url = reverse('recipe:recipe-upload-chunk', args=[recipe.id, res.data['id']])
+
+        self.assertEqual(self.client.get(upload_url).status_code, 200)
+        res = self.client.generic('PATCH', upload_url, b'\x89PNG\r\n\x1a\n0000',
+                                  content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET='0')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.client.get(upload_url).status_code, 200)
+        self.assertEqual(self.client.post(reverse('recipe:recipe-start-upload', args=[recipe.id]),
+                                          {'size': 20}).status_code, 429)
+
+    def test_contended_lock_fails_open(self):
+        """Test that a check not getting the bucket lock still spends a token and leaves the lock of its holder alone"""
+        lock = f'throttle:read:user:{self.user.pk}:lock'
+        cache.add(lock, 'holder', timeout=1)
+
+        with patch('core.throttling.time.sleep') as sleep:
+            res = self.client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sleep.call_count, 8)
+        self.assertEqual(cache.get(lock), 'holder')
+        self.assertIsNotNone(cache.get(f'throttle:read:user:{self.user.pk}'))
+
+    def test_process_local_cache_warning(self):
+        """Test that throttling with a cache the workers do not share is reported"""
+        self.assertEqual([warning.id for warning in check_throttling_cache(None)], ['core.W001'])
+        with override_settings(THROTTLING=dict(THROTTLING, ENABLED=False)):
+            self.assertEqual(check_throttling_cache(None), [])
+
+    def test_users_are_separate(self):
+        """Test that one client exhausting its bucket does not throttle another"""
+        for _ in range(4):
+            self.client.get(TAGS_URL)
+        other = APIClient()
+        other.force_authenticate(get_user_model().objects.create_user(email='other@test.com', password='password123'))
+
+        self.assertEqual(other.get(TAGS_URL).status_code, 200)
+
+    def test_token_issuance_throttled_by_address(self):
+        """Test that token requests are limited per address"""
+        client = APIClient()
+        payload = {'email': 'test@test.com', 'password': 'wrong'}
+        statuses = [client.post(reverse('user:token'), payload).status_code for _ in range(3)]
+
+        self.assertEqual(statuses, [400, 400, 429])
+        other_address = client.post(reverse('user:token'), payload, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(other_address.status_code, 400)
+
+    @override_settings(THROTTLING=dict(THROTTLING, ENABLED=False))
+    def test_disabled(self):
+        """Test that nothing is throttled while throttling is disabled"""
+        statuses = {self.client.get(TAGS_URL).status_code for _ in range(5)}
+
+        self.assertEqual(statuses, {200})
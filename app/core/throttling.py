@@ -0,0 +1,80 @@
+import math
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket per client and scope, THROTTLING['BUCKETS'] maps scopes to (capacity, tokens refilled per second).
+    Views pick their bucket with a throttle_scope attribute, like @action(throttle_scope='upload'), others spend
+    from read or write by request method. Authenticated clients are identified by user, anonymous ones by address.
+
+    A bucket is stored as the single cache value of the generic cell rate algorithm: the time it will be full again.
+    Each check costs a constant number of cache calls, serialized per bucket by a lock taken with cache.add. Checks
+    that cannot get the lock go ahead unserialized, so contention never throttles a client that is within its rate.
+    Buckets are only shared between the workers of a shared cache backend, see core.checks.
+    """
+    cache = cache
+    lock_attempts = 8  # waiting 1 ms, doubled per attempt, about a quarter second in total
+    lock_timeout = 1  # seconds, frees the lock of a holder that died
+
+    def get_scope(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if scope is not None:
+            return scope
+
+        return 'read' if request.method in SAFE_METHODS else 'write'
+
+    def get_client(self, request):
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+
+        return f'address:{self.get_ident(request)}'
+
+    @contextmanager
+    def _locked(self, key):
+        """
+        Hold the lock of a bucket, yielding whether it was acquired within lock_attempts. Only the holder that took
+        the lock releases it, after lock_timeout it may already belong to another request.
+        """
+        lock = f'{key}:lock'
+        holder = uuid.uuid4().hex
+        for attempt in range(self.lock_attempts):
+            if self.cache.add(lock, holder, timeout=self.lock_timeout):
+                try:
+                    yield True
+                finally:
+                    if self.cache.get(lock) == holder:
+                        self.cache.delete(lock)
+                return
+            time.sleep(0.001 * 2 ** attempt)
+        yield False
+
+    def allow_request(self, request, view):
+        if not settings.THROTTLING['ENABLED']:
+            return True
+
+        scope = self.get_scope(request, view)
+        capacity, refill_rate = settings.THROTTLING['BUCKETS'][scope]
+        interval = 1 / refill_rate  # seconds to refill one token
+        key = f'throttle:{scope}:{self.get_client(request)}'
+        # without the lock, concurrent checks may both spend the same token, a burst gets slightly more than its rate
+        with self._locked(key):
+            now = time.time()
+            full_at = max(self.cache.get(key, now), now) + interval  # once the token of this request is spent
+            if full_at - now > capacity * interval:
+                self.retry_after = full_at - now - capacity * interval
+                return False
+
+            self.cache.set(key, full_at, timeout=math.ceil(full_at - now))
+
+        return True
+
+    def wait(self):
+        return self.retry_after
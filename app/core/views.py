@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.db.models import Q
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import require_safe
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from core.batch import BatchSerializer, dispatch_all
+from core.media import image_name, serve_image
+from core.metrics import registry
+from core.models import Recipe
+
+
+def metrics(request):
+    """Expose the per endpoint metrics in prometheus text format to local scrapers only"""
+    if not settings.METRICS_ENABLED or request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _media_user(request):
+    """Return the user of a session or API token, tokens failing authentication count as anonymous"""
+    if request.user.is_authenticated:
+        return request.user
+    try:
+        user_token = TokenAuthentication().authenticate(Request(request))
+    except AuthenticationFailed:
+        return None
+
+    return user_token and user_token[0]
+
+
+@require_safe
+def media(request, path):
+    """
+    Serve a recipe image of a public recipe or one owned by the requesting user, anything else is not found.
+    The transfer is handed off to the web server when MEDIA_SERVING['BACKEND'] is set.
+    """
+    name = image_name(path)
+    if name is None:
+        raise Http404
+
+    user = _media_user(request)
+    visible = Q(visibility=Recipe.PUBLIC) | Q(user_id=user.id) if user else Q(visibility=Recipe.PUBLIC)
+    visibilities = set(Recipe.objects.filter(visible, image=name).values_list('visibility', flat=True))
+    response = serve_image(request, name, public=Recipe.PUBLIC in visibilities) if visibilities else None
+    if response is None:
+        raise Http404
+
+    return response
+
+
+@api_view(['POST'])
+@authentication_classes((TokenAuthentication,))
+@permission_classes((IsAuthenticated,))
+@throttle_classes(())  # every call is throttled by its own view
+def batch(request):
+    """Run several recipe and user API calls in one round trip, authenticating once for all of them"""
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+
+    return Response({'responses': dispatch_all(request, serializer.validated_data['requests'])})
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class RecipeConfig(AppConfig):
     name = 'recipe'
+
+    def ready(self):
+        """Connect the signal handlers keeping the recipe indexes up to date"""
+        from recipe import signals  # noqa: F401
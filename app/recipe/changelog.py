@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.bulk import update_values
+from core.models import ChangeLogEntry, Recipe
+from recipe.events import publish_changes
+
+# Change log of the recipes, tags and ingredients of every user, read by delta sync in recipe.sync.
+# Written by the receivers in recipe.signals within the transaction of the change itself, the event streams of
+# recipe.events are notified once it commits.
+
+_collected = threading.local()
+
+
+@contextmanager
+def collect_changes():
+    """
+    Record the changes made within the block once per object when it exits, instead of once per signal.
+    Wrap writes sending several signals for the same objects, like a recipe saved along with its links.
+    """
+    if getattr(_collected, 'changes', None) is not None:  # nested, the outermost block records
+        yield
+        return
+
+    _collected.changes = changes = OrderedDict()
+    try:
+        yield
+    finally:
+        _collected.changes = None
+
+    groups = OrderedDict()
+    for (user_id, model, object_id), (deleted, created) in changes.items():
+        groups.setdefault((user_id, model, deleted, created), []).append(object_id)
+    for (user_id, model, deleted, created), ids in groups.items():
+        _record(user_id, model, ids, deleted, created)
+
+
+def record_changes(user_id, model, ids, deleted=False, created=False):
+    """Record changed objects for delta sync, pass created for objects known to be new"""
+    changes = getattr(_collected, 'changes', None)
+    if changes is None:
+        _record(user_id, model, list(ids), deleted, created)
+        return
+
+    for object_id in ids:
+        previous = changes.pop((user_id, model, object_id), (deleted, created))
+        changes[(user_id, model, object_id)] = (deleted, created or previous[1])
+
+
+def _advance(user_id, count):
+    """
+    Hand out count sequence numbers of a user, returning the last one, None for soft deleted users.
+    PostgreSQL reads the counter back with the update itself, elsewhere it takes a second query.
+    """
+    User = get_user_model()
+    connection = connections[router.db_for_write(User)]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {connection.ops.quote_name(User._meta.db_table)} '
+                           'SET change_seq = change_seq + %s WHERE id = %s AND deleted_at IS NULL '
+                           'RETURNING change_seq', [count, user_id])
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    users = User.objects.filter(pk=user_id)
+    if not users.update(change_seq=F('change_seq') + count):
+        return None
+    return users.values_list('change_seq', flat=True).get()
+
+
+def _record(user_id, model, ids, deleted, created):
+    """
+    Move the change log entries of objects to the end of the change sequence of their user, inserting missing ones.
+    The user row stays locked until the transaction ends, so sequence numbers become visible in increasing order.
+    A database sequence would hand numbers out in call order instead of commit order, and a client syncing past
+    a number whose transaction has not committed yet would never see that change. The lock only serializes the
+    writes of a single user, which come from the few clients of that user.
+    Nothing is recorded for soft deleted users, their data is about to be purged.
+    """
+    last = _advance(user_id, len(ids)) if ids else None
+    if last is None:
+        return
+
+    model_name = model._meta.model_name
+    sequence = list(zip(range(last - len(ids) + 1, last + 1), ids))
+    entries = ChangeLogEntry.objects.filter(user_id=user_id, model=model_name)
+    existing = set()
+    if not created and len(ids) == 1:  # the common save of a single object, try updating before looking up
+        existing = set(ids) if entries.filter(object_id=ids[0]).update(seq=last, deleted=deleted) else set()
+    elif not created:
+        existing = set(entries.filter(object_id__in=ids).values_list('object_id', flat=True))
+        update_values(entries, 'object_id', 'seq',
+                      {object_id: seq for seq, object_id in sequence if object_id in existing}, deleted=deleted)
+
+    ChangeLogEntry.objects.bulk_create([
+        ChangeLogEntry(user_id=user_id, model=model_name, object_id=object_id, seq=seq, deleted=deleted)
+        for seq, object_id in sequence if object_id not in existing
+    ])
+
+    changes = [
+        {'seq': seq, 'model': model_name, 'id': object_id,
+         'action': 'deleted' if deleted else 'updated' if object_id in existing else 'created'}
+        for seq, object_id in sequence
+    ]
+    transaction.on_commit(lambda: publish_changes(user_id, changes))
+
+
+def touch_recipes(user_id, recipe_ids):
+    """
+    Mark recipes whose links changed as updated, link changes do not save the recipe itself.
+    Recipes already saved or touched within the same collect_changes block are left alone.
+    Returns the new updated_at, None if nothing was touched.
+    """
+    changes = getattr(_collected, 'changes', None) or {}
+    recipe_ids = [recipe_id for recipe_id in recipe_ids if (user_id, Recipe, recipe_id) not in changes]
+    if not recipe_ids:
+        return None
+
+    now = timezone.now()
+    Recipe.objects.filter(pk__in=recipe_ids).update(updated_at=now)
+    record_changes(user_id, Recipe, recipe_ids)
+
+    return now
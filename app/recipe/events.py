@@ -0,0 +1,83 @@
+import json
+import time
+
+from django.conf import settings
+from django.db import connection
+from rest_framework.renderers import BaseRenderer
+
+from core.models import ChangeLogEntry
+from core.pubsub import get_broker
+
+
+def _channel(user_id):
+    return f'recipe-changes.{user_id}'
+
+
+def _format(event_id, event, data):
+    """Format a server-sent event"""
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines += [f'event: {event}', f'data: {json.dumps(data)}']
+    return '\n'.join(lines) + '\n\n'
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets event stream views accept text/event-stream, errors before the stream starts are sent as error events"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return _format(None, 'error', data).encode()
+
+
+def publish_changes(user_id, changes):
+    """Notify the event streams of a user about committed changes, dicts of seq, model, id and action"""
+    broker = get_broker()
+    for change in changes:
+        broker.publish(_channel(user_id), change)
+
+
+def _replay(user_id, last_event_id):
+    """Return the changes missed since last_event_id from the change log, None if too many to replay"""
+    limit = settings.EVENTS['REPLAY_LIMIT']
+    entries = list(ChangeLogEntry.objects.filter(user_id=user_id, seq__gt=last_event_id).order_by('seq')[:limit + 1])
+    if len(entries) > limit:
+        return None
+
+    return [{'seq': entry.seq, 'model': entry.model, 'id': entry.object_id,
+             'action': 'deleted' if entry.deleted else 'updated'} for entry in entries]
+
+
+def event_stream(user_id, last_event_id=None):
+    """
+    Yield the server-sent events of the changes of a user until EVENTS['MAX_STREAM_SECONDS'] pass.
+    Changes missed since last_event_id are replayed first, a resync event asks the client to fall back to delta sync
+    when too many were missed or the stream could not keep up.
+    """
+    subscription = get_broker().subscribe(_channel(user_id))  # before replaying, so nothing falls in between
+    try:
+        yield f'retry: {settings.EVENTS["RETRY_MS"]}\n\n'
+
+        replayed = 0
+        if last_event_id is not None:
+            missed = _replay(user_id, last_event_id)
+            if missed is None:
+                yield _format(None, 'resync', {})
+                return
+            for change in missed:
+                yield _format(change['seq'], 'change', change)
+            replayed = missed[-1]['seq'] if missed else last_event_id
+        if not connection.in_atomic_block:
+            connection.close()  # streams are long lived, do not hold on to a database connection
+
+        deadline = time.monotonic() + settings.EVENTS['MAX_STREAM_SECONDS']
+        while time.monotonic() < deadline:
+            change = subscription.get(timeout=max(min(settings.EVENTS['KEEPALIVE'], deadline - time.monotonic()), 0))
+            if subscription.overflowed:
+                yield _format(None, 'resync', {})
+                return
+            if change is None:
+                yield ': keepalive\n\n'
+            elif change['seq'] > replayed:
+                yield _format(change['seq'], 'change', change)
+    finally:
+        subscription.close()
@@ -0,0 +1,29 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from core.bulk import update_values
+from core.models import FeedEntry, Recipe
+from recipe.serializers import FeedRecipeSerializer
+
+
+def refresh_feed(recipe_ids):
+    """Bring the feed entries of the given recipes in line with their visibility and current content"""
+    recipe_ids = set(recipe_ids)
+    if not recipe_ids:
+        return
+
+    recipes = Recipe.objects.filter(id__in=recipe_ids, visibility=Recipe.PUBLIC).prefetch_related('tags', 'ingredients')
+    payloads = {
+        recipe.id: json.dumps(FeedRecipeSerializer(recipe).data, cls=DjangoJSONEncoder) for recipe in recipes
+    }
+
+    # unpublished and deleted recipes leave the feed, published ones keep their original publication time
+    FeedEntry.objects.filter(recipe_id__in=recipe_ids - set(payloads)).delete()
+    published = set(FeedEntry.objects.filter(recipe_id__in=payloads).values_list('recipe_id', flat=True))
+    update_values(FeedEntry.objects.all(), 'recipe_id', 'payload',
+                  {recipe_id: payloads[recipe_id] for recipe_id in published})
+    FeedEntry.objects.bulk_create([
+        FeedEntry(recipe_id=recipe_id, payload=payload)
+        for recipe_id, payload in payloads.items() if recipe_id not in published
+    ])
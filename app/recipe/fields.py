@@ -0,0 +1,57 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework.relations import MANY_RELATION_KWARGS, ManyRelatedField, PrimaryKeyRelatedField
+
+
+class BulkManyRelatedField(ManyRelatedField):
+    """List of primary keys validated with a single id__in query instead of one query per key"""
+    default_error_messages = dict(
+        ManyRelatedField.default_error_messages,
+        does_not_exist='Invalid pks {pk_values} - objects do not exist.',
+        incorrect_type='Incorrect type. Expected pk values, received {data_type}.',
+    )
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        queryset = self.child_relation.get_queryset()
+        pk_field = queryset.model._meta.pk
+        pks = []
+        for item in data:
+            if isinstance(item, bool) or not isinstance(item, (int, str)):
+                self.fail('incorrect_type', data_type=type(item).__name__)
+            try:
+                pks.append(pk_field.to_python(item))
+            except DjangoValidationError:
+                self.fail('incorrect_type', data_type=type(item).__name__)
+
+        pks = list(dict.fromkeys(pks))  # drop duplicates, keep the order
+        objects = queryset.in_bulk(pks) if pks else {}
+        missing = [pk for pk in pks if pk not in objects]
+        if missing:
+            self.fail('does_not_exist', pk_values=missing)
+
+        return [objects[pk] for pk in pks]
+
+
+class UserPrimaryKeyRelatedField(PrimaryKeyRelatedField):
+    """Primary key field limited to the objects of the requesting user, validated in bulk with many=True"""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+
+        return BulkManyRelatedField(**list_kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        request = self.context.get('request')
+        if request is None or not request.user.is_authenticated:
+            return queryset.none()  # nothing to scope to, accept no ids rather than everyone's
+
+        return queryset.filter(user=request.user)
@@ -0,0 +1,357 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from heapq import nsmallest
+
+import numpy as np
+from django.core.cache import cache
+
+from core.models import Ingredient, Recipe, Tag
+
+
+def current_version(version_key, timeout):
+    """
+    Return the version counter cached at version_key, starting a missing one from the clock so values cached
+    before the counter got evicted never carry the new version
+    """
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, time.time_ns(), timeout)
+        version = cache.get(version_key)
+
+    return version
+
+
+def next_version(version_key):
+    """Increment the version counter cached at version_key and return it, None if there is no counter"""
+    try:
+        return cache.incr(version_key)
+    except ValueError:
+        return None
+
+
+class CachedUserIndex:
+    """
+    Base class for per-user indexes that are built lazily and kept in the cache.
+    Every change increments a version counter cached next to the index, an index is only used while it carries the
+    current version. A writer applies its change only on top of the version right before its own, when writers race
+    the loser leaves the index behind at an older version and the next read rebuilds it instead of losing the change.
+    Needs a cache with atomic incr, like memcached or redis, once several processes share it.
+    """
+    cache_key = None  # formatted with the user id, bump the version when the pickled layout changes
+    timeout = 60 * 60  # stale entries rebuild at the latest after an hour
+    related_models = ()  # models linked to recipes whose m2m changes the index tracks
+    local_size = 64  # indexes kept unpickled per process, reads of a current one only fetch its version
+    version = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._local = OrderedDict()
+        cls._local_lock = threading.Lock()
+
+    @classmethod
+    def _keys(cls, user_id):
+        key = cls.cache_key.format(user_id=user_id)
+        return key, f'{key}:version'
+
+    @classmethod
+    def _remember(cls, key, index):
+        """Keep an index for the reads of this process, it must not be mutated afterwards"""
+        with cls._local_lock:
+            cls._local[key] = index
+            cls._local.move_to_end(key)
+            while len(cls._local) > cls.local_size:
+                cls._local.popitem(last=False)
+
+    @classmethod
+    def build(cls, user_id):
+        """Build the index for a user from the database"""
+        raise NotImplementedError
+
+    @classmethod
+    def get(cls, user_id):
+        """Return the current index of a user, building it if necessary"""
+        key, version_key = cls._keys(user_id)
+        version = current_version(version_key, cls.timeout)
+
+        index = cls._local.get(key)
+        if index is not None and index.version == version:
+            return index
+
+        index = cache.get(key)
+        if index is None or index.version != version:
+            # changes committed while building bump the version, leaving this index stale for the next read
+            index = cls.build(user_id)
+            index.version = version
+            cache.set(key, index, cls.timeout)
+        cls._remember(key, index)
+
+        return index
+
+    @classmethod
+    def update(cls, user_id, func):
+        """Apply func to the cached index of a user, indexes that are not cached are left to be built lazily"""
+        key, version_key = cls._keys(user_id)
+        version = next_version(version_key)
+        if version is None:  # no version, so no index either
+            return
+
+        index = cache.get(key)
+        if index is not None and index.version == version - 1:
+            func(index)
+            index.version = version
+            cache.set(key, index, cls.timeout)
+            cls._remember(key, index)
+
+    @classmethod
+    def invalidate(cls, user_id):
+        """Drop the cached index of a user, an index being built concurrently is left stale"""
+        key, version_key = cls._keys(user_id)
+        next_version(version_key)
+        cache.delete(key)
+
+    def link(self, recipe_id, model, ids):
+        """Record that a recipe got linked to the model instances with the given ids"""
+        raise NotImplementedError
+
+    def link_many(self, model, pairs):
+        """Record links given as (recipe id, model instance id) pairs"""
+        grouped = {}
+        for recipe_id, pk in pairs:
+            grouped.setdefault(recipe_id, []).append(pk)
+        for recipe_id, ids in grouped.items():
+            self.link(recipe_id, model, ids)
+
+    def unlink(self, recipe_id, model, ids):
+        """Record that a recipe got unlinked from the model instances with the given ids"""
+        raise NotImplementedError
+
+    def discard_recipe(self, recipe_id):
+        """Remove a recipe and all of its links from the index"""
+        raise NotImplementedError
+
+
+def _insort(values, value):
+    """Insert value into a sorted array unless it is already present"""
+    position = bisect_left(values, value)
+    if position == len(values) or values[position] != value:
+        values.insert(position, value)
+
+
+def _discard(values, value):
+    """Remove value from a sorted array if present"""
+    position = bisect_left(values, value)
+    if position < len(values) and values[position] == value:
+        del values[position]
+
+
+def _rank_key(item):
+    recipe_id, count, coverage = item
+    return -coverage, -count, -recipe_id
+
+
+class IngredientIndex(CachedUserIndex):
+    """Inverted index of a users recipes, ingredient id -> sorted recipe ids"""
+    cache_key = 'recipe:ingredient-index:v2:{user_id}'
+    related_models = (Ingredient,)
+
+    def __init__(self):
+        self.postings = {}  # ingredient id -> sorted array of recipe ids using it
+        self.recipes = {}  # recipe id -> sorted array of its ingredient ids
+
+    @classmethod
+    def build(cls, user_id):
+        """Build the index with a single query over the recipe-ingredient links"""
+        index = cls()
+        links = Recipe.ingredients.through.objects \
+            .filter(recipe__user_id=user_id, recipe__deleted_at__isnull=True) \
+            .order_by('recipe_id', 'ingredient_id') \
+            .values_list('recipe_id', 'ingredient_id')
+
+        # links arrive sorted by recipe, so appending keeps every array sorted
+        for recipe_id, ingredient_id in links.iterator():
+            index.postings.setdefault(ingredient_id, array('l')).append(recipe_id)
+            index.recipes.setdefault(recipe_id, array('l')).append(ingredient_id)
+
+        return index
+
+    def add(self, recipe_id, ingredient_ids):
+        """Record that a recipe uses the given ingredients"""
+        ingredients = self.recipes.setdefault(recipe_id, array('l'))
+        for ingredient_id in ingredient_ids:
+            _insort(ingredients, ingredient_id)
+            _insort(self.postings.setdefault(ingredient_id, array('l')), recipe_id)
+
+    def remove(self, recipe_id, ingredient_ids):
+        """Record that a recipe no longer uses the given ingredients"""
+        ingredients = self.recipes.get(recipe_id)
+        if ingredients is None:
+            return
+
+        for ingredient_id in ingredient_ids:
+            _discard(ingredients, ingredient_id)
+            recipe_ids = self.postings.get(ingredient_id)
+            if recipe_ids is not None:
+                _discard(recipe_ids, recipe_id)
+                if not recipe_ids:
+                    del self.postings[ingredient_id]
+
+        if not ingredients:
+            del self.recipes[recipe_id]
+
+    def link(self, recipe_id, model, ids):
+        self.add(recipe_id, ids)
+
+    def unlink(self, recipe_id, model, ids):
+        self.remove(recipe_id, ids)
+
+    def discard_recipe(self, recipe_id):
+        self.remove(recipe_id, list(self.recipes.get(recipe_id, ())))
+
+    def rank(self, have, limit=None):
+        """
+        Return (recipe id, coverage) pairs ordered by the fraction of required ingredients in have.
+        Only the postings of the available ingredients are visited, recipes without any match are skipped.
+        """
+        matches = Counter()
+        for ingredient_id in set(have):
+            matches.update(self.postings.get(ingredient_id, ()))
+
+        scored = ((recipe_id, count, count / len(self.recipes[recipe_id])) for recipe_id, count in matches.items())
+        # best coverage first, more matched ingredients and newer recipes break ties
+        ranking = sorted(scored, key=_rank_key) if limit is None else nsmallest(limit, scored, key=_rank_key)
+
+        return [(recipe_id, coverage) for recipe_id, _, coverage in ranking]
+
+
+def attribute_codes(model, ids):
+    """Encode tag and ingredient ids into a single integer attribute space"""
+    return [2 * pk + (model is Ingredient) for pk in ids]
+
+
+class SimilarityIndex(CachedUserIndex):
+    """
+    Sparse recipe x attribute membership matrix of a users recipes, stored column wise as numpy arrays of rows.
+    Attributes are the tags and ingredients of a recipe, see attribute_codes.
+    """
+    cache_key = 'recipe:similarity-index:v2:{user_id}'
+    related_models = (Tag, Ingredient)
+
+    def __init__(self, row_ids=None, sizes=None, postings=None):
+        self.row_ids = np.zeros(0, dtype=np.int64) if row_ids is None else row_ids  # row -> recipe id, -1 if removed
+        self.sizes = np.zeros(0, dtype=np.int64) if sizes is None else sizes  # row -> number of attributes
+        self.postings = postings or {}  # attribute code -> array of rows having it
+        self.rows = {recipe_id: row for row, recipe_id in enumerate(self.row_ids.tolist())}
+
+    @classmethod
+    def from_links(cls, recipe_ids, codes):
+        """Build the matrix from parallel arrays of recipe ids and attribute codes without python level loops"""
+        recipe_ids = np.asarray(recipe_ids, dtype=np.int64)
+        codes = np.asarray(codes, dtype=np.int64)
+        row_ids, rows = np.unique(recipe_ids, return_inverse=True)
+        sizes = np.bincount(rows, minlength=len(row_ids)).astype(np.int64)
+
+        order = np.lexsort((rows, codes))  # the rows of every posting end up sorted
+        keys, starts = np.unique(codes[order], return_index=True)
+        postings = dict(zip(keys.tolist(), np.split(rows[order], starts[1:])))
+
+        return cls(row_ids, sizes, postings)
+
+    @classmethod
+    def build(cls, user_id):
+        """Build the index with one query per relation"""
+        recipe_ids, codes = [], []
+        for relation, column, offset in (('tags', 'tag_id', 0), ('ingredients', 'ingredient_id', 1)):
+            links = getattr(Recipe, relation).through.objects \
+                .filter(recipe__user_id=user_id, recipe__deleted_at__isnull=True) \
+                .values_list('recipe_id', column)
+            links = np.array(list(links), dtype=np.int64).reshape(-1, 2)
+            recipe_ids.append(links[:, 0])
+            codes.append(2 * links[:, 1] + offset)
+
+        return cls.from_links(np.concatenate(recipe_ids), np.concatenate(codes))
+
+    def _rows(self, recipe_ids):
+        """Return the rows of recipes, appending rows for unknown recipes in one go"""
+        recipe_ids = list(recipe_ids)
+        new = [recipe_id for recipe_id in dict.fromkeys(recipe_ids) if recipe_id not in self.rows]
+        if new:
+            self.rows.update((recipe_id, row) for row, recipe_id in enumerate(new, len(self.row_ids)))
+            self.row_ids = np.concatenate([self.row_ids, np.array(new, dtype=np.int64)])
+            self.sizes = np.concatenate([self.sizes, np.zeros(len(new), dtype=np.int64)])
+
+        return np.array([self.rows[recipe_id] for recipe_id in recipe_ids], dtype=np.int64)
+
+    def _add_links(self, rows, codes):
+        """Add links given as parallel arrays of rows and attribute codes, merging each posting once"""
+        order = np.lexsort((rows, codes))
+        rows, codes = rows[order], codes[order]
+        keys, starts = np.unique(codes, return_index=True)
+        for code, new_rows in zip(keys.tolist(), np.split(rows, starts[1:])):
+            new_rows = np.unique(new_rows)
+            current = self.postings.get(code, np.zeros(0, dtype=np.int64))
+            positions = np.searchsorted(current, new_rows)
+            added = positions == len(current)
+            added[~added] = current[positions[~added]] != new_rows[~added]
+            self.postings[code] = np.insert(current, positions[added], new_rows[added])
+            self.sizes[new_rows[added]] += 1
+
+    def link(self, recipe_id, model, ids):
+        codes = np.array(attribute_codes(model, ids), dtype=np.int64)
+        self._add_links(self._rows([recipe_id] * len(codes)), codes)
+
+    def link_many(self, model, pairs):
+        pairs = np.array(list(pairs), dtype=np.int64).reshape(-1, 2)
+        self._add_links(self._rows(pairs[:, 0].tolist()), 2 * pairs[:, 1] + (model is Ingredient))
+
+    def unlink(self, recipe_id, model, ids):
+        row = self.rows.get(recipe_id)
+        if row is None:
+            return
+
+        for code in attribute_codes(model, ids):
+            rows = self.postings.get(code)
+            if rows is None:
+                continue
+            position = np.searchsorted(rows, row)
+            if position < len(rows) and rows[position] == row:
+                self.postings[code] = np.delete(rows, position)
+                self.sizes[row] -= 1
+
+    def discard_recipe(self, recipe_id):
+        # the row stays behind as a tombstone so other rows keep their position, postings skip it at query time
+        row = self.rows.pop(recipe_id, None)
+        if row is not None:
+            self.row_ids[row] = -1
+            self.sizes[row] = 0
+
+    def similar(self, codes, limit=10, exclude=None):
+        """
+        Return (recipe id, similarity) pairs of the recipes most similar to the given attribute codes.
+        The Jaccard similarity |A & B| / |A | B| is only computed for recipes sharing at least one attribute.
+        """
+        codes = set(codes)
+        postings = [self.postings[code] for code in codes if code in self.postings]
+        if not postings or limit <= 0:
+            return []
+
+        # counting into a dense vector beats sorting the concatenated postings once staples are involved
+        counts = np.bincount(np.concatenate(postings), minlength=len(self.row_ids))
+        rows = np.flatnonzero(counts)
+        recipe_ids = self.row_ids[rows]
+        keep = recipe_ids >= 0  # tombstones of discarded recipes
+        if exclude is not None:
+            keep &= recipe_ids != exclude
+        rows, recipe_ids = rows[keep], recipe_ids[keep]
+
+        intersection = counts[rows]
+        similarity = intersection / (self.sizes[rows] + len(codes) - intersection)
+
+        if len(similarity) > limit:
+            top = np.argpartition(-similarity, limit - 1)[:limit]
+            similarity, recipe_ids = similarity[top], recipe_ids[top]
+
+        order = np.lexsort((-recipe_ids, -similarity))  # best match first, newer recipes break ties
+        return list(zip(recipe_ids[order].tolist(), similarity[order].tolist()))
@@ -0,0 +1,72 @@
+from django.db import router
+from django.db.models.signals import m2m_changed
+
+from core.models import Recipe
+
+# Direct through table writes for recipe.tags and recipe.ingredients, meant to run inside a transaction once the
+# recipe row is locked (see Recipe.bump_version), so the links read to diff against can not change before the write.
+# They send m2m_changed exactly like the related managers, so the receivers in recipe.signals keep working.
+
+
+def _relation(relation):
+    """Return the through model, related model and related column of a recipe m2m relation"""
+    through = getattr(Recipe, relation).through
+    model = Recipe._meta.get_field(relation).related_model
+    return through, model, f'{model._meta.model_name}_id'
+
+
+def _send(recipe, relation, action, pk_set):
+    """Send m2m_changed like the related manager would"""
+    through, model, _ = _relation(relation)
+    m2m_changed.send(sender=through, action=action, instance=recipe, reverse=False, model=model, pk_set=pk_set,
+                     using=router.db_for_write(through, instance=recipe))
+
+
+def _changed(recipe, relation):
+    """Forget the prefetched links of a relation that was just written"""
+    getattr(recipe, '_prefetched_objects_cache', {}).pop(relation, None)
+
+
+def _insert(recipe, relation, ids):
+    """Insert links known not to exist yet in bulk"""
+    through, _, column = _relation(relation)
+    _send(recipe, relation, 'pre_add', ids)
+    through.objects.bulk_create([through(recipe_id=recipe.id, **{column: pk}) for pk in ids])
+    _changed(recipe, relation)
+    _send(recipe, relation, 'post_add', ids)
+
+
+def add_links(recipe, relation, ids):
+    """Link a recipe to the given ids, reading only the links among those ids that already exist"""
+    through, _, column = _relation(relation)
+    ids = set(ids)
+    if ids:
+        ids -= set(through.objects.filter(recipe_id=recipe.id, **{f'{column}__in': ids}).values_list(
+            column, flat=True))
+    if ids:
+        _insert(recipe, relation, ids)
+
+
+def remove_links(recipe, relation, ids):
+    """Unlink a recipe from the given ids"""
+    through, _, column = _relation(relation)
+    ids = set(ids)
+    if ids:
+        _send(recipe, relation, 'pre_remove', ids)
+        through.objects.filter(recipe_id=recipe.id, **{f'{column}__in': ids}).delete()
+        _changed(recipe, relation)
+        _send(recipe, relation, 'post_remove', ids)
+
+
+def sync_links(recipe, relation, ids, existing=None):
+    """
+    Make the links of a recipe exactly the given ids, writing only the difference to the current links.
+    The current links are taken from existing, else read with one query.
+    """
+    through, _, column = _relation(relation)
+    ids = set(ids)
+    if existing is None:
+        existing = set(through.objects.filter(recipe_id=recipe.id).values_list(column, flat=True))
+    remove_links(recipe, relation, existing - ids)
+    if ids - existing:
+        _insert(recipe, relation, ids - existing)
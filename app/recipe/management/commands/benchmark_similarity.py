@@ -0,0 +1,48 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from recipe.indexes import SimilarityIndex
+
+
+class Command(BaseCommand):
+    """django command to benchmark the similar recipes index on synthetic data"""
+    help = 'Benchmark building and querying the recipe similarity index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, nargs='+', default=[10000, 100000])
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--ingredients', type=int, default=1000)
+        parser.add_argument('--attributes-per-recipe', type=int, default=12)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        for recipe_count in options['recipes']:
+            rng = np.random.RandomState(options['seed'])
+
+            # zipf distributed attributes, a few staples show up in most recipes like in real data
+            links = recipe_count * options['attributes_per_recipe']
+            recipe_ids = np.repeat(np.arange(1, recipe_count + 1), options['attributes_per_recipe'])
+            tag_count = options['tags']
+            attribute_ids = (rng.zipf(1.3, links) - 1) % (tag_count + options['ingredients'])
+            codes = np.where(attribute_ids < tag_count, 2 * attribute_ids, 2 * (attribute_ids - tag_count) + 1)
+            recipe_ids, codes = np.unique(np.stack([recipe_ids, codes], axis=1), axis=0).T
+
+            start = time.perf_counter()
+            index = SimilarityIndex.from_links(recipe_ids, codes)
+            build_ms = (time.perf_counter() - start) * 1000
+
+            timings = []
+            for recipe_id in rng.randint(1, recipe_count + 1, options['queries']):
+                query = codes[recipe_ids == recipe_id]
+                start = time.perf_counter()
+                index.similar(query, limit=10, exclude=recipe_id)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            self.stdout.write(
+                f'{recipe_count} recipes, {len(codes)} links: build {build_ms:.1f}ms, '
+                f'query p50 {np.percentile(timings, 50):.2f}ms p95 {np.percentile(timings, 95):.2f}ms '
+                f'max {max(timings):.2f}ms'
+            )
@@ -0,0 +1,32 @@
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import CursorPagination
+
+
+class StableOrderingFilter(OrderingFilter):
+    """Ordering filter appending the primary key as tie breaker so pages never shuffle rows with equal values"""
+
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view) or [])
+        if not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering.append('-id')
+
+        return ordering
+
+
+class RecipeCursorPagination(CursorPagination):
+    """
+    Keyset pagination for recipe lists, opt-in by passing ?page_size= so unpaginated clients keep working.
+    Pages continue from the last seen value of the first ordering field instead of an OFFSET.
+    """
+    page_size = None
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-id'
+
+
+class FeedCursorPagination(CursorPagination):
+    """Keyset pagination for the public feed, newest publications first"""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-published_at'
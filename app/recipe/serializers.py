@@ -1,5 +1,11 @@
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
-from core.models import Tag, Ingredient, Recipe
+from core.exceptions import PreconditionFailed
+from core.models import ImageUpload, Tag, Ingredient, Recipe
+from recipe.changelog import collect_changes
+from recipe.fields import UserPrimaryKeyRelatedField
+from recipe.links import add_links, remove_links, sync_links
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -7,8 +13,8 @@ class TagSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Tag
-        fields = ('id', 'name')
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'updated_at')
+        read_only_fields = ('id', 'updated_at')
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -16,20 +22,100 @@ class IngredientSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Ingredient
-        fields = ('id', 'name')
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'updated_at')
+        read_only_fields = ('id', 'updated_at')
+
+
+def save_fields(recipe, validated_data):
+    """
+    Set and save only the validated fields of a recipe, a full save would write back the version loaded with it
+    while another request may have bumped it since
+    """
+    for attr, value in validated_data.items():
+        setattr(recipe, attr, value)
+    recipe.save(update_fields=[*validated_data, 'updated_at'])
+
+    return recipe
 
 
 class RecipeSerializer(serializers.ModelSerializer):
     """Serialize a Recipe"""
-    ingredients = serializers.PrimaryKeyRelatedField(many=True, queryset=Ingredient.objects.all())
-    tags = serializers.PrimaryKeyRelatedField(many=True, queryset=Tag.objects.all())
+    ingredients = UserPrimaryKeyRelatedField(many=True, queryset=Ingredient.objects.all())
+    tags = UserPrimaryKeyRelatedField(many=True, queryset=Tag.objects.all())
     # tags = serializers.HyperlinkedRelatedField(many=True, queryset=Tag.objects.all(), view_name='tag-detail')
 
+    # incremental changes to the links, written without reading the full set of links
+    add_ingredients = UserPrimaryKeyRelatedField(many=True, queryset=Ingredient.objects.all(), write_only=True,
+                                                 required=False)
+    remove_ingredients = UserPrimaryKeyRelatedField(many=True, queryset=Ingredient.objects.all(), write_only=True,
+                                                    required=False)
+    add_tags = UserPrimaryKeyRelatedField(many=True, queryset=Tag.objects.all(), write_only=True, required=False)
+    remove_tags = UserPrimaryKeyRelatedField(many=True, queryset=Tag.objects.all(), write_only=True, required=False)
+
+    link_relations = ('ingredients', 'tags')
+
     class Meta:
         model = Recipe
-        fields = ('id', 'title', 'ingredients', 'tags', 'time_minutes', 'price', 'link')
-        read_only_fields = ('id',)
+        fields = ('id', 'title', 'ingredients', 'tags', 'time_minutes', 'price', 'link', 'visibility', 'version',
+                  'updated_at', 'add_ingredients', 'remove_ingredients', 'add_tags', 'remove_tags')
+        read_only_fields = ('id', 'version', 'updated_at')
+
+    def validate(self, attrs):
+        """Reject link changes that contradict each other"""
+        for relation in self.link_relations:
+            add, remove = attrs.get(f'add_{relation}', []), attrs.get(f'remove_{relation}', [])
+            if relation in attrs and (add or remove):
+                raise serializers.ValidationError(f'{relation} can not be combined with add_{relation} or '
+                                                  f'remove_{relation}')
+            if set(add) & set(remove):
+                raise serializers.ValidationError(f'add_{relation} and remove_{relation} overlap')
+
+        return attrs
+
+    def _pop_links(self, validated_data):
+        """Remove the link changes from validated_data, relation -> (ids to set or None, ids to add, ids to remove)"""
+        links = {}
+        for relation in self.link_relations:
+            replace = validated_data.pop(relation, None)
+            links[relation] = (
+                None if replace is None else [obj.pk for obj in replace],
+                [obj.pk for obj in validated_data.pop(f'add_{relation}', [])],
+                [obj.pk for obj in validated_data.pop(f'remove_{relation}', [])],
+            )
+
+        return links
+
+    def _save_links(self, recipe, links, created=False):
+        for relation, (replace, add, remove) in links.items():
+            if replace is not None:
+                # a new recipe has no links yet, there is nothing to diff against
+                sync_links(recipe, relation, replace, existing=set() if created else None)
+            add_links(recipe, relation, add)
+            remove_links(recipe, relation, remove)
+
+    def create(self, validated_data):
+        """Create a recipe, inserting its links in bulk"""
+        links = self._pop_links(validated_data)
+        with transaction.atomic(), collect_changes():
+            recipe = Recipe.objects.create(**validated_data)
+            self._save_links(recipe, links, created=True)
+
+        return recipe
+
+    def update(self, instance, validated_data):
+        """
+        Update a recipe, writing only the links that were added or removed.
+        Pass expected_version to save() to update only if the recipe was not modified in the meantime.
+        """
+        expected_version = validated_data.pop('expected_version', None)
+        links = self._pop_links(validated_data)
+        with transaction.atomic(), collect_changes():
+            if not instance.bump_version(expected_version):
+                raise PreconditionFailed
+            recipe = save_fields(instance, validated_data)
+            self._save_links(recipe, links)
+
+        return recipe
 
 
 class RecipeDetailSerializer(RecipeSerializer):
@@ -45,3 +131,42 @@ class RecipeImageSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ('id', 'image')
         read_only_fields = ('id',)
+
+    def update(self, instance, validated_data):
+        return save_fields(instance, validated_data)
+
+
+class ImageUploadSerializer(serializers.ModelSerializer):
+    """Serializer for starting and tracking chunked recipe image uploads"""
+
+    class Meta:
+        model = ImageUpload
+        fields = ('id', 'size', 'offset')
+        read_only_fields = ('id', 'offset')
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.IMAGE_UPLOADS['MAX_SIZE']:
+            raise serializers.ValidationError(f'Images are limited to {settings.IMAGE_UPLOADS["MAX_SIZE"]} bytes')
+
+        return value
+
+
+class RecipeCloneSerializer(serializers.Serializer):
+    """Serializer for the ids of recipes to clone in bulk"""
+    ids = serializers.ListField(child=serializers.IntegerField(), min_length=1, max_length=100)
+
+
+class RecipeBatchSerializer(serializers.Serializer):
+    """Serializer for the ids of recipes to retrieve in one request"""
+    ids = serializers.ListField(child=serializers.IntegerField(), min_length=1, max_length=500)
+
+
+class FeedRecipeSerializer(serializers.ModelSerializer):
+    """Serialize a published recipe for the public feed, tags and ingredients by name"""
+    ingredients = serializers.SlugRelatedField(many=True, read_only=True, slug_field='name')
+    tags = serializers.SlugRelatedField(many=True, read_only=True, slug_field='name')
+
+    class Meta:
+        model = Recipe
+        fields = ('id', 'title', 'ingredients', 'tags', 'time_minutes', 'price', 'link', 'image')
+        read_only_fields = fields
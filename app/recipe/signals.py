@@ -0,0 +1,248 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from core.models import FeedEntry, Ingredient, Recipe, Tag
+from recipe.feed import refresh_feed
+from recipe.indexes import IngredientIndex, SimilarityIndex
+from recipe.stats import invalidate_stats
+from recipe.changelog import record_changes, touch_recipes
+
+INDEXES = (IngredientIndex, SimilarityIndex)
+
+# sent by bulk operations inserting recipes and their links without save() or m2m_changed,
+# links maps Tag and Ingredient to (recipe_id, id) pairs of the inserted links
+recipes_bulk_created = Signal(providing_args=['user_id', 'recipe_ids', 'links'])
+
+
+def _owner_ids(recipes):
+    """Return the ids of the users owning the given recipes"""
+    return set(recipes.values_list('user_id', flat=True).distinct())
+
+
+def _published_ids(recipes):
+    """Return the ids of the public recipes among the given recipes"""
+    return list(recipes.filter(visibility=Recipe.PUBLIC).values_list('id', flat=True))
+
+
+def _invalidate_on_commit(indexes, user_ids):
+    """Drop the cached indexes of the given users once the transaction commits"""
+    transaction.on_commit(lambda: [index.invalidate(user_id) for index in indexes for user_id in user_ids])
+
+
+def _update_on_commit(indexes, user_id, func):
+    """Apply func to the cached indexes of a user once the transaction commits"""
+    transaction.on_commit(lambda: [index.update(user_id, func) for index in indexes])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_recipe_indexes(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """Keep the recipe indexes in sync with recipe.tags and recipe.ingredients"""
+    related_model = type(instance) if reverse else model
+    indexes = [index for index in INDEXES if related_model in index.related_models]
+
+    if reverse:
+        # changed from the tag/ingredient side (e.g. tag.recipe_set), rare enough to rebuild the affected indexes
+        if action == 'pre_clear':
+            instance._index_owner_ids = _owner_ids(instance.recipe_set.all())
+        elif action == 'post_clear':
+            _invalidate_on_commit(indexes, instance._index_owner_ids)
+        elif action in ('post_add', 'post_remove'):
+            _invalidate_on_commit(indexes, _owner_ids(Recipe.objects.filter(pk__in=pk_set)))
+        return
+
+    recipe_id = instance.id
+    cleared_attr = f'_cleared_{model._meta.model_name}_ids'
+    if action == 'pre_clear':
+        setattr(instance, cleared_attr, list(sender.objects.filter(recipe_id=recipe_id).values_list(
+            f'{model._meta.model_name}_id', flat=True
+        )))
+    elif action == 'post_clear':
+        ids = getattr(instance, cleared_attr)
+        _update_on_commit(indexes, instance.user_id, lambda index: index.unlink(recipe_id, model, ids))
+    elif action == 'post_add':
+        ids = list(pk_set)
+        _update_on_commit(indexes, instance.user_id, lambda index: index.link(recipe_id, model, ids))
+    elif action == 'post_remove':
+        ids = list(pk_set)
+        _update_on_commit(indexes, instance.user_id, lambda index: index.unlink(recipe_id, model, ids))
+
+
+@receiver(recipes_bulk_created, sender=Recipe)
+def update_for_bulk_created_recipes(sender, user_id, recipe_ids, links, **kwargs):
+    """Add bulk created recipes and their links to the recipe indexes and recompute the statistics"""
+    def link_all(index):
+        for model, pairs in links.items():
+            if model in index.related_models:
+                index.link_many(model, pairs)
+
+    _update_on_commit(INDEXES, user_id, link_all)
+    transaction.on_commit(lambda: invalidate_stats(user_id))
+
+
+@receiver(post_save, sender=Recipe)
+def discard_soft_deleted_recipe(sender, instance, **kwargs):
+    """Drop a soft deleted recipe from the recipe indexes"""
+    if instance.deleted_at is not None:
+        discard_deleted_recipe(sender, instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def discard_deleted_recipe(sender, instance, **kwargs):
+    """Drop a deleted recipe from the recipe indexes"""
+    recipe_id = instance.id  # the instance loses its pk before the transaction commits
+    _update_on_commit(INDEXES, instance.user_id, lambda index: index.discard_recipe(recipe_id))
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def invalidate_for_deleted_attribute(sender, instance, **kwargs):
+    """Deleting a tag or ingredient cascades to its links without sending m2m_changed, rebuild the affected indexes"""
+    indexes = [index for index in INDEXES if sender in index.related_models]
+    _invalidate_on_commit(indexes, _owner_ids(instance.recipe_set.all()))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_recipe_stats(sender, instance, **kwargs):
+    """Recompute the recipe statistics of a user after any of their recipes, tags or ingredients changed"""
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_stats(user_id))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def invalidate_recipe_stats_for_links(sender, instance, action, **kwargs):
+    """Recompute the recipe statistics of a user after recipe tags or ingredients changed"""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        user_id = instance.user_id
+        transaction.on_commit(lambda: invalidate_stats(user_id))
+
+
+# the public feed lives in the database, so it is refreshed within the transaction of the change itself
+
+@receiver(post_save, sender=Recipe)
+def refresh_feed_for_recipe(sender, instance, created, update_fields, **kwargs):
+    """Publish, refresh or unpublish a saved recipe in the public feed"""
+    saved_visibility = update_fields is None or 'visibility' in update_fields
+    if instance.visibility == Recipe.PUBLIC:
+        refresh_feed([instance.id])
+    # only recipes that were public have a feed entry, the visibility of recipes not loaded from the db is unknown
+    elif saved_visibility and not created and getattr(instance, '_saved_visibility', Recipe.PUBLIC) == Recipe.PUBLIC:
+        FeedEntry.objects.filter(recipe_id=instance.id).delete()
+
+    if saved_visibility:
+        instance._saved_visibility = instance.visibility
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def refresh_feed_for_links(sender, instance, action, reverse, pk_set, **kwargs):
+    """Refresh the feed entries of published recipes whose tags or ingredients changed"""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear') and instance.visibility == Recipe.PUBLIC:
+            refresh_feed([instance.id])
+    elif action == 'pre_clear':
+        instance._feed_recipe_ids = _published_ids(instance.recipe_set.all())
+    elif action == 'post_clear':
+        refresh_feed(instance._feed_recipe_ids)
+    elif action in ('post_add', 'post_remove'):
+        refresh_feed(_published_ids(Recipe.objects.filter(pk__in=pk_set)))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def refresh_feed_for_attribute(sender, instance, created, **kwargs):
+    """Refresh the feed entries of published recipes showing a renamed tag or ingredient"""
+    if not created:
+        refresh_feed(_published_ids(instance.recipe_set.all()))
+
+
+@receiver(post_save, sender=get_user_model())
+def unpublish_for_deleted_user(sender, instance, **kwargs):
+    """Take the recipes of a soft deleted account off the feed, the recipes themselves are purged later"""
+    if instance.deleted_at is not None:
+        FeedEntry.objects.filter(recipe__user=instance).delete()
+        user_id = instance.id
+        _invalidate_on_commit(INDEXES, [user_id])
+        transaction.on_commit(lambda: invalidate_stats(user_id))
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def collect_feed_for_deleted_attribute(sender, instance, **kwargs):
+    """Remember the published recipes of a tag or ingredient whose links the deletion cascades to"""
+    instance._feed_recipe_ids = _published_ids(instance.recipe_set.all())
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def refresh_feed_for_deleted_attribute(sender, instance, **kwargs):
+    """Drop a deleted tag or ingredient from the feed entries of its published recipes"""
+    refresh_feed(instance._feed_recipe_ids)
+
+
+# the delta sync change log, see recipe.changelog, is written within the transaction of the change itself
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def record_saved_change(sender, instance, created, **kwargs):
+    """Record a saved recipe, tag or ingredient for delta sync, soft deleted recipes as tombstones"""
+    deleted = getattr(instance, 'deleted_at', None) is not None
+    record_changes(instance.user_id, sender, [instance.id], deleted=deleted, created=created)
+
+
+@receiver(pre_delete, sender=Recipe)
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def record_deleted_change(sender, instance, **kwargs):
+    """
+    Leave a tombstone for a deleted recipe, tag or ingredient unless soft deletion already did.
+    Recorded before the delete, so entries of a user deleted along with them are removed by the same cascade.
+    """
+    if getattr(instance, 'deleted_at', None) is None:
+        record_changes(instance.user_id, sender, [instance.id], deleted=True)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def record_link_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Record the recipes whose tags or ingredients changed for delta sync"""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            instance.updated_at = touch_recipes(instance.user_id, [instance.id]) or instance.updated_at
+    elif action == 'pre_clear':
+        instance._sync_recipes = list(instance.recipe_set.values_list('user_id', 'id'))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        recipes = instance._sync_recipes if action == 'post_clear' else Recipe.objects.filter(
+            pk__in=pk_set).values_list('user_id', 'id')
+        _touch_grouped(recipes)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def record_sync_for_deleted_attribute(sender, instance, **kwargs):
+    """Record the recipes about to lose a deleted tag or ingredient for delta sync, the deletion cascades to links"""
+    _touch_grouped(instance.recipe_set.values_list('user_id', 'id'))
+
+
+@receiver(recipes_bulk_created, sender=Recipe)
+def record_bulk_created_recipes(sender, user_id, recipe_ids, **kwargs):
+    """Record bulk created recipes for delta sync, saved one by one on backends without bulk insert ids"""
+    record_changes(user_id, Recipe, recipe_ids)
+
+
+def _touch_grouped(recipes):
+    """Touch (user_id, recipe_id) pairs user by user"""
+    grouped = {}
+    for user_id, recipe_id in recipes:
+        grouped.setdefault(user_id, []).append(recipe_id)
+    for user_id, recipe_ids in grouped.items():
+        touch_recipes(user_id, recipe_ids)
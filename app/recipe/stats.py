@@ -0,0 +1,89 @@
+from django.core.cache import cache
+from django.db.models import Avg, Count, Q
+
+from core.models import Ingredient, Recipe, Tag
+from recipe.indexes import current_version, next_version
+
+# cached as (version, statistics), only served while the version still matches the counter at {key}:version,
+# which invalidate_stats increments, like the versions of recipe.indexes.CachedUserIndex
+CACHE_KEY = 'recipe:stats:v2:{user_id}'
+CACHE_TIMEOUT = 60 * 60
+
+# lower bounds of the histogram buckets, the last bucket is open ended
+TIME_MINUTES_BINS = (0, 15, 30, 60, 120)
+PRICE_BINS = (0, 5, 10, 20, 50)
+
+
+def _histogram_aggregates(field, bins):
+    """Return one filtered COUNT per bucket so a whole histogram is computed in the aggregate query"""
+    aggregates = {}
+    for position, lower in enumerate(bins):
+        condition = Q(**{f'{field}__gte': lower})
+        if position + 1 < len(bins):
+            condition &= Q(**{f'{field}__lt': bins[position + 1]})
+        aggregates[f'{field}_{position}'] = Count('id', filter=condition)
+
+    return aggregates
+
+
+def _histogram(totals, field, bins):
+    """Pick the bucket counts of a histogram out of the aggregate results"""
+    return [
+        {'min': lower, 'max': bins[position + 1] if position + 1 < len(bins) else None,
+         'count': totals.pop(f'{field}_{position}')}
+        for position, lower in enumerate(bins)
+    ]
+
+
+def _per_attribute(model, user):
+    """Return recipe count and averages for every tag or ingredient of a user in a single grouped query"""
+    own_recipes = Q(recipe__user=user, recipe__deleted_at__isnull=True)  # joins bypass the recipe manager
+    return list(
+        model.objects.filter(user=user)
+        .annotate(
+            recipe_count=Count('recipe', filter=own_recipes),
+            avg_time_minutes=Avg('recipe__time_minutes', filter=own_recipes),
+            avg_price=Avg('recipe__price', filter=own_recipes),
+        )
+        .order_by('-recipe_count', 'name')
+        .values('id', 'name', 'recipe_count', 'avg_time_minutes', 'avg_price')
+    )
+
+
+def compute_stats(user):
+    """Compute the recipe statistics of a user with three aggregate queries"""
+    totals = Recipe.objects.filter(user=user).aggregate(
+        count=Count('id'),
+        avg_time_minutes=Avg('time_minutes'),
+        avg_price=Avg('price'),
+        **_histogram_aggregates('time_minutes', TIME_MINUTES_BINS),
+        **_histogram_aggregates('price', PRICE_BINS),
+    )
+    totals['time_minutes_histogram'] = _histogram(totals, 'time_minutes', TIME_MINUTES_BINS)
+    totals['price_histogram'] = _histogram(totals, 'price', PRICE_BINS)
+    totals['tags'] = _per_attribute(Tag, user)
+    totals['ingredients'] = _per_attribute(Ingredient, user)
+
+    return totals
+
+
+def get_stats(user):
+    """Return the cached recipe statistics of a user, computing them if necessary"""
+    key = CACHE_KEY.format(user_id=user.id)
+    version = current_version(f'{key}:version', CACHE_TIMEOUT)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    # an invalidation while computing increments the version, leaving these statistics stale for the next read
+    stats = compute_stats(user)
+    cache.set(key, (version, stats), CACHE_TIMEOUT)
+
+    return stats
+
+
+def invalidate_stats(user_id):
+    """Drop the cached recipe statistics of a user, statistics being computed concurrently are left stale"""
+    key = CACHE_KEY.format(user_id=user_id)
+    next_version(f'{key}:version')
+    cache.delete(key)
@@ -0,0 +1,34 @@
+from core.models import ChangeLogEntry, Ingredient, Recipe, Tag
+from recipe.serializers import IngredientSerializer, RecipeSerializer, TagSerializer
+
+# payload key, model, serializer and relations to prefetch of the objects returned by delta sync
+SYNCED_MODELS = (
+    ('recipes', Recipe, RecipeSerializer, ('tags', 'ingredients')),
+    ('tags', Tag, TagSerializer, ()),
+    ('ingredients', Ingredient, IngredientSerializer, ()),
+)
+
+
+def changes_since(user, since, limit, context=None):
+    """
+    Return the objects of a user changed after the sequence number since, at most limit of them, and the cursor
+    to pass as since next time. Deleted objects are only listed by id. Runs a fixed number of queries backed by
+    the (user, seq) index, whatever the size of the collection.
+    """
+    entries = list(ChangeLogEntry.objects.filter(user=user, seq__gt=since).order_by('seq')[:limit + 1])
+    changes = {
+        'cursor': entries[:limit][-1].seq if entries else since,
+        'has_more': len(entries) > limit,
+        'deleted': {},
+    }
+
+    entries = entries[:limit]
+    for key, model, serializer_class, prefetch in SYNCED_MODELS:
+        model_entries = [entry for entry in entries if entry.model == model._meta.model_name]
+        objects = model.objects.filter(user=user).prefetch_related(*prefetch).in_bulk(
+            [entry.object_id for entry in model_entries if not entry.deleted])
+        changes[key] = serializer_class([objects[entry.object_id] for entry in model_entries
+                                         if entry.object_id in objects], many=True, context=context).data
+        changes['deleted'][key] = [entry.object_id for entry in model_entries if entry.object_id not in objects]
+
+    return changes
@@ -0,0 +1,104 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe, Tag
+
+EVENTS_URL = reverse('recipe:events')
+EVENTS = {'BACKEND': 'core.pubsub.LocalBroker', 'QUEUE_SIZE': 100, 'KEEPALIVE': 0.05, 'MAX_STREAM_SECONDS': 1,
+          'RETRY_MS': 3000, 'REPLAY_LIMIT': 2}
+
+
+def parse_event(chunk):
+    """Return the id, event name and data of a server-sent event"""
+    fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+    return fields.get('id'), fields['event'], json.loads(fields['data'])
+
+
+@override_settings(EVENTS=EVENTS)
+class EventStreamTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def open_stream(self, **extra):
+        """Open the event stream and read past its retry field"""
+        res = self.client.get(EVENTS_URL, HTTP_ACCEPT='text/event-stream', **extra)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.addCleanup(res.close)
+        stream = iter(res.streaming_content)
+        self.assertEqual(next(stream), b'retry: 3000\n\n')
+        return res, stream
+
+    def next_event(self, stream):
+        """Return the next event of a stream, skipping keepalive comments"""
+        for chunk in stream:
+            if not chunk.startswith(b':'):
+                return parse_event(chunk.decode())
+
+    def test_stream_requires_authentication(self):
+        """Test that anonymous clients get an error instead of a stream"""
+        self.client.force_authenticate(None)
+
+        res = self.client.get(EVENTS_URL, HTTP_ACCEPT='text/event-stream')
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertTrue(res.content.startswith(b'event: error'))
+
+    def test_changes_pushed(self):
+        """Test that created, updated and deleted objects are pushed once their transaction commits"""
+        res, stream = self.open_stream()
+        self.assertEqual(res['Content-Type'], 'text/event-stream')
+
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        tag_id = tag.id
+        created = self.next_event(stream)
+        tag.name = 'Vegetarian'
+        tag.save()
+        updated = self.next_event(stream)
+        tag.delete()
+        deleted = self.next_event(stream)
+
+        seq = get_user_model().objects.get(id=self.user.id).change_seq
+        self.assertEqual(created, (str(seq - 2), 'change',
+                                   {'seq': seq - 2, 'model': 'tag', 'id': tag_id, 'action': 'created'}))
+        self.assertEqual(updated[2]['action'], 'updated')
+        self.assertEqual(deleted, (str(seq), 'change', {'seq': seq, 'model': 'tag', 'id': tag_id,
+                                                        'action': 'deleted'}))
+
+    @override_settings(EVENTS=dict(EVENTS, MAX_STREAM_SECONDS=0.3))
+    def test_other_users_changes_not_pushed(self):
+        """Test that a stream only carries the changes of its user and ends after MAX_STREAM_SECONDS"""
+        other = get_user_model().objects.create_user(email='other@test.com', password='password123')
+        res, stream = self.open_stream()
+
+        Ingredient.objects.create(user=other, name='Salt')
+
+        self.assertEqual(set(stream), {b': keepalive\n\n'})
+
+    def test_missed_changes_replayed(self):
+        """Test that a reconnecting client receives the changes after its Last-Event-ID"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        seq = get_user_model().objects.get(id=self.user.id).change_seq
+        recipe = Recipe.objects.create(user=self.user, title='recipe', time_minutes=10, price=5)
+
+        res, stream = self.open_stream(HTTP_LAST_EVENT_ID=str(seq))
+        replayed = self.next_event(stream)
+
+        self.assertEqual(replayed, (str(seq + 1), 'change',
+                                    {'seq': seq + 1, 'model': 'recipe', 'id': recipe.id, 'action': 'updated'}))
+
+    def test_resync_when_too_many_missed(self):
+        """Test that clients missing more changes than can be replayed are asked to resync"""
+        for i in range(3):
+            Tag.objects.create(user=self.user, name=f'tag{i}')
+
+        res, stream = self.open_stream(HTTP_LAST_EVENT_ID='0')
+
+        self.assertEqual(self.next_event(stream), (None, 'resync', {}))
@@ -0,0 +1,151 @@
+import warnings
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TransactionTestCase
+
+from core.models import Ingredient, Recipe, Tag
+from recipe.cloning import clone_recipes
+from recipe.indexes import IngredientIndex, SimilarityIndex, attribute_codes
+from recipe.links import add_links, remove_links, sync_links
+
+
+class IngredientIndexTests(TransactionTestCase):
+    """Test that the cached ingredient index follows committed changes"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.eggs = Ingredient.objects.create(user=self.user, name='eggs')
+        self.milk = Ingredient.objects.create(user=self.user, name='milk')
+        self.recipe = Recipe.objects.create(user=self.user, title='pancakes', time_minutes=10, price=5)
+        self.recipe.ingredients.add(self.eggs)
+        IngredientIndex.get(self.user.id)  # build and cache the index before the changes under test
+
+    def test_add_ingredient(self):
+        """Test that added ingredients are indexed"""
+        self.recipe.ingredients.add(self.milk)
+
+        index = IngredientIndex.get(self.user.id)
+        self.assertEqual(list(index.postings[self.milk.id]), [self.recipe.id])
+        self.assertEqual(index.rank([self.eggs.id]), [(self.recipe.id, 0.5)])
+
+    def test_remove_and_clear_ingredients(self):
+        """Test that removed ingredients are dropped from the index"""
+        self.recipe.ingredients.add(self.milk)
+        self.recipe.ingredients.remove(self.eggs)
+        self.assertNotIn(self.eggs.id, IngredientIndex.get(self.user.id).postings)
+
+        self.recipe.ingredients.clear()
+        self.assertEqual(IngredientIndex.get(self.user.id).recipes, {})
+
+    def test_delete_recipe(self):
+        """Test that deleted recipes are dropped from the index"""
+        self.recipe.delete()
+
+        self.assertEqual(IngredientIndex.get(self.user.id).rank([self.eggs.id]), [])
+
+    def test_link_helpers(self):
+        """Test that direct through table writes are indexed"""
+        add_links(self.recipe, 'ingredients', [self.milk.id])
+        self.assertEqual(list(IngredientIndex.get(self.user.id).recipes[self.recipe.id]), [self.eggs.id, self.milk.id])
+
+        remove_links(self.recipe, 'ingredients', [self.eggs.id])
+        self.assertEqual(list(IngredientIndex.get(self.user.id).recipes[self.recipe.id]), [self.milk.id])
+
+        sync_links(self.recipe, 'ingredients', [self.eggs.id])
+        self.assertEqual(list(IngredientIndex.get(self.user.id).recipes[self.recipe.id]), [self.eggs.id])
+
+    def test_racing_updates(self):
+        """Test that an update racing another one leaves the index to be rebuilt rather than losing a change"""
+        other = Recipe.objects.create(user=self.user, title='omelette', time_minutes=5, price=2)
+
+        def racing_add(index):
+            other.ingredients.add(self.eggs)  # another worker updates the index meanwhile
+            index.add(self.recipe.id, [self.milk.id])
+
+        Recipe.ingredients.through.objects.create(recipe=self.recipe, ingredient=self.milk)
+        IngredientIndex.update(self.user.id, racing_add)
+
+        index = IngredientIndex.get(self.user.id)
+        self.assertEqual(list(index.postings[self.eggs.id]), [self.recipe.id, other.id])
+        self.assertEqual(list(index.postings[self.milk.id]), [self.recipe.id])
+
+    def test_invalidate_during_build(self):
+        """Test that an index built from data changing meanwhile is not used"""
+        build = IngredientIndex.build
+
+        def build_then_change(user_id):
+            index = build(user_id)
+            self.recipe.ingredients.add(self.milk)  # commits, the index built above misses it
+            return index
+
+        IngredientIndex.invalidate(self.user.id)
+        with patch.object(IngredientIndex, 'build', build_then_change):
+            IngredientIndex.get(self.user.id)
+
+        self.assertEqual(list(IngredientIndex.get(self.user.id).recipes[self.recipe.id]), [self.eggs.id, self.milk.id])
+
+    def test_cloned_recipe(self):
+        """Test that bulk cloned recipes are indexed"""
+        clone, = clone_recipes([self.recipe])
+
+        self.assertEqual(list(IngredientIndex.get(self.user.id).postings[self.eggs.id]), [self.recipe.id, clone.id])
+        self.assertEqual(SimilarityIndex.get(self.user.id).similar(
+            attribute_codes(Ingredient, [self.eggs.id]), exclude=self.recipe.id), [(clone.id, 1.0)])
+
+
+class SimilarityIndexTests(TransactionTestCase):
+    """Test the similarity index and that it follows committed changes"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.vegan = Tag.objects.create(user=self.user, name='vegan')
+        self.tofu = Ingredient.objects.create(user=self.user, name='tofu')
+        self.recipe1 = Recipe.objects.create(user=self.user, title='recipe1', time_minutes=10, price=5)
+        self.recipe2 = Recipe.objects.create(user=self.user, title='recipe2', time_minutes=10, price=5)
+        self.recipe1.tags.add(self.vegan)
+        self.recipe1.ingredients.add(self.tofu)
+        SimilarityIndex.get(self.user.id)
+
+    def test_jaccard_similarity(self):
+        """Test that similarity is the Jaccard index of the attribute sets"""
+        index = SimilarityIndex.from_links([1, 1, 2, 2, 2, 3], [2, 3, 2, 3, 5, 7])
+
+        self.assertEqual(index.similar([2, 3], exclude=1), [(2, 2 / 3)])
+        self.assertEqual(index.similar([2, 3, 7], limit=1), [(1, 2 / 3)])
+
+    def test_links_are_tracked(self):
+        """Test that tag and ingredient changes update the cached index"""
+        self.recipe2.tags.add(self.vegan)
+        codes = attribute_codes(Tag, [self.vegan.id]) + attribute_codes(Ingredient, [self.tofu.id])
+
+        similar = SimilarityIndex.get(self.user.id).similar(codes, exclude=self.recipe1.id)
+        self.assertEqual(similar, [(self.recipe2.id, 0.5)])
+
+        self.recipe2.tags.clear()
+        self.assertEqual(SimilarityIndex.get(self.user.id).similar(codes, exclude=self.recipe1.id), [])
+
+    def test_delete_recipe(self):
+        """Test that deleted recipes are never returned"""
+        self.recipe1.delete()
+
+        codes = attribute_codes(Tag, [self.vegan.id])
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')  # the tombstone left behind must not be divided by
+            self.assertEqual(SimilarityIndex.get(self.user.id).similar(codes), [])
+
+    def test_link_and_unlink(self):
+        """Test that links added one by one or in bulk match an index built from scratch"""
+        index = SimilarityIndex.from_links([1, 2], [2, 4])
+        index.link(3, Tag, [1, 2])
+        index.link_many(Tag, [(1, 1), (2, 1), (4, 3), (1, 1)])
+        index.link(1, Tag, [1])
+        index.unlink(2, Tag, [1, 5])
+
+        self.assertEqual(index.row_ids.tolist(), [1, 2, 3, 4])
+        self.assertEqual(index.sizes.tolist(), [1, 1, 2, 1])
+        self.assertEqual({code: rows.tolist() for code, rows in index.postings.items()},
+                         {2: [0, 2], 4: [1, 2], 6: [3]})
@@ -2,7 +2,7 @@ from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.test import TestCase
 from rest_framework import status
-from rest_framework.test import APIClient
+from core.testing import QueryCountAssertionsMixin, QueryCountingAPIClient
 from core.models import Ingredient, Recipe
 from recipe.serializers import IngredientSerializer
 
@@ -13,7 +13,7 @@ class PublicIngredientsApiTests(TestCase):
     """Test the publicly available ingredients api"""
 
     def setUp(self):
-        self.client = APIClient()
+        self.client = QueryCountingAPIClient()
 
     def test_login_required(self):
         """Test that login is required for retrieving ingredients"""
@@ -21,12 +21,12 @@ class PublicIngredientsApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class PrivateIngredientsApiTests(TestCase):
+class PrivateIngredientsApiTests(QueryCountAssertionsMixin, TestCase):
     """Test private ingredients API"""
 
     def setUp(self):
         self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
-        self.client = APIClient()
+        self.client = QueryCountingAPIClient()
         self.client.force_authenticate(self.user)
 
     def test_retrieve_ingredient_list(self):
@@ -98,3 +98,12 @@ class PrivateIngredientsApiTests(TestCase):
         # assigned_only is a filter, meaning only ingredients assigned to recipes will be returned (0 or 1)
         res = self.client.get(INGREDIENTS_URL, {'assigned_only': 1})
         self.assertEqual(len(res.data), 1)  # this is why we need second ingredient, otherwise always 1
+
+    def test_list_queries_constant(self):
+        """Test that listing ingredients assigned to recipes does not issue queries per ingredient"""
+        recipe = Recipe.objects.create(user=self.user, title='recipe', time_minutes=5, price=5)
+
+        def add_ingredient(i):
+            recipe.ingredients.add(Ingredient.objects.create(user=self.user, name=f'ingredient {i}'))
+
+        self.assertConstantQueries(self.client, INGREDIENTS_URL, add_ingredient, params={'assigned_only': 1})
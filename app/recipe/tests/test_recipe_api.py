@@ -1,15 +1,34 @@
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from unittest.mock import patch
 from rest_framework import status
 from rest_framework.test import APIClient
-from core.models import Recipe, Tag, Ingredient
-from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from core.testing import QueryCountAssertionsMixin, QueryCountingAPIClient, TemporaryMediaRootMixin
+from core.models import ImageUpload, Recipe, Tag, Ingredient, recipe_image_storage
+from recipe.feed import refresh_feed
+from recipe import stats
+from recipe.serializers import RecipeSerializer, RecipeDetailSerializer, RecipeImageSerializer
+from recipe.views import RecipeViewSet
+import fcntl
 import tempfile
+import io
 import os
+from datetime import timedelta
 from PIL import Image
 
 RECIPES_URL = reverse('recipe:recipe-list')
+COOKABLE_URL = reverse('recipe:recipe-cookable')
+STATS_URL = reverse('recipe:recipe-stats')
+CLONE_MANY_URL = reverse('recipe:recipe-clone-many')
+BATCH_URL = reverse('recipe:recipe-batch')
+FEED_URL = reverse('recipe:recipe-feed')
+TAGS_URL = reverse('recipe:tag-list')
 
 
 def image_upload_url(recipe_id):
@@ -17,6 +36,27 @@ def image_upload_url(recipe_id):
     return reverse('recipe:recipe-upload-image', args=[recipe_id])
 
 
+def similar_url(recipe_id):
+    """Return the similar recipes URL"""
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+def clone_url(recipe_id):
+    """Return the recipe clone URL"""
+    return reverse('recipe:recipe-clone', args=[recipe_id])
+
+
+def start_upload_url(recipe_id):
+    """Return the URL starting a chunked image upload"""
+    return reverse('recipe:recipe-start-upload', args=[recipe_id])
+
+
+def upload_url(recipe_id, upload_id, finalize=False):
+    """Return the URL of a chunked image upload, or of its finalization"""
+    name = 'recipe:recipe-finalize-upload' if finalize else 'recipe:recipe-upload-chunk'
+    return reverse(name, args=[recipe_id, upload_id])
+
+
 def detail_url(recipe_id):
     """Return the recipe detail URL"""
     return reverse('recipe:recipe-detail', args=[recipe_id])
@@ -50,7 +90,7 @@ class PublicRecipeApiTests(TestCase):
     """Test unauthenticated API access"""
 
     def setUp(self):
-        self.client = APIClient()
+        self.client = QueryCountingAPIClient()
 
     def test_login_required(self):
         """Test that login is required for retrieving ingredients"""
@@ -58,12 +98,12 @@ class PublicRecipeApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class PrivateIngredientsApiTests(TestCase):
+class PrivateIngredientsApiTests(QueryCountAssertionsMixin, TestCase):
     """Test private ingredients API"""
 
     def setUp(self):
         self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
-        self.client = APIClient()
+        self.client = QueryCountingAPIClient()
         self.client.force_authenticate(self.user)
 
     def test_retrieve_recipes(self):
@@ -164,6 +204,31 @@ class PrivateIngredientsApiTests(TestCase):
         self.assertIn(ingredient1, ingredients)
         self.assertIn(ingredient2, ingredients)
 
+    def test_create_recipe_ids_validated_in_bulk(self):
+        """Test that the query count of a create does not depend on the number of ingredients"""
+        ingredients = [sample_ingredient(user=self.user, name=f'ingredient{i}') for i in range(50)]
+        payload = {'title': 'Stew', 'time_minutes': 60, 'price': 8, 'tags': []}
+
+        one = self.client.post(RECIPES_URL, dict(payload, ingredients=[ingredients[0].id]), format='json')
+        many = self.client.post(RECIPES_URL, dict(payload, ingredients=[i.id for i in ingredients]), format='json')
+
+        self.assertEqual(many.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Recipe.objects.get(id=many.data['id']).ingredients.count(), 50)
+        self.assertEqual(one.query_count, many.query_count)
+
+    def test_create_recipe_with_foreign_ids(self):
+        """Test that ids of other users and unknown ids are reported together"""
+        other = get_user_model().objects.create_user(email='other@test.com', password='password123')
+        own_tag = sample_tag(user=self.user)
+        other_tag = sample_tag(user=other)
+        payload = {'title': 'Stew', 'time_minutes': 60, 'price': 8, 'tags': [own_tag.id, other_tag.id, 9999]}
+
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str([other_tag.id, 9999]), res.data['tags'][0])
+        self.assertFalse(Recipe.objects.exists())
+
     def test_partial_update_recipe(self):
         """Test updating a recipe with PATCH"""
         recipe = sample_recipe(user=self.user)
@@ -203,6 +268,82 @@ class PrivateIngredientsApiTests(TestCase):
         tags = recipe.tags.all()
         self.assertEqual(len(tags), 0)
 
+    def test_update_recipe_diffs_links(self):
+        """Test that replacing the tags keeps the links that stay"""
+        recipe = sample_recipe(user=self.user)
+        tag1, tag2, tag3 = (sample_tag(user=self.user, name=f'tag{i}') for i in range(3))
+        recipe.tags.add(tag1, tag2)
+        kept = Recipe.tags.through.objects.get(recipe=recipe, tag=tag2)
+
+        res = self.client.patch(detail_url(recipe.id), {'tags': [tag2.id, tag3.id]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(res.data['tags']), [tag2.id, tag3.id])
+        self.assertTrue(Recipe.tags.through.objects.filter(id=kept.id, tag=tag2).exists())
+
+    def test_update_recipe_links_added_concurrently(self):
+        """Test that links are diffed against the links current once the recipe is locked, not when it was read"""
+        recipe = sample_recipe(user=self.user)
+        tag1, tag2 = sample_tag(user=self.user, name='tag1'), sample_tag(user=self.user, name='tag2')
+        recipe.tags.add(tag1)
+        bump_version = Recipe.bump_version
+        client = APIClient()  # the queries of the concurrent write do not count against the endpoint budgets
+        client.force_authenticate(self.user)
+
+        def add_concurrently(instance, *args, **kwargs):
+            Recipe.tags.through.objects.get_or_create(recipe_id=recipe.id, tag_id=tag2.id)
+            return bump_version(instance, *args, **kwargs)
+
+        with patch.object(Recipe, 'bump_version', add_concurrently):
+            res = client.patch(detail_url(recipe.id), {'tags': [tag1.id, tag2.id]}, format='json')
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            res = client.put(detail_url(recipe.id), {'title': 'put', 'time_minutes': 5, 'price': 1,
+                                                     'tags': [tag1.id], 'ingredients': []}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(recipe.tags.values_list('id', flat=True)), [tag1.id])
+
+    def test_update_recipe_add_and_remove_links(self):
+        """Test incremental link changes with add_ and remove_ fields"""
+        recipe = sample_recipe(user=self.user)
+        tag1, tag2 = sample_tag(user=self.user, name='tag1'), sample_tag(user=self.user, name='tag2')
+        ingredient = sample_ingredient(user=self.user)
+        recipe.tags.add(tag1)
+
+        payload = {'add_tags': [tag2.id, tag1.id], 'remove_tags': [], 'add_ingredients': [ingredient.id]}
+        res = self.client.patch(detail_url(recipe.id), payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(res.data['tags']), [tag1.id, tag2.id])
+        self.assertEqual(res.data['ingredients'], [ingredient.id])
+        self.assertNotIn('add_tags', res.data)
+
+        res = self.client.patch(detail_url(recipe.id), {'remove_tags': [tag1.id]}, format='json')
+        self.assertEqual(res.data['tags'], [tag2.id])
+
+    def test_update_recipe_conflicting_links(self):
+        """Test that replacing and incrementally changing the same links is rejected"""
+        recipe = sample_recipe(user=self.user)
+        tag = sample_tag(user=self.user)
+        url = detail_url(recipe.id)
+
+        res = self.client.patch(url, {'tags': [tag.id], 'add_tags': [tag.id]}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.patch(url, {'add_tags': [tag.id], 'remove_tags': [tag.id]}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delete_recipe(self):
+        """Test that deleted recipes disappear from the API and the feed but stay until they are purged"""
+        recipe = sample_recipe(user=self.user, visibility=Recipe.PUBLIC)
+        recipe.tags.add(sample_tag(user=self.user))
+
+        res = self.client.delete(detail_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(RECIPES_URL).data, [])
+        self.assertEqual(self.client.get(FEED_URL).data['results'], [])
+        self.assertEqual(self.client.get(TAGS_URL, {'assigned_only': 1}).data, [])
+        self.assertTrue(Recipe.all_objects.filter(id=recipe.id).exists())
+
     def test_filter_recipes_by_tags(self):
         """Test returning recipes with specific tags"""
         recipe1 = sample_recipe(user=self.user, title='bla1')
@@ -245,12 +386,72 @@ class PrivateIngredientsApiTests(TestCase):
         self.assertIn(serializer2.data, res.data)
         self.assertNotIn(serializer3.data, res.data)
 
+    def test_list_queries_constant(self):
+        """Test that listing recipes does not issue queries per recipe"""
+        def add_recipe(i):
+            recipe = sample_recipe(user=self.user, title=f'recipe {i}')
+            recipe.tags.add(sample_tag(user=self.user))
+            recipe.ingredients.add(sample_ingredient(user=self.user))
+
+        self.assertConstantQueries(self.client, RECIPES_URL, add_recipe)
+        self.assertConstantQueries(self.client, RECIPES_URL, add_recipe, sizes=(6, 8), params={'page_size': 5})
+
+    def test_filter_recipes_by_time_and_price(self):
+        """Test range filters on time_minutes and price"""
+        cheap_quick = sample_recipe(user=self.user, time_minutes=10, price=3)
+        sample_recipe(user=self.user, time_minutes=90, price=4)
+        sample_recipe(user=self.user, time_minutes=5, price=25)
+
+        res = self.client.get(RECIPES_URL, {'max_time': 30, 'max_price': '10.50'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([recipe['id'] for recipe in res.data], [cheap_quick.id])
+
+    def test_filter_recipes_invalid_range(self):
+        """Test that non numeric range filters are rejected"""
+        for params in ({'min_price': 'cheap'}, {'min_price': 'nan'}, {'max_price': 'Infinity'},
+                       {'max_time': '9' * 30}, {'min_price': '-1e30'}):
+            res = self.client.get(RECIPES_URL, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_range_filters_list_only(self):
+        """Test that range filters do not hide the recipe of a detail request or update"""
+        recipe = sample_recipe(user=self.user, price=5)
 
-class RecipeImageUploadTests(TestCase):
+        res = self.client.patch(f'{detail_url(recipe.id)}?max_price=1', {'title': 'renamed'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_order_recipes(self):
+        """Test ordering by whitelisted fields only"""
+        recipe1 = sample_recipe(user=self.user, time_minutes=10, price=8)
+        recipe2 = sample_recipe(user=self.user, time_minutes=20, price=8)
+        recipe3 = sample_recipe(user=self.user, time_minutes=30, price=2)
+
+        res = self.client.get(RECIPES_URL, {'ordering': 'price,-time_minutes'})
+        self.assertEqual([recipe['id'] for recipe in res.data], [recipe3.id, recipe2.id, recipe1.id])
+
+        res = self.client.get(RECIPES_URL, {'ordering': 'title'})
+        self.assertEqual([recipe['id'] for recipe in res.data], [recipe3.id, recipe2.id, recipe1.id])
+
+    def test_paginate_recipes(self):
+        """Test keyset pagination when a page size is requested"""
+        recipes = [sample_recipe(user=self.user, price=price) for price in (1, 2, 2, 3)]
+
+        res = self.client.get(RECIPES_URL, {'ordering': 'price', 'page_size': 3})
+        expected = [recipes[0].id, recipes[2].id, recipes[1].id]
+        self.assertEqual([recipe['id'] for recipe in res.data['results']], expected)
+
+        res = self.client.get(res.data['next'])
+        self.assertEqual([recipe['id'] for recipe in res.data['results']], [recipes[3].id])
+        self.assertIsNone(res.data['next'])
+
+
+class RecipeImageUploadTests(TemporaryMediaRootMixin, TestCase):
 
     def setUp(self):
         self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
-        self.client = APIClient()
+        self.client = QueryCountingAPIClient()
         self.client.force_authenticate(self.user)
         self.recipe = sample_recipe(user=self.user)
 
@@ -275,3 +476,584 @@ class RecipeImageUploadTests(TestCase):
         url = image_upload_url(self.recipe.id)
         res = self.client.post(url, {'image': 'is no image'}, format='multipart')
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeConcurrencyTests(TemporaryMediaRootMixin, TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = QueryCountingAPIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user)
+
+    def test_version_etag(self):
+        """Test that every update increments the version exposed as ETag"""
+        res = self.client.get(detail_url(self.recipe.id))
+        self.assertEqual(res['ETag'], '"1"')
+
+        res = self.client.patch(detail_url(self.recipe.id), {'title': 'new title'})
+        self.assertEqual((res.data['version'], res['ETag']), (2, '"2"'))
+
+    def test_update_if_match(self):
+        """Test that updates with an outdated If-Match fail with 412"""
+        url = detail_url(self.recipe.id)
+        res = self.client.patch(url, {'title': 'first'}, HTTP_IF_MATCH='"1"')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        res = self.client.patch(url, {'title': 'second'}, HTTP_IF_MATCH='"1"')
+        self.assertEqual(res.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.recipe.refresh_from_db()
+        self.assertEqual((self.recipe.title, self.recipe.version), ('first', 2))
+
+    def test_concurrent_update_if_match(self):
+        """Test that a write racing with another update is rejected by the conditional update"""
+        stale = Recipe.objects.get(id=self.recipe.id)
+        Recipe.objects.filter(id=self.recipe.id).update(title='other device', version=2)
+
+        with patch.object(RecipeViewSet, 'get_object', return_value=stale):
+            res = self.client.patch(detail_url(self.recipe.id), {'title': 'this device'}, HTTP_IF_MATCH='"1"')
+
+        self.assertEqual(res.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title, 'other device')
+
+    def test_image_save_keeps_version(self):
+        """Test that saving the image of a recipe loaded before another update leaves that update in place"""
+        stale = Recipe.objects.get(id=self.recipe.id)
+        self.client.patch(detail_url(self.recipe.id), {'title': 'new title'})
+        image = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(image, format='JPEG')
+        serializer = RecipeImageSerializer(stale, data={'image': SimpleUploadedFile('image.jpg', image.getvalue())})
+        self.assertTrue(serializer.is_valid())
+        serializer.save()
+
+        self.recipe.refresh_from_db()
+        self.assertEqual((self.recipe.title, self.recipe.version), ('new title', 2))
+        self.assertEqual(self.recipe.image.name, stale.image.name)
+
+    def test_image_upload_bumps_version(self):
+        """Test that replacing the image increments the version"""
+        image = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(image, format='JPEG')
+        image.seek(0)
+        image.name = 'image.jpg'
+        res = self.client.post(image_upload_url(self.recipe.id), {'image': image}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.addCleanup(self.recipe.image.delete)
+        self.assertEqual(self.recipe.version, 2)
+
+    def test_delete_if_match(self):
+        """Test that deletes honour If-Match"""
+        url = detail_url(self.recipe.id)
+        res = self.client.delete(url, HTTP_IF_MATCH='"2", W/"3"')
+        self.assertEqual(res.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        res = self.client.delete(url, HTTP_IF_MATCH='"2", W/"1"')
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Recipe.objects.exists())
+
+
+class RecipeCloneTests(QueryCountAssertionsMixin, TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = QueryCountingAPIClient()
+        self.client.force_authenticate(self.user)
+
+    def sample_linked_recipe(self, title='sample recipe'):
+        """Create a recipe with a tag, an ingredient and an image reference"""
+        recipe = sample_recipe(user=self.user, title=title, link='https://example.com', image='uploads/recipe/a.jpg')
+        recipe.tags.add(sample_tag(user=self.user))
+        recipe.ingredients.add(sample_ingredient(user=self.user))
+        return recipe
+
+    def test_clone_recipe(self):
+        """Test that a clone copies the fields, links and image of a recipe"""
+        recipe = self.sample_linked_recipe()
+
+        res = self.client.post(clone_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        clone = Recipe.objects.get(id=res.data['id'])
+        self.assertNotEqual(clone.id, recipe.id)
+        self.assertEqual(res.data, RecipeSerializer(clone).data)
+        for field in ('title', 'time_minutes', 'price', 'link', 'image', 'user'):
+            self.assertEqual(getattr(clone, field), getattr(recipe, field))
+        self.assertEqual(list(clone.tags.all()), list(recipe.tags.all()))
+        self.assertEqual(list(clone.ingredients.all()), list(recipe.ingredients.all()))
+
+    def test_clone_other_users_recipe(self):
+        """Test that recipes of other users can not be cloned"""
+        other = get_user_model().objects.create_user(email='other@test.com', password='password123')
+        recipe = sample_recipe(user=other)
+
+        self.assertEqual(self.client.post(clone_url(recipe.id)).status_code, status.HTTP_404_NOT_FOUND)
+        res = self.client.post(CLONE_MANY_URL, {'ids': [recipe.id]}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_clone_many(self):
+        """Test that bulk clones are returned in the order of the ids"""
+        recipe1 = self.sample_linked_recipe('recipe1')
+        recipe2 = self.sample_linked_recipe('recipe2')
+
+        res = self.client.post(CLONE_MANY_URL, {'ids': [recipe2.id, recipe1.id, recipe2.id]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([recipe['title'] for recipe in res.data], ['recipe2', 'recipe1'])
+        self.assertEqual(res.data[1]['tags'], [tag.id for tag in recipe1.tags.all()])
+        self.assertEqual(Recipe.objects.count(), 4)
+
+    def test_clone_many_invalid(self):
+        """Test that bulk cloning requires a non empty list of ids"""
+        res = self.client.post(CLONE_MANY_URL, {'ids': []}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_clone_many_queries(self):
+        """Test that bulk cloning inserts links without a query per link"""
+        recipes = [self.sample_linked_recipe(f'recipe{i}') for i in range(5)]
+        for recipe in recipes:
+            recipe.tags.add(*[sample_tag(user=self.user) for _ in range(3)])
+
+        one = self.client.post(CLONE_MANY_URL, {'ids': [recipes[0].id]}, format='json').query_count
+        many = self.client.post(CLONE_MANY_URL, {'ids': [recipe.id for recipe in recipes]}, format='json').query_count
+
+        # only the clone inserts grow on backends that can not return the ids of bulk inserts
+        self.assertLessEqual(many - one, len(recipes) - 1)
+
+
+class RecipeBatchTests(QueryCountAssertionsMixin, TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = QueryCountingAPIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_batch_retrieve(self):
+        """Test that recipes are returned in the requested order with missing ids reported"""
+        recipe1 = sample_recipe(user=self.user, title='recipe1')
+        recipe2 = sample_recipe(user=self.user, title='recipe2')
+        recipe2.tags.add(sample_tag(user=self.user))
+        other = sample_recipe(user=get_user_model().objects.create_user(email='other@test.com', password='pass123'))
+
+        res = self.client.get(BATCH_URL, {'ids': f'{recipe2.id},{other.id},{recipe1.id},{recipe2.id},999'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], RecipeDetailSerializer([recipe2, recipe1], many=True).data)
+        self.assertEqual(res.data['missing'], [other.id, 999])
+
+    def test_batch_post(self):
+        """Test that long id lists can be posted"""
+        recipe = sample_recipe(user=self.user)
+
+        res = self.client.post(BATCH_URL, {'ids': [recipe.id]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in res.data['results']], [recipe.id])
+        self.assertEqual(res.data['missing'], [])
+
+    def test_batch_invalid_ids(self):
+        """Test that malformed or empty id lists are rejected"""
+        self.assertEqual(self.client.get(BATCH_URL, {'ids': '1,a'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(BATCH_URL).status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.post(BATCH_URL, {'ids': []}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_queries(self):
+        """Test that the number of queries does not grow with the number of recipes"""
+        recipes = [sample_recipe(user=self.user, title=f'recipe{i}') for i in range(5)]
+        for recipe in recipes:
+            recipe.tags.add(sample_tag(user=self.user))
+            recipe.ingredients.add(sample_ingredient(user=self.user))
+
+        one = self.client.get(BATCH_URL, {'ids': str(recipes[0].id)}).query_count
+        many = self.client.get(BATCH_URL, {'ids': ','.join(str(recipe.id) for recipe in recipes)}).query_count
+
+        self.assertEqual(one, many)
+
+
+class RecipeFeedTests(QueryCountAssertionsMixin, TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = QueryCountingAPIClient()
+        self.client.force_authenticate(self.user)
+        self.anonymous = QueryCountingAPIClient()
+
+    def test_publish_recipe(self):
+        """Test that only public recipes of any user are listed in the feed, without authentication"""
+        recipe = sample_recipe(user=self.user, title='pancakes')
+        recipe.tags.add(sample_tag(user=self.user, name='breakfast'))
+        sample_recipe(user=self.user, title='secret')
+
+        res = self.client.patch(detail_url(recipe.id), {'visibility': Recipe.PUBLIC})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        res = self.anonymous.get(FEED_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('public', res['Cache-Control'])
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'][0]['title'], 'pancakes')
+        self.assertEqual(res.data['results'][0]['tags'], ['breakfast'])
+
+    def test_feed_follows_changes(self):
+        """Test that feed entries are refreshed on edits and removed on unpublish"""
+        recipe = sample_recipe(user=self.user, visibility=Recipe.PUBLIC)
+        tag = sample_tag(user=self.user, name='vegan')
+        recipe.tags.add(tag)
+        tag.name = 'plant based'
+        tag.save()
+        recipe.ingredients.add(sample_ingredient(user=self.user, name='tofu'))
+
+        entry = self.anonymous.get(FEED_URL).data['results'][0]
+        self.assertEqual((entry['tags'], entry['ingredients']), (['plant based'], ['tofu']))
+
+        tag.delete()
+        self.assertEqual(self.anonymous.get(FEED_URL).data['results'][0]['tags'], [])
+
+        recipe.visibility = Recipe.PRIVATE
+        recipe.save()
+        self.assertEqual(self.anonymous.get(FEED_URL).data['results'], [])
+
+    def test_private_recipe_save_skips_feed(self):
+        """Test that saving a recipe that stays private does not touch the feed"""
+        recipe = Recipe.objects.get(id=sample_recipe(user=self.user).id)
+        recipe.title = 'still private'
+        with CaptureQueriesContext(connection) as queries:
+            recipe.save()
+
+        self.assertFalse(any('core_feedentry' in query['sql'] for query in queries.captured_queries))
+
+    def test_feed_refresh_batched(self):
+        """Test that renaming a tag of many published recipes refreshes their entries in one update"""
+        tag = sample_tag(user=self.user, name='vegan')
+        for i in range(3):
+            sample_recipe(user=self.user, title=f'recipe{i}', visibility=Recipe.PUBLIC).tags.add(tag)
+
+        Tag.objects.filter(id=tag.id).update(name='plant based')
+        with CaptureQueriesContext(connection) as queries:
+            refresh_feed(Recipe.objects.values_list('id', flat=True))
+
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in queries.captured_queries), 1)
+        self.assertEqual({tuple(entry['tags']) for entry in self.anonymous.get(FEED_URL).data['results']},
+                         {('plant based',)})
+
+    def test_feed_pagination(self):
+        """Test that the feed is paginated newest first"""
+        recipes = [sample_recipe(user=self.user, title=f'recipe{i}', visibility=Recipe.PUBLIC) for i in range(3)]
+
+        res = self.anonymous.get(FEED_URL, {'page_size': 2})
+        self.assertEqual([entry['id'] for entry in res.data['results']], [recipes[2].id, recipes[1].id])
+        res = self.anonymous.get(res.data['next'])
+        self.assertEqual([entry['id'] for entry in res.data['results']], [recipes[0].id])
+
+    def test_feed_queries_constant(self):
+        """Test that the feed queries do not grow with the number of entries"""
+        def add_result(i):
+            recipe = sample_recipe(user=self.user, visibility=Recipe.PUBLIC)
+            recipe.tags.add(sample_tag(user=self.user))
+
+        self.assertConstantQueries(self.anonymous, FEED_URL, add_result)
+
+
+class ChunkedImageUploadTests(TemporaryMediaRootMixin, TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = QueryCountingAPIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user)
+        image = io.BytesIO()
+        Image.new('RGB', (20, 20), 'green').save(image, format='PNG')
+        self.image = image.getvalue()
+
+    def start(self, size):
+        res = self.client.post(start_upload_url(self.recipe.id), {'size': size})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.data['id']
+
+    def send(self, upload_id, offset, data):
+        return self.client.generic('PATCH', upload_url(self.recipe.id, upload_id), data,
+                                   content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_chunked_upload(self):
+        """Test uploading an image in chunks and resuming from the reported offset"""
+        upload_id = self.start(len(self.image))
+
+        self.assertEqual(self.send(upload_id, 0, self.image[:30])['Upload-Offset'], '30')
+        res = self.client.get(upload_url(self.recipe.id, upload_id))
+        self.assertEqual(res.data['offset'], 30)
+        self.assertEqual(self.send(upload_id, 30, self.image[30:]).status_code, status.HTTP_200_OK)
+
+        res = self.client.post(upload_url(self.recipe.id, upload_id, finalize=True))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.addCleanup(self.recipe.image.delete)
+        self.assertTrue(self.recipe.image.name.endswith('.png'))
+        with self.recipe.image.open() as stored:
+            self.assertEqual(stored.read(), self.image)
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_finalize_rolled_back(self):
+        """Test that a finalize rolled back leaves the upload and its partial file to finalize again"""
+        upload_id = self.start(len(self.image))
+        self.send(upload_id, 0, self.image)
+
+        with patch.object(Recipe, 'bump_version', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            self.client.post(upload_url(self.recipe.id, upload_id, finalize=True))
+
+        partial = recipe_image_storage.path(ImageUpload.objects.get().file_name)
+        self.assertTrue(os.path.exists(partial))
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+        res = self.client.post(upload_url(self.recipe.id, upload_id, finalize=True))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        with self.recipe.image.open() as stored:
+            self.assertEqual(stored.read(), self.image)
+        self.assertFalse(os.path.exists(partial))
+
+    def test_chunk_at_wrong_offset(self):
+        """Test that a chunk not continuing the upload is rejected with the offset to resume from"""
+        upload_id = self.start(len(self.image))
+        self.send(upload_id, 0, self.image[:30])
+
+        res = self.send(upload_id, 10, self.image[10:40])
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res['Upload-Offset'], '30')
+
+    def test_chunk_while_another_is_written(self):
+        """Test that a chunk arriving while another one is written to the partial file is refused"""
+        upload_id = self.start(len(self.image))
+        with open(recipe_image_storage.path(ImageUpload.objects.get().file_name), 'r+b') as partial:
+            fcntl.flock(partial, fcntl.LOCK_EX)
+            res = self.send(upload_id, 0, self.image[:30])
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res['Upload-Offset'], '0')
+        self.assertEqual(self.send(upload_id, 0, self.image[:30])['Upload-Offset'], '30')
+
+    def test_chunk_past_announced_size(self):
+        """Test that chunks may not extend past the announced size"""
+        upload_id = self.start(10)
+        self.assertEqual(self.send(upload_id, 0, self.image[:20]).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_not_an_image_rejected_early(self):
+        """Test that the first bytes are checked before the rest of the upload is sent"""
+        upload_id = self.start(1000)
+
+        res = self.send(upload_id, 0, b'%PDF-1.4 not an image')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_finalize_incomplete(self):
+        """Test that incomplete uploads can not be finalized"""
+        upload_id = self.start(len(self.image))
+        self.send(upload_id, 0, self.image[:30])
+
+        res = self.client.post(upload_url(self.recipe.id, upload_id, finalize=True))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ImageUpload.objects.get().offset, 30)
+
+    def test_upload_of_other_user(self):
+        """Test that uploads of other users can not be continued"""
+        upload_id = self.start(len(self.image))
+        other = get_user_model().objects.create_user(email='other@test.com', password='password123')
+        self.client.force_authenticate(other)
+
+        self.assertEqual(self.send(upload_id, 0, self.image).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RecipeImageReplaceTests(TemporaryMediaRootMixin, TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = QueryCountingAPIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, recipe, color):
+        """Upload a single colored jpeg to a recipe and return the stored name"""
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (10, 10), color).save(ntf, format='JPEG')
+            ntf.seek(0)
+            res = self.client.post(image_upload_url(recipe.id), {'image': ntf}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        recipe.refresh_from_db()
+        self.addCleanup(recipe.image.storage.delete, recipe.image.name)
+        return recipe.image.name
+
+    def test_identical_images_stored_once(self):
+        """Test that uploading the same image to two recipes stores one file"""
+        recipe1, recipe2 = sample_recipe(user=self.user), sample_recipe(user=self.user)
+
+        self.assertEqual(self.upload(recipe1, 'red'), self.upload(recipe2, 'red'))
+
+    def test_replaced_image_released(self):
+        """Test that a replaced image is deleted once no recipe refers to it anymore"""
+        recipe = sample_recipe(user=self.user)
+        red = self.upload(recipe, 'red')
+        clone = Recipe.objects.get(id=self.client.post(clone_url(recipe.id)).data['id'])
+
+        an_hour_ago = (timezone.now() - timedelta(hours=1)).timestamp()
+        os.utime(recipe.image.storage.path(red), (an_hour_ago, an_hour_ago))
+
+        self.upload(recipe, 'blue')
+        self.assertTrue(recipe.image.storage.exists(red))  # the clone still uses it
+
+        self.upload(clone, 'blue')
+        self.assertFalse(recipe.image.storage.exists(red))
+
+
+class RecipeRecommendationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = QueryCountingAPIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_cookable_ranked_by_coverage(self):
+        """Test that recipes are ranked by the fraction of available ingredients"""
+        eggs = sample_ingredient(user=self.user, name='eggs')
+        flour = sample_ingredient(user=self.user, name='flour')
+        milk = sample_ingredient(user=self.user, name='milk')
+        pancakes = sample_recipe(user=self.user, title='pancakes')
+        pancakes.ingredients.add(eggs, flour, milk)
+        omelette = sample_recipe(user=self.user, title='omelette')
+        omelette.ingredients.add(eggs)
+        porridge = sample_recipe(user=self.user, title='porridge')
+        porridge.ingredients.add(milk)
+
+        res = self.client.get(COOKABLE_URL, {'have': f'{eggs.id},{flour.id}'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([recipe['id'] for recipe in res.data], [omelette.id, pancakes.id])
+        self.assertEqual(res.data[0]['coverage'], 1)
+        self.assertEqual(res.data[1]['coverage'], round(2 / 3, 4))
+
+    def test_cookable_limited_to_user(self):
+        """Test that recipes of other users are never suggested"""
+        other_user = get_user_model().objects.create_user(email='other@other.com', password='password123')
+        ingredient = sample_ingredient(user=self.user)
+        sample_recipe(user=other_user).ingredients.add(ingredient)
+
+        res = self.client.get(COOKABLE_URL, {'have': ingredient.id})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [])
+
+    def test_similar_recipes(self):
+        """Test that recipes sharing tags and ingredients are returned by similarity"""
+        tag = sample_tag(user=self.user)
+        ingredient = sample_ingredient(user=self.user)
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(tag)
+        recipe.ingredients.add(ingredient)
+        same = sample_recipe(user=self.user, title='same')
+        same.tags.add(tag)
+        same.ingredients.add(ingredient)
+        partial = sample_recipe(user=self.user, title='partial')
+        partial.tags.add(tag)
+        sample_recipe(user=self.user, title='unrelated')
+
+        res = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([(data['id'], data['similarity']) for data in res.data], [(same.id, 1), (partial.id, 0.5)])
+
+    def test_cookable_invalid_ids(self):
+        """Test that malformed ingredient ids are rejected"""
+        res = self.client.get(COOKABLE_URL, {'have': 'eggs'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cookable_without_ingredients(self):
+        """Test that an empty ingredient list suggests nothing"""
+        sample_recipe(user=self.user).ingredients.add(sample_ingredient(user=self.user))
+
+        res = self.client.get(COOKABLE_URL, {'have': ''})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [])
+
+
+class RecipeStatsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = QueryCountingAPIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_stats(self):
+        """Test recipe counts, averages and histograms"""
+        vegan = sample_tag(user=self.user, name='vegan')
+        sample_tag(user=self.user, name='unused')
+        quick = sample_recipe(user=self.user, time_minutes=10, price=4)
+        slow = sample_recipe(user=self.user, time_minutes=150, price=30)
+        quick.tags.add(vegan)
+        slow.tags.add(vegan)
+        sample_recipe(user=get_user_model().objects.create_user(email='other@other.com', password='password123'))
+
+        with self.assertNumQueries(3):
+            res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 2)
+        self.assertEqual(res.data['avg_time_minutes'], 80)
+        self.assertEqual([bucket['count'] for bucket in res.data['time_minutes_histogram']], [1, 0, 0, 0, 1])
+        self.assertEqual([bucket['count'] for bucket in res.data['price_histogram']], [1, 0, 0, 1, 0])
+        tag_counts = [(tag['name'], tag['recipe_count']) for tag in res.data['tags']]
+        self.assertEqual(tag_counts, [('vegan', 2), ('unused', 0)])
+        self.assertEqual(res.data['tags'][0]['avg_time_minutes'], 80)
+
+    def test_stats_cached(self):
+        """Test that statistics are served from the cache on subsequent requests"""
+        self.client.get(STATS_URL)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_stats_invalidated_while_computing(self):
+        """Test that statistics computed before an invalidation are not served after it"""
+        compute_stats = stats.compute_stats
+
+        def compute_then_change(user):
+            computed = compute_stats(user)
+            stats.invalidate_stats(user.id)  # a change committed while the statistics were computed
+            return computed
+
+        with patch('recipe.stats.compute_stats', compute_then_change):
+            self.client.get(STATS_URL)
+        sample_recipe(user=self.user)
+
+        self.assertEqual(self.client.get(STATS_URL).data['count'], 1)
+
+
+class RecipeStatsInvalidationTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = QueryCountingAPIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_stats_invalidated_on_change(self):
+        """Test that cached statistics are recomputed after recipes change"""
+        recipe = sample_recipe(user=self.user)
+        self.assertEqual(self.client.get(STATS_URL).data['count'], 1)
+
+        recipe.tags.add(sample_tag(user=self.user))
+        self.assertEqual(self.client.get(STATS_URL).data['tags'][0]['recipe_count'], 1)
+
+        recipe.delete()
+        self.assertEqual(self.client.get(STATS_URL).data['count'], 0)
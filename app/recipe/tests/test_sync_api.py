@@ -0,0 +1,156 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+
+from core.models import ChangeLogEntry, Ingredient, Recipe, Tag
+from core.testing import QueryCountAssertionsMixin, QueryCountingAPIClient
+from recipe.changelog import record_changes
+
+SYNC_URL = reverse('recipe:sync')
+
+
+def detail_url(recipe_id):
+    """Return the recipe detail URL"""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+class SyncApiTests(QueryCountAssertionsMixin, TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
+        self.client = QueryCountingAPIClient()
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.recipe = Recipe.objects.create(user=self.user, title='recipe', time_minutes=10, price=5)
+        self.recipe.tags.add(self.tag)
+
+    def sync(self, since=None, **params):
+        """Sync from since and return the response data"""
+        if since is not None:
+            params['since'] = since
+        res = self.client.get(SYNC_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def test_sync_requires_authentication(self):
+        """Test that sync is only available to authenticated users"""
+        self.client.force_authenticate(None)
+
+        self.assertEqual(self.client.get(SYNC_URL).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_initial_and_empty_sync(self):
+        """Test that a sync without cursor returns everything and syncing from its cursor returns nothing"""
+        first = self.sync()
+        second = self.sync(first['cursor'])
+
+        self.assertEqual([recipe['id'] for recipe in first['recipes']], [self.recipe.id])
+        self.assertEqual(first['recipes'][0]['tags'], [self.tag.id])
+        self.assertEqual([tag['name'] for tag in first['tags']], ['Vegan'])
+        self.assertFalse(first['has_more'])
+        self.assertEqual(second['cursor'], first['cursor'])
+        self.assertEqual(second['recipes'] + second['tags'] + second['ingredients'], [])
+
+    def test_sync_returns_changes_only(self):
+        """Test that updated recipes, link changes and new objects are returned once after the cursor"""
+        other = Recipe.objects.create(user=self.user, title='other', time_minutes=10, price=5)
+        cursor = self.sync()['cursor']
+        updated_at = Recipe.objects.get(id=self.recipe.id).updated_at
+
+        self.client.patch(detail_url(self.recipe.id), {'title': 'new'})
+        other.tags.remove(self.tag)
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        changes = self.sync(cursor)
+
+        self.assertEqual(sorted(recipe['id'] for recipe in changes['recipes']), [self.recipe.id, other.id])
+        self.assertEqual([item['id'] for item in changes['ingredients']], [ingredient.id])
+        self.assertEqual(changes['tags'], [])
+        self.assertGreater(Recipe.objects.get(id=self.recipe.id).updated_at, updated_at)
+
+        self.recipe.ingredients.add(ingredient)
+        self.assertEqual([recipe['id'] for recipe in self.sync(changes['cursor'])['recipes']], [self.recipe.id])
+
+    def test_sync_tombstones(self):
+        """Test that deleted recipes and tags are reported as deleted along with recipes losing the tag"""
+        recipe = Recipe.objects.create(user=self.user, title='other', time_minutes=10, price=5)
+        tag_id = self.tag.id
+        cursor = self.sync()['cursor']
+
+        self.client.delete(detail_url(recipe.id))
+        self.tag.delete()
+        changes = self.sync(cursor)
+
+        self.assertEqual(changes['deleted'], {'recipes': [recipe.id], 'tags': [tag_id], 'ingredients': []})
+        self.assertEqual([item['id'] for item in changes['recipes']], [self.recipe.id])
+        self.assertEqual(changes['recipes'][0]['tags'], [])
+
+    def test_sync_pages(self):
+        """Test that limit pages through the changes in sequence order"""
+        for i in range(3):
+            Ingredient.objects.create(user=self.user, name=f'ingredient{i}')
+
+        first = self.sync(limit=2)
+        rest = self.sync(first['cursor'], limit=10)
+
+        self.assertTrue(first['has_more'])
+        self.assertEqual(len(first['recipes'] + first['tags'] + first['ingredients']), 2)
+        self.assertFalse(rest['has_more'])
+        self.assertEqual([item['name'] for item in rest['ingredients']], [f'ingredient{i}' for i in range(3)])
+
+    def test_sync_scoped_to_user(self):
+        """Test that changes of other users are never returned"""
+        other = get_user_model().objects.create_user(email='other@test.com', password='password123')
+        Tag.objects.create(user=other, name='Other')
+
+        self.assertEqual([tag['name'] for tag in self.sync()['tags']], ['Vegan'])
+
+    def test_sync_invalid_params(self):
+        """Test that a malformed cursor is rejected"""
+        self.assertEqual(self.client.get(SYNC_URL, {'since': 'a'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sync_queries(self):
+        """Test that the number of queries does not grow with the number of changes"""
+        self.recipe.ingredients.add(Ingredient.objects.create(user=self.user, name='Salt'))
+        few = self.client.get(SYNC_URL).query_count
+        for i in range(5):
+            recipe = Recipe.objects.create(user=self.user, title=f'recipe{i}', time_minutes=10, price=5)
+            recipe.tags.add(self.tag)
+            recipe.ingredients.add(Ingredient.objects.create(user=self.user, name=f'ingredient{i}'))
+
+        self.assertEqual(self.client.get(SYNC_URL).query_count, few)
+
+    def test_change_recorded_once_per_save(self):
+        """Test that a recipe created with links through the API is recorded once, not once per signal"""
+        seq = get_user_model().objects.get(id=self.user.id).change_seq
+        res = self.client.post(reverse('recipe:recipe-list'), {'title': 'new', 'time_minutes': 5, 'price': 1,
+                                                               'tags': [self.tag.id]})
+
+        entry = ChangeLogEntry.objects.get(model='recipe', object_id=res.data['id'])
+        self.assertEqual(entry.seq, seq + 1)
+        self.assertEqual(get_user_model().objects.get(id=self.user.id).change_seq, seq + 1)
+
+    def test_user_save_keeps_change_seq(self):
+        """Test that saving a stale copy of the user does not move the change sequence back"""
+        seq = get_user_model().objects.get(id=self.user.id).change_seq
+
+        res = self.client.patch(reverse('user:me'), {'name': 'new name'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_user_model().objects.get(id=self.user.id).change_seq, seq)
+        tag = Tag.objects.create(user=self.user, name='Dessert')
+        self.assertEqual(ChangeLogEntry.objects.get(model='tag', object_id=tag.id).seq, seq + 1)
+
+    def test_changes_moved_in_one_update(self):
+        """Test that several existing entries are moved to the end of the sequence with one update"""
+        ids = [Tag.objects.create(user=self.user, name=f'tag{i}').id for i in range(3)]
+
+        with CaptureQueriesContext(connection) as queries:
+            record_changes(self.user.id, Tag, ids)
+
+        updates = [query for query in queries if query['sql'].startswith('UPDATE "core_changelogentry"')]
+        self.assertEqual(len(updates), 1)
+        seq = get_user_model().objects.get(id=self.user.id).change_seq
+        self.assertEqual(list(ChangeLogEntry.objects.filter(model='tag', object_id__in=ids).order_by('object_id')
+                              .values_list('seq', flat=True)), [seq - 2, seq - 1, seq])
@@ -2,7 +2,7 @@ from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.test import TestCase
 from rest_framework import status
-from rest_framework.test import APIClient
+from core.testing import QueryCountAssertionsMixin, QueryCountingAPIClient
 from core.models import Tag, Recipe
 from recipe.serializers import TagSerializer
 
@@ -13,7 +13,7 @@ class PublicTagsApiTests(TestCase):
     """Test the publicly available tag api"""
 
     def setUp(self):
-        self.client = APIClient()
+        self.client = QueryCountingAPIClient()
 
     def test_login_required(self):
         """Test that login is required for retrieving tags"""
@@ -22,12 +22,12 @@ class PublicTagsApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class PrivateTagsApiTests(TestCase):
+class PrivateTagsApiTests(QueryCountAssertionsMixin, TestCase):
     """Test authoriced user apu"""
 
     def setUp(self):
         self.user = get_user_model().objects.create_user(email='test@test.com', password='password123')
-        self.client = APIClient()
+        self.client = QueryCountingAPIClient()
         self.client.force_authenticate(self.user)
 
     def test_retrieve_tags(self):
@@ -98,3 +98,12 @@ class PrivateTagsApiTests(TestCase):
 
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
         self.assertEqual(len(res.data), 1)  # this is why we need second tag
+
+    def test_list_queries_constant(self):
+        """Test that listing tags assigned to recipes does not issue queries per tag"""
+        recipe = Recipe.objects.create(user=self.user, title='recipe', time_minutes=5, price=5)
+
+        def add_tag(i):
+            recipe.tags.add(Tag.objects.create(user=self.user, name=f'tag {i}'))
+
+        self.assertConstantQueries(self.client, TAGS_URL, add_tag, params={'assigned_only': 1})
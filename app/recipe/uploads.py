@@ -0,0 +1,150 @@
+import fcntl
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from PIL import Image
+from rest_framework.exceptions import NotFound, ValidationError
+
+from core.models import ImageUpload, recipe_image_file_path, recipe_image_storage
+
+COPY_BUFFER_SIZE = 64 * 1024
+HEADER_SIZE = 12  # enough bytes to recognize every supported format
+
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+
+class InvalidImage(ValidationError):
+    """The upload is not an image, callers discard it once the transaction that found out has rolled back"""
+
+
+def sniff_image(header):
+    """Return the extension of the image format starting with header, None for anything else"""
+    for signature, extension in SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+
+    return None
+
+
+def _partial_path(upload):
+    return recipe_image_storage.path(upload.file_name)
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def discard(upload):
+    """Delete an upload and its partial file"""
+    _remove(_partial_path(upload))
+    upload.delete()
+
+
+def create_partial_file(upload):
+    """Create the empty partial file chunks get appended to"""
+    path = _partial_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+def _locked_offset(upload):
+    """Refresh the offset and extension of an upload with its row locked only for the read"""
+    try:
+        with transaction.atomic():
+            current = ImageUpload.objects.select_for_update().get(pk=upload.pk)
+    except ImageUpload.DoesNotExist:  # discarded or expired meanwhile
+        raise NotFound('Upload not found')
+    upload.offset, upload.extension = current.offset, current.extension
+
+
+def append_chunk(upload, stream, offset, length):
+    """
+    Write length bytes from stream to the partial file at offset, which has to be the offset received so far.
+    A chunk cut short by a dropped connection still advances the offset, the client resumes from there.
+    The first bytes are checked against the supported image formats so bad uploads fail before they are sent.
+
+    The body streams in holding an exclusive lock on the partial file only, a chunk arriving while another one
+    is written is refused like one at the wrong offset. The upload row is locked just to read the offset before
+    and to advance it after, so slow clients do not hold a database lock.
+    """
+    if length > settings.IMAGE_UPLOADS['MAX_CHUNK_SIZE'] or offset + length > upload.size:
+        raise ValidationError(f'Chunks are limited to {settings.IMAGE_UPLOADS["MAX_CHUNK_SIZE"]} bytes and may not '
+                              f'extend past the announced size of {upload.size} bytes')
+
+    try:
+        partial = open(_partial_path(upload), 'r+b')
+    except FileNotFoundError:
+        raise NotFound('Upload not found')
+
+    with partial:
+        try:
+            fcntl.flock(partial, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            _locked_offset(upload)
+            return False
+
+        _locked_offset(upload)
+        if offset != upload.offset:
+            return False
+
+        partial.seek(offset)
+        partial.truncate()  # drop bytes of an earlier attempt that never got recorded
+        written = 0
+        while written < length:
+            data = stream.read(min(COPY_BUFFER_SIZE, length - written))
+            if not data:
+                break
+            partial.write(data)
+            written += len(data)
+
+        extension = upload.extension
+        if not extension and offset + written >= min(HEADER_SIZE, upload.size):
+            partial.flush()
+            partial.seek(0)
+            extension = sniff_image(partial.read(HEADER_SIZE)) or ''
+
+        upload.offset, upload.extension = offset + written, extension
+        if not ImageUpload.objects.filter(pk=upload.pk, offset=offset).update(offset=upload.offset,
+                                                                              extension=extension):
+            raise NotFound('Upload not found')  # the file lock keeps other chunks out, only a discard gets here
+
+    if not upload.extension and upload.offset >= min(HEADER_SIZE, upload.size):
+        raise InvalidImage('Upload a valid image. The file you uploaded is not a supported image format.')
+
+    return True
+
+
+def finalize(upload):
+    """
+    Verify a complete upload and store it in the recipe image storage, returning the stored name. The partial file
+    is only removed once the transaction commits, a rolled back finalize leaves the upload to be finalized again and
+    the stored file to gc_images.
+    """
+    if upload.offset != upload.size:
+        raise ValidationError(f'The upload is incomplete, {upload.offset} of {upload.size} bytes were received')
+
+    path = _partial_path(upload)
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except Exception:  # PIL raises anything from IOError to SyntaxError for broken files
+        raise InvalidImage('Upload a valid image. The file you uploaded was either not an image or corrupted.')
+
+    with open(path, 'rb') as partial:
+        name = recipe_image_storage.content_name(recipe_image_file_path(upload.recipe, f'image.{upload.extension}'),
+                                                 File(partial))
+    recipe_image_storage.link_as(name, path)
+    upload.delete()
+    transaction.on_commit(lambda: _remove(path))
+
+    return name
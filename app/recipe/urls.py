@@ -12,5 +12,7 @@ router.register('recipes', views.RecipeViewSet)
 app_name = 'recipe'
 
 urlpatterns = [
+    path('sync/', views.SyncView.as_view(), name='sync'),
+    path('events/', views.EventStreamView.as_view(), name='events'),
     path('', include(router.urls)),
 ]
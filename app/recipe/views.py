@@ -1,11 +1,28 @@
+import json
+import uuid
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_cache_control
 from rest_framework import viewsets, mixins, status
 from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from core.models import Tag, Ingredient, Recipe
-from recipe import serializers
+from core.exceptions import PreconditionFailed
+from core.models import FeedEntry, ImageUpload, Tag, Ingredient, Recipe
+from recipe import serializers, uploads
+from recipe.cloning import clone_recipes
+from recipe.events import EventStreamRenderer, event_stream
+from recipe.indexes import IngredientIndex, SimilarityIndex, attribute_codes
+from recipe.pagination import FeedCursorPagination, RecipeCursorPagination, StableOrderingFilter
+from recipe.stats import get_stats
+from recipe.sync import changes_since
 
 
 class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
@@ -21,7 +38,7 @@ class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
         queryset = self.queryset
 
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
+            queryset = queryset.filter(recipe__isnull=False, recipe__deleted_at__isnull=True)
 
         return queryset.filter(user=self.request.user).order_by('-name').distinct()
 
@@ -48,16 +65,50 @@ class RecipeViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.RecipeSerializer  # normal serializer class, changed for certain actions
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    pagination_class = RecipeCursorPagination
+    filter_backends = (StableOrderingFilter,)
+    # only orderings backed by the (user, time_minutes) and (user, price) indexes or the primary key are allowed
+    ordering_fields = ('price', 'time_minutes', 'id')
+    ordering = ('-id',)
+    feed_max_age = 60  # seconds shared caches may serve the public feed
+    throttle_scope = None  # token bucket by request method, actions override it, see TokenBucketThrottle
+
+    # query param -> (lookup, type) of the range filters on the recipe list
+    range_filters = {
+        'min_time': ('time_minutes__gte', int),
+        'max_time': ('time_minutes__lte', int),
+        'min_price': ('price__gte', Decimal),
+        'max_price': ('price__lte', Decimal),
+    }
+    max_filter_value = 2 ** 63 - 1  # larger integers overflow the database drivers
 
     def _params_to_ints(self, query_string):
-        """Convert a list of string IDs to a list of integers"""
-        return [int(str_id) for str_id in query_string.split(',')]
+        """Convert a list of string IDs to a list of integers, an empty string to an empty list"""
+        return [int(str_id) for str_id in query_string.split(',')] if query_string else []
+
+    def _range_filters(self):
+        """Return the lookups of the range filters present in the query params"""
+        lookups = {}
+        for param, (lookup, cast) in self.range_filters.items():
+            value = self.request.query_params.get(param)
+            if value:
+                try:
+                    number = cast(value)
+                except (ValueError, InvalidOperation):
+                    number = None
+                if number is None or not Decimal(number).is_finite() or abs(number) > self.max_filter_value:
+                    raise ValidationError({param: f'{value} is not a valid number'})
+                lookups[lookup] = number
+
+        return lookups
 
     def get_queryset(self):
         """Retrieve the recipes for authenticated user"""
         tags = self.request.query_params.get('tags')
         ingredients = self.request.query_params.get('ingredients')
         queryset = self.queryset
+        if self.action == 'list':
+            queryset = queryset.filter(**self._range_filters())
 
         # filter relevant tags
         if tags:
@@ -69,6 +120,10 @@ class RecipeViewSet(viewsets.ModelViewSet):
             ingredient_ids = self._params_to_ints(ingredients)
             queryset = queryset.filter(ingredients__id__in=ingredient_ids).distinct()
 
+        # serializing tags and ingredients of many recipes would otherwise cost two queries per recipe
+        if self.action in ('list', 'retrieve', 'batch'):
+            queryset = queryset.prefetch_related('tags', 'ingredients')
+
         # return filtered queryset (note that )
         return queryset.filter(user=self.request.user)
 
@@ -76,24 +131,189 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """create a new recipe"""
         serializer.save(user=self.request.user)  # inject user =  authenticated user, as it's not send in payload
 
+    def _expected_version(self, recipe):
+        """Return the version required by the If-Match header, failing right away if the recipe has moved on"""
+        header = self.request.META.get('HTTP_IF_MATCH')
+        if header is None:
+            return None
+
+        # compressed responses carry the version as a weak etag, it still names the version so both forms match
+        etags = [etag.strip() for etag in header.split(',')]
+        if '*' in etags:
+            return None
+        if f'"{recipe.version}"' not in (etag[2:] if etag.startswith('W/') else etag for etag in etags):
+            raise PreconditionFailed
+
+        return recipe.version
+
+    def perform_update(self, serializer):
+        """update a recipe, only if it still has the version given in If-Match"""
+        serializer.save(expected_version=self._expected_version(serializer.instance))
+
+    def perform_destroy(self, instance):
+        """delete a recipe, only if it still has the version given in If-Match"""
+        expected_version = self._expected_version(instance)
+        with transaction.atomic():
+            if expected_version is not None and not instance.bump_version(expected_version):
+                raise PreconditionFailed
+            instance.soft_delete()  # purge_deleted removes the row, its links and its image later
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Expose the version of a single recipe as ETag, for If-Match on the following write"""
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.action in ('create', 'retrieve', 'update', 'partial_update') and response.status_code < 300:
+            response['ETag'] = f'"{response.data["version"]}"'
+
+        return response
+
     def get_serializer_class(self):
         """Return appropriate serializer class for different kind of requests"""
         if self.action == 'retrieve':
             return serializers.RecipeDetailSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
+        elif self.action == 'clone_many':
+            return serializers.RecipeCloneSerializer
+        elif self.action == 'batch':
+            return serializers.RecipeBatchSerializer
+        elif self.action in ('start_upload', 'upload_chunk'):
+            return serializers.ImageUploadSerializer
+        elif self.action == 'finalize_upload':
+            return serializers.RecipeImageSerializer
 
         # returns the normal serializer class of this view
         return self.serializer_class
 
-    @action(methods=['POST'], detail=True, url_path='upload-image')
+    @action(methods=['GET'], detail=False)
+    def cookable(self, request):
+        """Rank recipes by the fraction of their ingredients covered by the ingredient ids in ?have="""
+        try:
+            have = self._params_to_ints(request.query_params.get('have', ''))
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            raise ValidationError('have must be a comma separated list of ingredient ids and limit an integer')
+
+        ranking = IngredientIndex.get(request.user.id).rank(have, limit=max(limit, 0))
+        recipes = Recipe.objects.filter(user=request.user) \
+            .prefetch_related('ingredients', 'tags') \
+            .in_bulk([recipe_id for recipe_id, _ in ranking])
+
+        results = []
+        for recipe_id, coverage in ranking:
+            if recipe_id in recipes:  # index may briefly lag behind deletions
+                data = self.get_serializer(recipes[recipe_id]).data
+                data['coverage'] = round(coverage, 4)
+                results.append(data)
+
+        return Response(results)
+
+    @action(methods=['GET'], detail=False)
+    def stats(self, request):
+        """Return recipe counts, averages and histograms per tag and ingredient computed by the database"""
+        return Response(get_stats(request.user))
+
+    @action(methods=['GET'], detail=False, authentication_classes=(), permission_classes=(AllowAny,),
+            filter_backends=())
+    def feed(self, request):
+        """Return the published recipes of all users, read from the precomputed feed entries"""
+        paginator = FeedCursorPagination()
+        entries = paginator.paginate_queryset(FeedEntry.objects.only('published_at', 'payload'), request, view=self)
+        response = paginator.get_paginated_response([
+            dict(json.loads(entry.payload), published_at=entry.published_at) for entry in entries
+        ])
+
+        # identical for every client, shared caches and CDNs may serve it
+        patch_cache_control(response, public=True, max_age=self.feed_max_age)
+        return response
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """Return the recipes sharing the most tags and ingredients with this recipe (Jaccard similarity)"""
+        recipe = self.get_object()
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            raise ValidationError('limit must be an integer')
+
+        codes = attribute_codes(Tag, recipe.tags.values_list('id', flat=True)) + \
+            attribute_codes(Ingredient, recipe.ingredients.values_list('id', flat=True))
+        ranking = SimilarityIndex.get(request.user.id).similar(codes, limit=limit, exclude=recipe.id)
+        recipes = Recipe.objects.filter(user=request.user) \
+            .prefetch_related('ingredients', 'tags') \
+            .in_bulk([recipe_id for recipe_id, _ in ranking])
+
+        results = []
+        for recipe_id, similarity in ranking:
+            if recipe_id in recipes:  # index may briefly lag behind deletions
+                data = self.get_serializer(recipes[recipe_id]).data
+                data['similarity'] = round(similarity, 4)
+                results.append(data)
+
+        return Response(results)
+
+    def _cloned_response(self, clones):
+        """Serialize freshly cloned recipes, fetching their tags and ingredients in bulk"""
+        recipes = Recipe.objects.prefetch_related('tags', 'ingredients').in_bulk([clone.id for clone in clones])
+        return [serializers.RecipeSerializer(recipes[clone.id]).data for clone in clones]
+
+    @action(methods=['POST'], detail=True)
+    def clone(self, request, pk=None):
+        """Copy a recipe with its tags, ingredients and image"""
+        clones = clone_recipes([self.get_object()])
+        return Response(self._cloned_response(clones)[0], status=status.HTTP_201_CREATED)
+
+    @action(methods=['POST'], detail=False, url_path='clone', url_name='clone-many')
+    def clone_many(self, request):
+        """Copy the recipes with the given ids, returning the clones in the order of the ids"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))  # drop duplicates, keep the order
+        recipes = Recipe.objects.filter(user=request.user).in_bulk(ids)
+        missing = [recipe_id for recipe_id in ids if recipe_id not in recipes]
+        if missing:
+            raise ValidationError({'ids': [f'Recipes {missing} do not exist']})
+
+        clones = clone_recipes([recipes[recipe_id] for recipe_id in ids])
+        return Response(self._cloned_response(clones), status=status.HTTP_201_CREATED)
+
+    @action(methods=['GET', 'POST'], detail=False, throttle_scope='read')
+    def batch(self, request):
+        """
+        Retrieve the recipes with the ids in ?ids=1,5,9 or the posted ids list in their order, with a fixed number of
+        queries. Ids not found are reported as missing instead of failing the whole batch.
+        """
+        if request.method == 'GET':
+            try:
+                data = {'ids': self._params_to_ints(request.query_params.get('ids', ''))}
+            except ValueError:
+                raise ValidationError({'ids': 'ids must be a comma separated list of recipe ids'})
+        else:
+            data = request.data
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))  # drop duplicates, keep the order
+        recipes = self.get_queryset().in_bulk(ids)
+        found = [recipes[recipe_id] for recipe_id in ids if recipe_id in recipes]
+        return Response({
+            'results': serializers.RecipeDetailSerializer(found, many=True, context=self.get_serializer_context()).data,
+            'missing': [recipe_id for recipe_id in ids if recipe_id not in recipes],
+        })
+
+    @action(methods=['POST'], detail=True, url_path='upload-image', throttle_scope='upload')
     def upload_image(self, request, pk=None):
         """Upload an image to an recipe"""
         recipe = self.get_object()
+        previous_image = recipe.image.name
         serializer = self.get_serializer(recipe, data=request.data)
 
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
+                if previous_image != recipe.image.name:
+                    recipe.bump_version(refresh=False)  # the response does not show the version
+                    transaction.on_commit(lambda: Recipe.release_images([previous_image]))
             return Response(
                 serializer.data,
                 status=status.HTTP_200_OK
@@ -103,3 +323,107 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer.errors,
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    def _get_upload(self, upload_id, lock=False):
+        """Return an upload of the requested recipe, with lock locked until the end of the transaction"""
+        recipe = self.get_object()
+        queryset = ImageUpload.objects.select_for_update() if lock else ImageUpload.objects
+        try:
+            return queryset.select_related('recipe').get(id=uuid.UUID(upload_id), recipe=recipe)
+        except (ValueError, ImageUpload.DoesNotExist):
+            raise NotFound('Upload not found')
+
+    @action(methods=['POST'], detail=True, url_path='uploads', throttle_scope='upload')
+    def start_upload(self, request, pk=None):
+        """Start a resumable image upload of ?size bytes, sent in chunks to the returned upload"""
+        recipe = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.save(user=request.user, recipe=recipe)
+        uploads.create_partial_file(upload)
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers={'Upload-Offset': '0'})
+
+    @action(methods=['GET', 'PATCH'], detail=True, url_path=r'uploads/(?P<upload_id>[^/.]+)')
+    def upload_chunk(self, request, pk=None, upload_id=None):
+        """
+        GET returns the offset to resume from. PATCH appends the raw request body at the Upload-Offset header,
+        streaming it to disk as it arrives, and answers 409 if the offset is not where the upload stands.
+        """
+        try:
+            offset = int(request.META['HTTP_UPLOAD_OFFSET']) if request.method == 'PATCH' else None
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            raise ValidationError('Chunks need an Upload-Offset header and a Content-Length')
+
+        upload = self._get_upload(upload_id)
+        try:
+            # the body is read straight from the request stream, request.data would buffer it first
+            if offset is not None and not uploads.append_chunk(upload, request.stream, offset, length):
+                return Response(self.get_serializer(upload).data, status=status.HTTP_409_CONFLICT,
+                                headers={'Upload-Offset': str(upload.offset)})
+        except uploads.InvalidImage:
+            uploads.discard(upload)
+            raise
+
+        return Response(self.get_serializer(upload).data, headers={'Upload-Offset': str(upload.offset)})
+
+    @action(methods=['POST'], detail=True, url_path=r'uploads/(?P<upload_id>[^/.]+)/finalize')
+    def finalize_upload(self, request, pk=None, upload_id=None):
+        """Turn a complete upload into the image of the recipe"""
+        upload = None
+        try:
+            with transaction.atomic():
+                upload = self._get_upload(upload_id, lock=True)
+                recipe = upload.recipe
+                previous_image = recipe.image.name
+                recipe.image = uploads.finalize(upload)
+                recipe.save(update_fields=['image'])
+                if previous_image != recipe.image.name:
+                    recipe.bump_version(refresh=False)
+                    transaction.on_commit(lambda: Recipe.release_images([previous_image]))
+        except uploads.InvalidImage:
+            uploads.discard(upload)
+            raise
+
+        return Response(self.get_serializer(recipe).data)
+
+
+class SyncView(APIView):
+    """Delta sync of the recipes, tags and ingredients of the user changed since ?since=<cursor>"""
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    default_limit = 500
+    max_limit = 1000
+
+    def get(self, request):
+        """Return the changed objects and tombstones in sequence order, the cursor of the last one and has_more"""
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ValidationError('since and limit must be integers')
+
+        limit = min(max(limit, 1), self.max_limit)
+        return Response(changes_since(request.user, since, limit, context={'request': request}))
+
+
+class EventStreamView(APIView):
+    """Server-sent events notifying the user of changes to their recipes, tags and ingredients"""
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    renderer_classes = (EventStreamRenderer, JSONRenderer)
+
+    def get(self, request):
+        """Stream change events, replaying the ones missed since the Last-Event-ID header of a reconnecting client"""
+        header = request.META.get('HTTP_LAST_EVENT_ID')
+        try:
+            last_event_id = int(header) if header else None
+        except ValueError:
+            raise ValidationError('Last-Event-ID must be the id of an event sent by this stream')
+
+        response = StreamingHttpResponse(event_stream(request.user.id, last_event_id),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # keeps nginx from buffering the events
+        return response
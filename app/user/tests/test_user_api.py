@@ -2,8 +2,9 @@ from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
-from rest_framework.test import APIClient
+from core.testing import QueryCountingAPIClient
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
@@ -18,7 +19,7 @@ class PublicUserApiTests(TestCase):
     """Test the public users API (public = available without auth)"""
 
     def setUp(self):
-        self.client = APIClient()
+        self.client = QueryCountingAPIClient()
 
     def test_create_valid_user_success(self):
         """Test creating user with valid payload is successful"""
@@ -114,7 +115,7 @@ class PrivateUserApiTests(TestCase):
     """Test API request that require authentication"""
     def setUp(self):
         self.user = create_user(email='test@test.com', password='password123', name='first last')
-        self.client = APIClient()
+        self.client = QueryCountingAPIClient()
 
         # every request in tests will be made with self.user hardcoded
         self.client.force_authenticate(user=self.user)
@@ -140,3 +141,18 @@ class PrivateUserApiTests(TestCase):
         self.assertEqual(self.user.name, payload['name'])
         self.assertTrue(self.user.check_password(payload['password']))
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_delete_user(self):
+        """Test that deleting the account deactivates it right away and frees the email address"""
+        Token.objects.create(user=self.user)
+        res = self.client.delete(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(get_user_model().objects.filter(id=self.user.id).exists())
+        deleted = get_user_model().all_objects.get(id=self.user.id)
+        self.assertFalse(deleted.is_active)
+        self.assertFalse(Token.objects.filter(user=deleted).exists())
+
+        payload = {'email': 'test@test.com', 'password': 'password123', 'name': 'new account'}
+        res = QueryCountingAPIClient().post(CREATE_USER_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
@@ -1,4 +1,6 @@
+from django.db import transaction
 from rest_framework import generics, authentication, permissions
+from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
 
@@ -8,16 +10,19 @@ from user.serializers import UserSerielizer, AuthTokenSerializer
 class CreateUserView(generics.CreateAPIView):
     """Create new user in the system"""
     serializer_class = UserSerielizer
+    throttle_scope = 'token'
 
 
 class CreateTokenView(ObtainAuthToken):
     """Create new auth token for user"""
     serializer_class = AuthTokenSerializer
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES  # ObtainAuthToken turns throttling off
+    throttle_scope = 'token'
     # makes it possible to view endpoint via the browsable api, no need to use postman etc.
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     """Manage authenticated user"""
     serializer_class = UserSerielizer
     authentication_classes = (authentication.TokenAuthentication,)
@@ -26,3 +31,9 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
     def get_object(self):
         """Retrieve and return authenticated user"""
         return self.request.user
+
+    def perform_destroy(self, instance):
+        """Soft delete the account, its data is deleted in batches by purge_deleted instead of one long cascade"""
+        with transaction.atomic():
+            instance.soft_delete()
+            Token.objects.filter(user=instance).delete()